@@ -17,6 +17,8 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")
 # Импортируйте ВСЕ модели, которые должны отслеживаться
 from app.core.db import Base  # Base из вашего models/__init__.py или конкретной модели
 from app.models.metric import Metric  # noqa: F401 - импортируем для регистрации
+from app.models.series import Series  # noqa: F401
+from app.models.rollup import MetricRollup1m, MetricRollup5m, MetricRollup1h, RollupWatermark  # noqa: F401
 
 # --- Alembic Config ---
 config = context.config
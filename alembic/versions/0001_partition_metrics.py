@@ -0,0 +1,148 @@
+"""partition metrics table by timestamp
+
+Revision ID: 0001_partition_metrics
+Revises:
+Create Date: 2026-10-16 12:00:00.000000
+
+Переводит metrics на декларативное RANGE-секционирование по timestamp.
+Существующая (несекционированная) таблица переименовывается, данные
+копируются в секции, покрывающие их диапазон, старая таблица удаляется.
+Дальнейшее создание/удаление секций - app.core.partitions.
+"""
+import os
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = '0001_partition_metrics'
+down_revision: Union[str, Sequence[str], None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Должны совпадать с app.core.partitions
+PARTITION_INTERVAL = os.getenv("METRICS_PARTITION_INTERVAL", "day").lower()
+PARTITION_PREMAKE = int(os.getenv("METRICS_PARTITION_PREMAKE", "3"))
+
+_INTERVALS = {
+    "day": ("day", "1 day", "YYYYMMDD"),
+    "hour": ("hour", "1 hour", "YYYYMMDDHH24"),
+}
+
+INDEXES = {
+    "ix_metrics_tags": "USING gin (tags jsonb_path_ops)",
+    "ix_metrics_timestamp": "USING btree (timestamp)",
+    "ix_metrics_service_metric_ts": "USING btree (service_name, metric_name, timestamp)",
+    "ix_metrics_service_name": "(service_name)",
+    "ix_metrics_metric_name": "(metric_name)",
+}
+
+
+def _rename_existing(old_suffix: str) -> None:
+    """Переименовывает metrics и её индексы, освобождая имена."""
+    op.execute(f"ALTER TABLE metrics RENAME TO metrics_{old_suffix}")
+    op.execute(f"ALTER INDEX IF EXISTS metrics_pkey RENAME TO metrics_{old_suffix}_pkey")
+    op.execute(f"ALTER INDEX IF EXISTS ix_metrics_id RENAME TO ix_metrics_{old_suffix}_id")
+    for name in INDEXES:
+        op.execute(f"ALTER INDEX IF EXISTS {name} RENAME TO {name.replace('ix_metrics', f'ix_metrics_{old_suffix}')}")
+
+
+def _create_indexes() -> None:
+    for name, definition in INDEXES.items():
+        op.execute(f"CREATE INDEX {name} ON metrics {definition}")
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    trunc, step, fmt = _INTERVALS[PARTITION_INTERVAL]
+    bind = op.get_bind()
+
+    relkind = bind.execute(sa.text("SELECT relkind FROM pg_class WHERE oid = to_regclass('public.metrics')")).scalar()
+    if relkind == "p":
+        # Таблица уже создана секционированной (init_db по текущей модели)
+        return
+
+    has_table = relkind is not None
+    if has_table:
+        _rename_existing("unpartitioned")
+
+    op.execute("CREATE SEQUENCE IF NOT EXISTS metrics_id_seq")
+    op.execute("""
+        CREATE TABLE metrics (
+            id integer NOT NULL DEFAULT nextval('metrics_id_seq'),
+            service_name varchar,
+            metric_name varchar,
+            value double precision NOT NULL,
+            tags jsonb,
+            timestamp timestamptz NOT NULL DEFAULT now(),
+            CONSTRAINT metrics_pkey PRIMARY KEY (id, timestamp)
+        ) PARTITION BY RANGE (timestamp)
+    """)
+    # Последовательность переходит к новой таблице (иначе удалится вместе со старой)
+    op.execute("ALTER SEQUENCE metrics_id_seq OWNED BY metrics.id")
+    _create_indexes()
+
+    # Секции от самых старых данных до PARTITION_PREMAKE интервалов вперёд (UTC)
+    since = "now()"
+    if has_table:
+        since = "COALESCE((SELECT min(timestamp) FROM metrics_unpartitioned), now())"
+    op.execute(f"""
+        DO $$
+        DECLARE
+            part_start timestamptz;
+        BEGIN
+            FOR part_start IN
+                SELECT generate_series(
+                    date_trunc('{trunc}', {since}, 'UTC'),
+                    date_trunc('{trunc}', now(), 'UTC') + interval '{step}' * {PARTITION_PREMAKE},
+                    interval '{step}'
+                )
+            LOOP
+                EXECUTE format(
+                    'CREATE TABLE IF NOT EXISTS %I PARTITION OF metrics FOR VALUES FROM (%L) TO (%L)',
+                    'metrics_p' || to_char(part_start AT TIME ZONE 'UTC', '{fmt}'),
+                    part_start,
+                    part_start + interval '{step}'
+                );
+            END LOOP;
+        END $$;
+    """)
+
+    if has_table:
+        op.execute("""
+            INSERT INTO metrics (id, service_name, metric_name, value, tags, timestamp)
+            SELECT id, service_name, metric_name, value, tags, COALESCE(timestamp, now())
+            FROM metrics_unpartitioned
+        """)
+        op.execute("SELECT setval('metrics_id_seq', COALESCE((SELECT max(id) FROM metrics), 0) + 1, false)")
+        op.execute("DROP TABLE metrics_unpartitioned")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    _rename_existing("partitioned")
+
+    op.execute("""
+        CREATE TABLE metrics (
+            id integer NOT NULL DEFAULT nextval('metrics_id_seq'),
+            service_name varchar,
+            metric_name varchar,
+            value double precision NOT NULL,
+            tags jsonb,
+            timestamp timestamptz DEFAULT now(),
+            CONSTRAINT metrics_pkey PRIMARY KEY (id)
+        )
+    """)
+    op.execute("ALTER SEQUENCE metrics_id_seq OWNED BY metrics.id")
+    op.execute("CREATE INDEX ix_metrics_id ON metrics (id)")
+    _create_indexes()
+
+    op.execute("""
+        INSERT INTO metrics (id, service_name, metric_name, value, tags, timestamp)
+        SELECT id, service_name, metric_name, value, tags, timestamp
+        FROM metrics_partitioned
+    """)
+    # Удаляет и все секции
+    op.execute("DROP TABLE metrics_partitioned")
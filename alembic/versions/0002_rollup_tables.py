@@ -0,0 +1,57 @@
+"""rollup tables 1m / 5m / 1h
+
+Revision ID: 0002_rollup_tables
+Revises: 0001_partition_metrics
+Create Date: 2026-10-16 13:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = '0002_rollup_tables'
+down_revision: Union[str, Sequence[str], None] = '0001_partition_metrics'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+LEVELS = ("1m", "5m", "1h")
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    for level in LEVELS:
+        table = f"metrics_rollup_{level}"
+        op.create_table(
+            table,
+            sa.Column("service_name", sa.String(), nullable=False),
+            sa.Column("metric_name", sa.String(), nullable=False),
+            sa.Column("tags", postgresql.JSONB(), nullable=False),
+            sa.Column("bucket", sa.DateTime(timezone=True), nullable=False),
+            sa.Column("count", sa.BigInteger(), nullable=False),
+            sa.Column("sum", sa.Float(), nullable=False),
+            sa.Column("min", sa.Float(), nullable=False),
+            sa.Column("max", sa.Float(), nullable=False),
+            sa.Column("sketch", sa.LargeBinary(), nullable=False),
+            sa.PrimaryKeyConstraint("service_name", "metric_name", "tags", "bucket"),
+            if_not_exists=True,
+        )
+        op.create_index(f"ix_{table}_series_bucket", table, ["service_name", "metric_name", "bucket"], if_not_exists=True)
+        op.create_index(f"ix_{table}_bucket", table, ["bucket"], if_not_exists=True)
+
+    op.create_table(
+        "metrics_rollup_watermarks",
+        sa.Column("level", sa.String(), nullable=False),
+        sa.Column("watermark", sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint("level"),
+        if_not_exists=True,
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("metrics_rollup_watermarks")
+    for level in LEVELS:
+        op.drop_table(f"metrics_rollup_{level}")
@@ -0,0 +1,151 @@
+"""series dictionary
+
+Revision ID: 0003_series_dictionary
+Revises: 0002_rollup_tables
+Create Date: 2026-10-16 14:00:00.000000
+
+Выносит (service_name, metric_name, tags) из metrics и rollup-таблиц
+в словарь series. В точках остаётся только series_id - стабильный хэш
+ключа серии (app.core.series.compute_series_id).
+"""
+import hashlib
+import json
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = '0003_series_dictionary'
+down_revision: Union[str, Sequence[str], None] = '0002_rollup_tables'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+ROLLUP_TABLES = ("metrics_rollup_1m", "metrics_rollup_5m", "metrics_rollup_1h")
+SERIES_TABLES = ("metrics",) + ROLLUP_TABLES
+
+OLD_METRIC_INDEXES = {
+    "ix_metrics_tags": "USING gin (tags jsonb_path_ops)",
+    "ix_metrics_service_metric_ts": "USING btree (service_name, metric_name, timestamp)",
+    "ix_metrics_service_name": "(service_name)",
+    "ix_metrics_metric_name": "(metric_name)",
+}
+
+_INSERT_CHUNK_SIZE = 5000
+
+
+# Замороженная копия app.core.series.series_key / compute_series_id на момент
+# этой ревизии: миграция не импортирует код приложения, и её результат не
+# меняется вместе с ним. Менять нельзя - id уже записаны в существующих базах.
+def _series_id(service_name: str, metric_name: str, tags) -> int:
+    key = [service_name, metric_name, sorted((tags or {}).items())]
+    canonical = json.dumps(key, separators=(",", ":"), ensure_ascii=False)
+    digest = hashlib.blake2b(canonical.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+def _has_column(bind, table: str, column: str) -> bool:
+    return bind.execute(sa.text("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = 'public' AND table_name = :table AND column_name = :column
+    """), {"table": table, "column": column}).scalar() is not None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    bind = op.get_bind()
+
+    op.create_table(
+        "series",
+        sa.Column("id", sa.BigInteger(), nullable=False),
+        sa.Column("service_name", sa.String(), nullable=False),
+        sa.Column("metric_name", sa.String(), nullable=False),
+        sa.Column("tags", postgresql.JSONB(), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.text("now()")),
+        sa.PrimaryKeyConstraint("id"),
+        if_not_exists=True,
+    )
+    op.create_index("ix_series_service_metric", "series", ["service_name", "metric_name"], if_not_exists=True)
+    op.execute("CREATE INDEX IF NOT EXISTS ix_series_tags ON series USING gin (tags jsonb_path_ops)")
+
+    tables = [t for t in SERIES_TABLES if _has_column(bind, t, "service_name")]
+    if not tables:
+        # Схема уже создана по текущим моделям (init_db)
+        return
+
+    # id серий считаются тем же хэшем, что и при приёме, поэтому вычисляются в Python
+    distinct = " UNION ".join(
+        f"SELECT DISTINCT service_name, metric_name, COALESCE(tags, '{{}}'::jsonb) AS tags FROM {t}"
+        for t in tables
+    )
+    rows = [
+        {"id": _series_id(r.service_name, r.metric_name, r.tags),
+         "service_name": r.service_name, "metric_name": r.metric_name, "tags": r.tags}
+        for r in bind.execute(sa.text(distinct))
+    ]
+    series = sa.table(
+        "series",
+        sa.column("id", sa.BigInteger()),
+        sa.column("service_name", sa.String()),
+        sa.column("metric_name", sa.String()),
+        sa.column("tags", postgresql.JSONB()),
+    )
+    for start in range(0, len(rows), _INSERT_CHUNK_SIZE):
+        stmt = postgresql.insert(series).values(rows[start:start + _INSERT_CHUNK_SIZE])
+        bind.execute(stmt.on_conflict_do_nothing(index_elements=["id"]))
+
+    for table in tables:
+        op.add_column(table, sa.Column("series_id", sa.BigInteger(), nullable=True))
+        op.execute(f"""
+            UPDATE {table} AS t SET series_id = s.id
+            FROM series AS s
+            WHERE s.service_name = t.service_name
+              AND s.metric_name = t.metric_name
+              AND s.tags = COALESCE(t.tags, '{{}}'::jsonb)
+        """)
+        op.alter_column(table, "series_id", nullable=False)
+
+        if table == "metrics":
+            for name in OLD_METRIC_INDEXES:
+                op.execute(f"DROP INDEX IF EXISTS {name}")
+            op.execute("CREATE INDEX IF NOT EXISTS ix_metrics_series_ts ON metrics USING btree (series_id, timestamp)")
+        else:
+            op.execute(f"DROP INDEX IF EXISTS ix_{table}_series_bucket")
+            op.execute(f"ALTER TABLE {table} DROP CONSTRAINT {table}_pkey")
+            op.execute(f"ALTER TABLE {table} ADD CONSTRAINT {table}_pkey PRIMARY KEY (series_id, bucket)")
+
+        for column in ("service_name", "metric_name", "tags"):
+            op.drop_column(table, column)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table in SERIES_TABLES:
+        op.add_column(table, sa.Column("service_name", sa.String(), nullable=True))
+        op.add_column(table, sa.Column("metric_name", sa.String(), nullable=True))
+        op.add_column(table, sa.Column("tags", postgresql.JSONB(), nullable=True))
+        op.execute(f"""
+            UPDATE {table} AS t
+            SET service_name = s.service_name, metric_name = s.metric_name, tags = s.tags
+            FROM series AS s
+            WHERE s.id = t.series_id
+        """)
+
+        if table == "metrics":
+            op.execute("DROP INDEX IF EXISTS ix_metrics_series_ts")
+            for name, definition in OLD_METRIC_INDEXES.items():
+                op.execute(f"CREATE INDEX {name} ON metrics {definition}")
+        else:
+            for column in ("service_name", "metric_name", "tags"):
+                op.alter_column(table, column, nullable=False)
+            op.execute(f"ALTER TABLE {table} DROP CONSTRAINT {table}_pkey")
+            op.execute(
+                f"ALTER TABLE {table} ADD CONSTRAINT {table}_pkey "
+                f"PRIMARY KEY (service_name, metric_name, tags, bucket)"
+            )
+            op.create_index(f"ix_{table}_series_bucket", table, ["service_name", "metric_name", "bucket"])
+
+        op.drop_column(table, "series_id")
+
+    op.drop_table("series")
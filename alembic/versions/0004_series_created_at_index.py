@@ -0,0 +1,28 @@
+"""series.created_at index for tag index refresh
+
+Revision ID: 0004_series_created_at_index
+Revises: 0003_series_dictionary
+Create Date: 2026-10-16 15:00:00.000000
+
+Индекс тегов (app.core.tag_index) периодически догружает серии,
+созданные после прошлой загрузки, - выборка по created_at.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = '0004_series_created_at_index'
+down_revision: Union[str, Sequence[str], None] = '0003_series_dictionary'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index("ix_series_created_at", "series", ["created_at"], if_not_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_series_created_at", table_name="series")
@@ -0,0 +1,49 @@
+"""compressed metric blocks
+
+Revision ID: 0005_metric_blocks
+Revises: 0004_series_created_at_index
+Create Date: 2026-10-16 23:00:00.000000
+
+Холодные сырые точки переносятся из metrics в сжатые блоки
+(app.core.blocks): по строке на серию и закрытый диапазон времени.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '0005_metric_blocks'
+down_revision: Union[str, Sequence[str], None] = '0004_series_created_at_index'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+DATA_COLUMNS = ("ts_data", "value_data", "id_data")
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "metric_blocks",
+        sa.Column("series_id", sa.BigInteger(), nullable=False),
+        sa.Column("start_ts", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("end_ts", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("sample_count", sa.Integer(), nullable=False),
+        sa.Column("ts_data", sa.LargeBinary(), nullable=False),
+        sa.Column("value_data", sa.LargeBinary(), nullable=False),
+        sa.Column("id_data", sa.LargeBinary(), nullable=False),
+        sa.PrimaryKeyConstraint("series_id", "start_ts"),
+        if_not_exists=True,
+    )
+    op.create_index("ix_metric_blocks_series_end", "metric_blocks", ["series_id", "end_ts"], if_not_exists=True)
+    op.create_index("ix_metric_blocks_end", "metric_blocks", ["end_ts"], if_not_exists=True)
+    # Потоки уже сжаты - TOAST не тратит время на pglz
+    for column in DATA_COLUMNS:
+        op.execute(f"ALTER TABLE metric_blocks ALTER COLUMN {column} SET STORAGE EXTERNAL")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_metric_blocks_end", table_name="metric_blocks")
+    op.drop_index("ix_metric_blocks_series_end", table_name="metric_blocks")
+    op.drop_table("metric_blocks")
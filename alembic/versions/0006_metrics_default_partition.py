@@ -0,0 +1,39 @@
+"""default partition for metrics
+
+Revision ID: 0006_metrics_default_partition
+Revises: 0005_metric_blocks
+Create Date: 2026-10-17 10:00:00.000000
+
+Точки вне заранее созданных секций попадают в metrics_default, а не
+валят вставку. app.core.partitions переносит их в секцию диапазона,
+когда создаёт её, и чистит по сроку хранения.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '0006_metrics_default_partition'
+down_revision: Union[str, Sequence[str], None] = '0005_metric_blocks'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Должно совпадать с app.core.partitions
+DEFAULT_PARTITION = "metrics_default"
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    relkind = op.get_bind().execute(
+        sa.text("SELECT relkind FROM pg_class WHERE oid = to_regclass('public.metrics')")
+    ).scalar()
+    if relkind != "p":
+        return
+    op.execute(f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF metrics DEFAULT")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # Строки из default-секции без своей секции вставить некуда - они удаляются вместе с ней
+    op.execute(f"DROP TABLE IF EXISTS {DEFAULT_PARTITION}")
@@ -0,0 +1,20 @@
+from fastapi import APIRouter, Query
+from typing import Dict, List
+
+from app.core.cardinality import cardinality_guard
+
+router = APIRouter()
+
+
+@router.get("/", response_model=List[Dict])
+async def cardinality_report(
+        top: int = Query(20, ge=1, le=1000, description="Сколько метрик (и ключей тегов в каждой) вернуть")
+):
+    """
+    Метрики с наибольшим числом серий и их самые кардинальные ключи тегов.
+
+    Оценки - HyperLogLog по всем встреченным значениям (включая отсечённые),
+    admitted - сколько значений / серий пропущено как есть, limited - сколько
+    раз значение заменено на __other__ или тег убран. Данные текущего процесса.
+    """
+    return cardinality_guard.report(top)
@@ -1,38 +1,211 @@
-from fastapi import APIRouter, Depends, Query, HTTPException
-from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func, and_
-from sqlalchemy.dialects.postgresql import JSONB
-from app.core.db import get_session
-from app.models.metric import Metric
-from app.schemas.metric import MetricCreate, MetricRead, HistoryQuery
-from datetime import datetime, timedelta
-from typing import Optional, Dict, List
+from fastapi import APIRouter, Query, Header, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from app.schemas.metric import (
+    MetricCreate,
+    MetricRead,
+    HistoryQuery,
+    BatchIngestResult,
+    BatchItemError,
+    IngestAccepted,
+    RollupPoint,
+    DownsampledPoint,
+)
+from app.core.cardinality import cardinality_guard
+from app.core.ingest_buffer import ingest_buffer
+from app.core.stream_aggregator import stream_aggregator
+from app.exporters.prometheus_exporter import exporter
+from app.storage import storage
+from app.utils.downsampling import DOWNSAMPLE_DEFAULT_METHOD
+from app.utils.history_formats import (
+    HISTORY_MEDIA_TYPES,
+    DOWNSAMPLED_COLUMNS,
+    RAW_COLUMNS,
+    ROLLUP_COLUMNS,
+    arrow_available,
+    encode_json,
+    encode_rows,
+    negotiate_format,
+)
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Dict, List, Any, Union, AsyncGenerator
 import json
+import os
 
 router = APIRouter()
 
+# Максимальное количество точек в одном батче
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "50000"))
 
-@router.post("/", response_model=MetricRead, status_code=201)
+# Максимальный размер страницы при keyset-пагинации
+HISTORY_MAX_PAGE_SIZE = int(os.getenv("HISTORY_MAX_PAGE_SIZE", "100000"))
+# Верхняя граница max_points (точек на серию при прореживании)
+HISTORY_MAX_POINTS = int(os.getenv("HISTORY_MAX_POINTS", "10000"))
+
+NDJSON_CONTENT_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+
+
+@router.post(
+    "/",
+    response_model=Union[IngestAccepted, MetricRead],
+    status_code=202,
+    responses={
+        201: {"model": MetricRead, "description": "Метрика записана синхронно (INGEST_BUFFER_ENABLED=false)"},
+        429: {"description": "Буфер приёма переполнен, повторите позже"},
+        503: {"description": "Сервис останавливается"},
+    },
+)
 async def ingest_metric(
         metric: MetricCreate,
-        session: AsyncSession = Depends(get_session)
+        response: Response
 ):
-    """Приём метрики с тегами"""
-    db_metric = Metric(**metric.model_dump())
-    session.add(db_metric)
-    await session.commit()
-    await session.refresh(db_metric)
-    return db_metric
+    """
+    Приём метрики с тегами.
+
+    По умолчанию метрика ставится в write-behind буфер и пишется в хранилище
+    групповым коммитом (ответ 202). С INGEST_BUFFER_ENABLED=false -
+    синхронная запись с возвратом сохранённой строки (ответ 201).
+    """
+    # Теги сверх лимитов кардинальности схлопываются в __other__ или убираются
+    metric = cardinality_guard.apply(metric)
+
+    if ingest_buffer.enabled:
+        if not ingest_buffer.accepting:
+            raise HTTPException(status_code=503, detail="Ingest buffer is not accepting metrics")
+        if not await ingest_buffer.put(metric):
+            raise HTTPException(
+                status_code=429,
+                detail="Ingest buffer is full",
+                headers={"Retry-After": "1"}
+            )
+        stream_aggregator.observe_metric(metric)
+        exporter.observe_metric(metric)
+        return IngestAccepted(queue_depth=ingest_buffer.depth)
+
+    response.status_code = 201
+    metric_id, timestamp = await storage.write_one(metric)
+    stream_aggregator.observe_metric(metric)
+    exporter.observe_metric(metric)
+    return MetricRead(id=metric_id, timestamp=timestamp, **metric.model_dump())
 
 
-def build_tags_filter(query, model_class, tags_filter: dict):
-    """Динамически строит WHERE условия для фильтрации по тегам"""
-    for key, value in tags_filter.items():
-        query = query.where(model_class.tags[key].astext == value)
-    return query
+def _parse_batch_body(body: bytes, content_type: str) -> List[Any]:
+    """
+    Разбирает тело батча: JSON-массив или NDJSON (одна метрика на строку).
+    Строки NDJSON с битым JSON не валят батч - они вернутся как ошибки элементов.
+    """
+    if any(content_type.startswith(ct) for ct in NDJSON_CONTENT_TYPES):
+        items = []
+        for line in body.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                items.append(json.loads(line))
+            except json.JSONDecodeError as e:
+                items.append(e)
+        return items
 
+    try:
+        items = json.loads(body)
+    except json.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="Invalid JSON body")
+    if not isinstance(items, list):
+        raise HTTPException(status_code=400, detail="Batch body must be a JSON array")
+    return items
 
-@router.get("/history", response_model=list[MetricRead])
+
+@router.post(
+    "/batch",
+    response_model=BatchIngestResult,
+    status_code=201,
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {
+                    "schema": {"type": "array", "items": {"$ref": "#/components/schemas/MetricCreate"}}
+                },
+                "application/x-ndjson": {"schema": {"type": "string"}},
+            },
+        }
+    },
+)
+async def ingest_metrics_batch(request: Request):
+    """
+    Пакетный приём метрик (JSON-массив или NDJSON).
+
+    Каждый элемент валидируется отдельно: невалидные элементы попадают в `errors`
+    и не мешают записи остальных. Валидные пишутся одной записью в хранилище
+    (COPY в Postgres).
+    """
+    body = await request.body()
+    items = _parse_batch_body(body, request.headers.get("content-type", "application/json"))
+
+    if len(items) > MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch too large: {len(items)} items (max {MAX_BATCH_SIZE})"
+        )
+
+    valid: List[MetricCreate] = []
+    errors: List[BatchItemError] = []
+    for index, item in enumerate(items):
+        if isinstance(item, json.JSONDecodeError):
+            errors.append(BatchItemError(
+                index=index,
+                errors=[{"type": "json_invalid", "msg": str(item)}]
+            ))
+            continue
+        try:
+            valid.append(MetricCreate.model_validate(item))
+        except ValidationError as e:
+            errors.append(BatchItemError(
+                index=index,
+                errors=e.errors(include_url=False, include_context=False)
+            ))
+
+    valid = [cardinality_guard.apply(metric) for metric in valid]
+    accepted = await storage.write(valid)
+    stream_aggregator.observe_many(valid)
+    exporter.observe_many(valid)
+
+    return BatchIngestResult(
+        received=len(items),
+        accepted=accepted,
+        rejected=len(errors),
+        errors=errors,
+    )
+
+
+async def _single_batch(rows: List[Dict]) -> AsyncGenerator[List[Dict], None]:
+    yield rows
+
+
+def _json_page(records: List[Any], limit: Optional[int]) -> Response:
+    """JSON-страница сырых точек без моделей Pydantic; ключ следующей страницы - в заголовках."""
+    headers = {}
+    if limit is not None and len(records) == limit:
+        headers["X-Next-After-Ts"] = records[-1]["timestamp"].isoformat()
+        headers["X-Next-After-Id"] = str(records[-1]["id"])
+    return Response(
+        content=encode_json(records, RAW_COLUMNS),
+        media_type=HISTORY_MEDIA_TYPES["json"],
+        headers=headers,
+    )
+
+
+@router.get(
+    "/history",
+    response_model=Union[List[MetricRead], List[RollupPoint], List[DownsampledPoint]],
+    responses={
+        200: {
+            "content": {media_type: {} for fmt, media_type in HISTORY_MEDIA_TYPES.items() if fmt != "json"},
+            "description": "JSON по умолчанию; ndjson / csv / arrow отдаются потоком",
+        },
+        406: {"description": "Формат arrow недоступен (не установлен pyarrow)"},
+    },
+)
 async def get_history(
         service_name: str = Query(..., description="Имя сервиса"),
         metric_name: str = Query(..., description="Имя метрики"),
@@ -41,54 +214,109 @@ async def get_history(
             description="JSON-фильтр тегов: ?tags_filter={\"region\":\"eu-west\",\"env\":\"prod\"}"
         ),
         last_minutes: int = Query(60, ge=1, le=1440, description="Период в минутах"),
-        session: AsyncSession = Depends(get_session)
+        step: Optional[int] = Query(
+            None,
+            ge=1,
+            description="Шаг в секундах. Если задан и не мельче 60 с, ответ строится из "
+                        "самой грубой подходящей rollup-таблицы (1m/5m/1h) - по точке на шаг"
+        ),
+        max_points: Optional[int] = Query(
+            None,
+            ge=2,
+            le=HISTORY_MAX_POINTS,
+            description="Проредить сырые точки до стольких точек на серию (для графиков)"
+        ),
+        downsample: str = Query(
+            DOWNSAMPLE_DEFAULT_METHOD,
+            pattern="^(lttb|minmax|avg)$",
+            description="Метод прореживания для max_points: lttb, minmax (мин/макс на бакет) или avg"
+        ),
+        output_format: Optional[str] = Query(
+            None,
+            alias="format",
+            pattern="^(json|ndjson|csv|arrow)$",
+            description="Формат ответа; без параметра выбирается по заголовку Accept"
+        ),
+        after_ts: Optional[datetime] = Query(
+            None, description="Keyset-пагинация: timestamp последней точки предыдущей страницы"
+        ),
+        after_id: Optional[int] = Query(
+            None, description="Keyset-пагинация: id последней точки предыдущей страницы"
+        ),
+        limit: Optional[int] = Query(
+            None, ge=1, le=HISTORY_MAX_PAGE_SIZE, description="Размер страницы (сырые точки)"
+        ),
+        accept: Optional[str] = Header(None)
 ):
-    """Получение истории метрик с опциональной фильтрацией по тегам"""
-    since = datetime.utcnow() - timedelta(minutes=last_minutes)
+    """
+    Получение истории метрик с опциональной фильтрацией по тегам.
+
+    Форматы ndjson / csv / arrow (IPC stream) отдаются потоком (в Postgres -
+    через серверный курсор, память не зависит от размера выборки). Сырые точки
+    упорядочены по (timestamp, id); следующая страница - after_ts/after_id
+    последней точки (для json с limit они же приходят в заголовках
+    X-Next-After-Ts / X-Next-After-Id).
 
-    query = select(Metric).where(
-        Metric.service_name == service_name,
-        Metric.metric_name == metric_name,
-        Metric.timestamp >= since
-    ).order_by(Metric.timestamp)
+    max_points прореживает сырые точки до фиксированного числа точек на серию;
+    пагинация при этом не применяется. Всё чтение - через хранилище (storage).
+    """
+    now = datetime.now(timezone.utc)
+    since = now - timedelta(minutes=last_minutes)
 
-    # Фильтрация по тегам
+    fmt = negotiate_format(output_format, accept)
+    if fmt == "arrow" and not arrow_available():
+        raise HTTPException(status_code=406, detail="Arrow output requires pyarrow")
+    if after_id is not None and after_ts is None:
+        raise HTTPException(status_code=400, detail="after_id requires after_ts")
+
+    tags_dict = None
     if tags_filter:
         try:
             tags_dict = json.loads(tags_filter)
-            query = build_tags_filter(query, Metric, tags_dict)
         except json.JSONDecodeError:
             raise HTTPException(status_code=400, detail="Invalid tags_filter JSON")
 
-    result = await session.execute(query)
-    return result.scalars().all()
+    if step is not None:
+        points = await storage.step_history(service_name, metric_name, tags_dict, since, now, step)
+        if points is not None:
+            if fmt == "json":
+                return points
+            return StreamingResponse(
+                encode_rows(fmt, _single_batch(points), ROLLUP_COLUMNS),
+                media_type=HISTORY_MEDIA_TYPES[fmt]
+            )
+
+    if max_points is not None:
+        points = await storage.downsample(service_name, metric_name, tags_dict, since, now, max_points, downsample)
+        if fmt == "json":
+            return points
+        return StreamingResponse(
+            encode_rows(fmt, _single_batch(points), DOWNSAMPLED_COLUMNS),
+            media_type=HISTORY_MEDIA_TYPES[fmt]
+        )
+
+    if fmt != "json":
+        batches = storage.stream_history(service_name, metric_name, tags_dict, since, after_ts, after_id, limit)
+        return StreamingResponse(encode_rows(fmt, batches, RAW_COLUMNS), media_type=HISTORY_MEDIA_TYPES[fmt])
+
+    if after_ts is None and limit is None:
+        # Запрос дашборда без пагинации: тело целиком из кэша результатов, если он есть
+        body = await storage.cached_history_json(service_name, metric_name, tags_dict, since, now)
+        if body is not None:
+            return Response(content=body, media_type=HISTORY_MEDIA_TYPES["json"])
+
+    # Ответ сериализуется из записей без моделей Pydantic
+    records = await storage.history(service_name, metric_name, tags_dict, since, after_ts, after_id, limit)
+    return _json_page(records, limit)
 
 
 @router.get("/unique-tags", response_model=Dict[str, List[str]])
 async def get_unique_tags(
         service_name: Optional[str] = None,
         metric_name: Optional[str] = None,
-        session: AsyncSession = Depends(get_session)
+        key_prefix: str = Query("", description="Только ключи тегов с этим префиксом"),
+        value_prefix: str = Query("", description="Только значения тегов с этим префиксом"),
+        limit: Optional[int] = Query(None, ge=1, le=10000, description="Максимум значений на ключ")
 ):
     """Получение всех уникальных тегов и их значений для автокомплита"""
-    query = select(Metric.tags)
-
-    if service_name:
-        query = query.where(Metric.service_name == service_name)
-    if metric_name:
-        query = query.where(Metric.metric_name == metric_name)
-
-    result = await session.execute(query)
-    all_tags = result.scalars().all()
-
-    # Агрегируем уникальные ключи и значения
-    unique = {}
-    for tag_dict in all_tags:
-        if not tag_dict:
-            continue
-        for key, value in tag_dict.items():
-            if key not in unique:
-                unique[key] = set()
-            unique[key].add(value)
-
-    return {k: sorted(v) for k, v in unique.items()}
+    return await storage.unique_tags(service_name, metric_name, key_prefix, value_prefix, limit)
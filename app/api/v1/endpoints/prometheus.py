@@ -1,7 +1,11 @@
-from fastapi import APIRouter, Response, Depends
-from sqlalchemy.ext.asyncio import AsyncSession
-from app.core.db import get_session
-from app.exporters.prometheus_exporter import exporter
+from fastapi import APIRouter, Header, Response
+from typing import Optional
+from app.exporters.prometheus_exporter import (
+    exporter,
+    accepts_gzip,
+    negotiate_exposition,
+    EXPOSITION_CONTENT_TYPES,
+)
 from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
 import asyncio
 
@@ -10,7 +14,8 @@ router = APIRouter()
 
 @router.get("/metrics", response_class=Response)
 async def prometheus_metrics(
-        session: AsyncSession = Depends(get_session)
+        accept: Optional[str] = Header(None),
+        accept_encoding: Optional[str] = Header(None)
 ):
     """
     Экспорт метрик в формате Prometheus.
@@ -18,24 +23,27 @@ async def prometheus_metrics(
     Prometheus будет опрашивать этот эндпоинт для сбора метрик.
     Все теги автоматически конвертируются в лейблы.
     """
-    # Собираем метрики из БД
-    metrics_data = await exporter.collect_metrics(session, window_minutes=5)
+    # Готовое тело экспозиции текущего снимка (gzip - если клиент его принимает)
+    # Формат - по Accept: text 0.0.4, OpenMetrics или protobuf с нативными гистограммами
+    fmt = negotiate_exposition(accept)
+    use_gzip = accepts_gzip(accept_encoding)
+    body, _ = await exporter.render(window_minutes=5, gzip_encoding=use_gzip, fmt=fmt)
 
-    # Генерируем формат Prometheus
-    prometheus_output = exporter.generate_prometheus_metrics(metrics_data)
+    headers = {"Vary": "Accept, Accept-Encoding"}
+    if use_gzip:
+        headers["Content-Encoding"] = "gzip"
 
     return Response(
-        content=prometheus_output,
-        media_type=CONTENT_TYPE_LATEST
+        content=body,
+        media_type=EXPOSITION_CONTENT_TYPES[fmt],
+        headers=headers
     )
 
 
 @router.get("/metrics/debug")
-async def debug_metrics(
-        session: AsyncSession = Depends(get_session)
-):
+async def debug_metrics():
     """
     Отладочный эндпоинт - возвращает метрики в JSON формате
     """
-    metrics_data = await exporter.collect_metrics(session, window_minutes=5)
+    metrics_data = await exporter.collect_metrics(window_minutes=5)
     return metrics_data
@@ -2,16 +2,28 @@ from fastapi import APIRouter, WebSocket, Query
 from typing import Optional
 import json
 
-from app.core.broadcaster import manager
+from app.core.broadcaster import manager, WS_DROP_POLICY
+from app.utils.frame_codecs import SUBPROTOCOLS, available_encodings, choose_subprotocol
 
 router = APIRouter()
 
 
+def _is_str_dict(value) -> bool:
+    return isinstance(value, dict) and all(isinstance(k, str) and isinstance(v, str) for k, v in value.items())
+
+
+def _is_str_list(value) -> bool:
+    return isinstance(value, list) and all(isinstance(item, str) for item in value)
+
+
 @router.websocket("/live")
 async def websocket_endpoint(
         websocket: WebSocket,
         tags_filter: Optional[str] = Query(None),
-        group_by: Optional[str] = Query(None)
+        group_by: Optional[str] = Query(None),
+        drop_policy: str = Query(WS_DROP_POLICY, pattern="^(latest|drop_oldest)$"),
+        encoding: Optional[str] = Query(None, pattern="^(json|msgpack|cbor)$"),
+        delta: bool = Query(False)
 ):
     """
     WebSocket для получения агрегированных метрик в реальном времени.
@@ -19,6 +31,21 @@ async def websocket_endpoint(
     Параметры:
     - tags_filter: JSON фильтр, например: {"env":"prod","region":"eu-west"}
     - group_by: список тегов для группировки, например: ["region","version"]
+    - drop_policy: что делать, если клиент не успевает читать: latest (только
+      самый свежий тик) или drop_oldest (выбрасывать самые старые тики)
+    - encoding: пакетный режим - один кадр на тик со всеми агрегатами:
+      json (текстовый), msgpack или cbor (бинарные). То же можно согласовать
+      подпротоколом metrics.batch.json / metrics.batch.msgpack / metrics.batch.cbor.
+      Без него - по текстовому JSON-кадру на агрегат, как раньше.
+      permessage-deflate включается сервером, если клиент его предлагает.
+    - delta: дельта-режим (пакетный, по умолчанию json). Кадры:
+      {"type": "snapshot", "seq", "aggregates"} - полное состояние (при подключении,
+      после пропуска и каждые WS_DELTA_KEYFRAME_TICKS тиков);
+      {"type": "delta", "seq", "upserts", "removed"} - изменения к seq - 1.
+      Дельту с разрывом в seq клиент пропускает до следующего снимка.
+
+    Клиент получает агрегаты только своей подписки; без параметров -
+    по сервису и метрике, без фильтра.
     """
     subscription = {}
 
@@ -28,6 +55,9 @@ async def websocket_endpoint(
         except json.JSONDecodeError:
             await websocket.close(code=1003)  # Unsupported data
             return
+        if not _is_str_dict(subscription["filter"]):
+            await websocket.close(code=1003)
+            return
 
     if group_by:
         try:
@@ -35,8 +65,24 @@ async def websocket_endpoint(
         except json.JSONDecodeError:
             await websocket.close(code=1003)
             return
+        if not _is_str_list(subscription["group_by"]):
+            await websocket.close(code=1003)
+            return
+
+    subprotocol = choose_subprotocol(websocket.scope.get("subprotocols", []))
+    if subprotocol is not None:
+        subscription["encoding"] = SUBPROTOCOLS[subprotocol]
+    elif encoding is not None:
+        if encoding not in available_encodings():
+            await websocket.close(code=1003, reason=f"Encoding {encoding} is not available")
+            return
+        subscription["encoding"] = encoding
 
-    await manager.connect(websocket, subscription)
+    if delta:
+        subscription["delta"] = True
+        subscription.setdefault("encoding", "json")
+
+    await manager.connect(websocket, subscription, drop_policy, subprotocol)
 
     try:
         # Keep-alive: клиент может отправлять ping
@@ -46,3 +92,12 @@ async def websocket_endpoint(
                 await websocket.send_text("pong")
     except Exception:
         manager.disconnect(websocket)
+
+
+@router.get("/stats")
+async def websocket_stats():
+    """Состояние live-клиентов: подписка, очередь, отставание и счётчики отправленных/выброшенных сообщений."""
+    return {
+        "connections": manager.stats(),
+        "distinct_subscriptions": len(manager.groups),
+    }
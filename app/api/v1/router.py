@@ -1,5 +1,5 @@
 from fastapi import APIRouter
-from app.api.v1.endpoints import metrics, ws, prometheus
+from app.api.v1.endpoints import metrics, ws, prometheus, cardinality
 
 # Создаем главный роутер для версии API v1
 api_router = APIRouter()
@@ -21,6 +21,11 @@ api_router.include_router(
     prefix="/prometheus",
     tags=["prometheus"]
 )
+api_router.include_router(
+    cardinality.router,
+    prefix="/cardinality",
+    tags=["Cardinality"]
+)
 
 # Экспортируем список роутеров для подключения в main.py
 # Это позволяет легко добавлять новые версии API (v2, v3)
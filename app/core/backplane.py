@@ -0,0 +1,160 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from typing import Callable, Dict, List, Optional, Tuple
+
+import asyncpg
+
+from app.core.db import DATABASE_URL
+
+logger = logging.getLogger(__name__)
+
+# inprocess - один процесс (и тесты); postgres - несколько воркеров/реплик через LISTEN/NOTIFY
+BROADCAST_BACKPLANE = os.getenv("BROADCAST_BACKPLANE", "inprocess").lower()
+
+# Ключ advisory lock, которым выбирается лидер-агрегатор
+_LEADER_LOCK_KEY = 0x6C697665  # "live"
+# NOTIFY ограничивает payload 8000 байтами - большие сообщения режутся на части
+_NOTIFY_CHUNK_SIZE = 7000
+# Недособранное сообщение выбрасывается через столько секунд
+_REASSEMBLY_TIMEOUT_SECONDS = 30
+
+Handler = Callable[[str], None]
+
+
+class Backplane:
+    """
+    Шина между воркерами для live-рассылки: publish/subscribe по каналам
+    и выбор единственного лидера, который считает агрегаты.
+
+    Сообщения - строки; обработчики вызываются синхронно в event loop,
+    в том числе для сообщений, опубликованных самим процессом.
+    """
+
+    def __init__(self):
+        self.node_id = f"{os.uname().nodename}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._handlers: Dict[str, List[Handler]] = {}
+
+    def subscribe(self, channel: str, handler: Handler):
+        self._handlers.setdefault(channel, []).append(handler)
+
+    def _dispatch(self, channel: str, message: str):
+        for handler in self._handlers.get(channel, []):
+            try:
+                handler(message)
+            except Exception as e:
+                logger.warning(f"⚠️ Backplane handler error on {channel}: {e}")
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish(self, channel: str, message: str):
+        raise NotImplementedError
+
+    async def is_leader(self) -> bool:
+        """Этот процесс - лидер (проверяется каждый тик; лидерство может смениться)."""
+        raise NotImplementedError
+
+
+class InProcessBackplane(Backplane):
+    """Всё в одном процессе: публикация - прямой вызов обработчиков, процесс всегда лидер."""
+
+    async def publish(self, channel: str, message: str):
+        self._dispatch(channel, message)
+
+    async def is_leader(self) -> bool:
+        return True
+
+
+class PostgresBackplane(Backplane):
+    """
+    Postgres LISTEN/NOTIFY на выделенном соединении asyncpg (не из пула).
+
+    Лидер держит сессионный pg_try_advisory_lock на этом соединении: если
+    процесс умирает или соединение рвётся, блокировка освобождается и
+    лидером становится следующий воркер, попытавшийся её взять.
+    """
+
+    def __init__(self, dsn: str):
+        super().__init__()
+        self.dsn = dsn
+        self._conn: Optional[asyncpg.Connection] = None
+        self._leader = False
+        self._lock = asyncio.Lock()
+        # Сборка сообщений, порезанных на части: message_id -> (время первой части, части)
+        self._partial: Dict[str, Tuple[float, List[Optional[str]]]] = {}
+
+    async def _connection(self) -> asyncpg.Connection:
+        async with self._lock:
+            if self._conn is None or self._conn.is_closed():
+                if self._leader:
+                    logger.warning("👑 Backplane connection lost, leadership released")
+                self._leader = False
+                self._conn = await asyncpg.connect(self.dsn)
+                for channel in self._handlers:
+                    await self._conn.add_listener(channel, self._on_notify)
+                logger.info(f"📡 Postgres backplane listening on {sorted(self._handlers)}")
+            return self._conn
+
+    async def start(self):
+        await self._connection()
+
+    async def stop(self):
+        if self._conn is not None and not self._conn.is_closed():
+            await self._conn.close()
+        self._conn = None
+        self._leader = False
+
+    def _on_notify(self, connection, pid, channel: str, payload: str):
+        message_id, index, total, chunk = payload.split(":", 3)
+        total = int(total)
+        if total == 1:
+            self._dispatch(channel, chunk)
+            return
+
+        now = time.monotonic()
+        started, parts = self._partial.setdefault(message_id, (now, [None] * total))
+        parts[int(index)] = chunk
+        if all(part is not None for part in parts):
+            del self._partial[message_id]
+            self._dispatch(channel, "".join(parts))
+
+        for stale_id in [m for m, (t, _) in self._partial.items() if now - t > _REASSEMBLY_TIMEOUT_SECONDS]:
+            del self._partial[stale_id]
+
+    async def publish(self, channel: str, message: str):
+        """message должен быть ASCII (json.dumps с ensure_ascii): части режутся по символам."""
+        conn = await self._connection()
+        chunks = [message[i:i + _NOTIFY_CHUNK_SIZE] for i in range(0, len(message), _NOTIFY_CHUNK_SIZE)] or [""]
+        message_id = uuid.uuid4().hex[:12]
+        # Одна транзакция - части доставляются подряд и в порядке отправки
+        async with conn.transaction():
+            for index, chunk in enumerate(chunks):
+                await conn.execute(
+                    "SELECT pg_notify($1, $2)", channel, f"{message_id}:{index}:{len(chunks)}:{chunk}"
+                )
+
+    async def is_leader(self) -> bool:
+        conn = await self._connection()
+        if not self._leader:
+            self._leader = await conn.fetchval("SELECT pg_try_advisory_lock($1)", _LEADER_LOCK_KEY)
+            if self._leader:
+                logger.info(f"👑 {self.node_id} elected as live aggregation leader")
+        return self._leader
+
+
+def create_backplane(kind: str = BROADCAST_BACKPLANE) -> Backplane:
+    if kind == "postgres":
+        # asyncpg принимает обычный DSN без указания драйвера SQLAlchemy
+        return PostgresBackplane(DATABASE_URL.replace("postgresql+asyncpg://", "postgresql://", 1))
+    if kind == "inprocess":
+        return InProcessBackplane()
+    raise ValueError(f"Unknown BROADCAST_BACKPLANE: {kind}")
+
+
+backplane = create_backplane()
@@ -0,0 +1,166 @@
+import heapq
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.series import restrict_to_series
+from app.models.metric_block import MetricBlock
+from app.models.series import Series
+from app.utils.gorilla import decode_floats, decode_ints, encode_floats, encode_ints
+
+# Длина диапазона одного блока (кратна часу - границы совпадают с границами секций metrics)
+BLOCK_SECONDS = int(os.getenv("METRIC_BLOCK_SECONDS", "3600"))
+# Диапазон сжимается, когда его конец старше этого. Должно быть больше самых длинных
+# окон, читаемых из сырых точек (агрегаты, экспортер, backfill); увеличивать - только
+# вместе со сбросом блоков: читатели не ищут блоки моложе этого порога
+BLOCK_COMPACT_AFTER_SECONDS = int(os.getenv("METRIC_BLOCK_COMPACT_AFTER_SECONDS", "7200"))
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# Точка блока: (timestamp в микросекундах, id, value)
+Sample = Tuple[int, int, float]
+
+
+def to_micros(ts: datetime) -> int:
+    delta = ts - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds
+
+
+def from_micros(micros: int) -> datetime:
+    return _EPOCH + timedelta(microseconds=micros)
+
+
+def encode_block(samples: Sequence[Sample]) -> Dict[str, Any]:
+    """Колонки блока для точек одной серии, упорядоченных по (timestamp, id)."""
+    return {
+        "sample_count": len(samples),
+        "end_ts": from_micros(samples[-1][0]),
+        "ts_data": encode_ints([s[0] for s in samples]),
+        "id_data": encode_ints([s[1] for s in samples]),
+        "value_data": encode_floats([s[2] for s in samples]),
+    }
+
+
+def decode_block(block) -> List[Sample]:
+    count = block.sample_count
+    return list(zip(
+        decode_ints(block.ts_data, count),
+        decode_ints(block.id_data, count),
+        decode_floats(block.value_data, count),
+    ))
+
+
+def blocks_may_cover(since: datetime, now: Optional[datetime] = None) -> bool:
+    """Диапазон с since может задевать сжатые блоки (иначе они не читаются вовсе)."""
+    now = now or datetime.now(timezone.utc)
+    return since < now - timedelta(seconds=BLOCK_COMPACT_AFTER_SECONDS)
+
+
+def block_statement():
+    """Блоки вместе с описанием серии; фильтры по серии и времени добавляет вызывающий код."""
+    return select(
+        MetricBlock.series_id,
+        Series.service_name,
+        Series.metric_name,
+        Series.tags,
+        MetricBlock.sample_count,
+        MetricBlock.ts_data,
+        MetricBlock.value_data,
+        MetricBlock.id_data,
+    ).join(
+        Series, Series.id == MetricBlock.series_id
+    )
+
+
+def block_history_rows(
+        blocks: Iterable,
+        since: datetime,
+        after_ts: Optional[datetime] = None,
+        after_id: Optional[int] = None
+) -> List[Dict[str, Any]]:
+    """
+    Строки истории (колонки RAW_COLUMNS) из блоков в порядке (timestamp, id):
+    не раньше since и строго после keyset-ключа (after_ts, after_id).
+    """
+    since_us = to_micros(since)
+    after_us = to_micros(after_ts) if after_ts is not None else None
+
+    rows = []
+    for block in blocks:
+        for ts_us, point_id, value in decode_block(block):
+            if ts_us < since_us:
+                continue
+            if after_us is not None and (ts_us < after_us or ts_us == after_us and (
+                    after_id is None or point_id <= after_id)):
+                continue
+            rows.append({
+                "id": point_id,
+                "service_name": block.service_name,
+                "metric_name": block.metric_name,
+                "value": value,
+                "tags": block.tags,
+                "timestamp": from_micros(ts_us),
+            })
+    rows.sort(key=lambda row: (row["timestamp"], row["id"]))
+    return rows
+
+
+def merge_history(
+        block_rows: Sequence[Mapping[str, Any]],
+        heap_rows: Sequence[Mapping[str, Any]],
+        limit: Optional[int] = None
+) -> List[Mapping[str, Any]]:
+    """Слияние двух упорядоченных по (timestamp, id) выборок с общим limit."""
+    if not block_rows:
+        return list(heap_rows)
+    merged = list(heapq.merge(block_rows, heap_rows, key=lambda row: (row["timestamp"], row["id"])))
+    return merged[:limit] if limit is not None else merged
+
+
+async def load_block_history(
+        session: AsyncSession,
+        service_name: Optional[str],
+        metric_name: Optional[str],
+        tags_filter: Optional[Dict[str, str]],
+        since: datetime,
+        after_ts: Optional[datetime] = None,
+        after_id: Optional[int] = None
+) -> List[Dict[str, Any]]:
+    """Строки истории из сжатых блоков через сессию (фильтры - как у сырых точек)."""
+    if not blocks_may_cover(since):
+        return []
+    query = block_statement().where(MetricBlock.end_ts >= since)
+    query = await restrict_to_series(
+        session, query, MetricBlock.series_id, service_name, metric_name, tags_filter, joined=True
+    )
+    result = await session.execute(query)
+    return block_history_rows(result, since, after_ts, after_id)
+
+
+async def load_block_samples(
+        session: AsyncSession,
+        since: datetime,
+        until: datetime,
+        service_name: Optional[str] = None,
+        metric_name: Optional[str] = None,
+        tags_filter: Optional[Dict[str, str]] = None
+) -> Dict[int, List[Sample]]:
+    """Точки [since, until) из блоков по сериям - для расчётов в Python поверх холодных данных."""
+    if not blocks_may_cover(since):
+        return {}
+    query = select(MetricBlock).where(MetricBlock.end_ts >= since, MetricBlock.start_ts < until)
+    query = await restrict_to_series(session, query, MetricBlock.series_id, service_name, metric_name, tags_filter)
+    since_us, until_us = to_micros(since), to_micros(until)
+
+    samples: Dict[int, List[Sample]] = {}
+    result = await session.execute(query)
+    for block in result.scalars():
+        points = [s for s in decode_block(block) if since_us <= s[0] < until_us]
+        if points:
+            samples.setdefault(block.series_id, []).extend(points)
+    for points in samples.values():
+        points.sort()
+    return samples
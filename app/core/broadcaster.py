@@ -1,63 +1,556 @@
 import logging
 import asyncio
+import itertools
+import json
+import os
+import time
+from collections import deque
 from fastapi import WebSocket
-from typing import Set, Dict, Optional
-from app.utils.aggregators import aggregate_last_window
+from prometheus_client import Counter, Gauge, Histogram
+from typing import Callable, Set, Dict, Deque, Iterable, List, Optional, Tuple
+from app.core.backplane import backplane, BROADCAST_BACKPLANE
+from app.core.stream_aggregator import stream_aggregator
 from app.schemas.metric import AggregatedMetric
+from app.storage import storage
+from app.utils.frame_codecs import Frame, encode_frame
 
 logger = logging.getLogger(__name__)
 
+# Окно агрегации и период рассылки live-агрегатов
+WS_AGGREGATION_WINDOW_SECONDS = int(os.getenv("WS_AGGREGATION_WINDOW_SECONDS", "30"))
+WS_TICK_SECONDS = float(os.getenv("WS_TICK_SECONDS", "5"))
+
+# Исходящая очередь клиента (в тиках) и политика при её переполнении:
+# - latest: держать только самый свежий тик (старые неотправленные заменяются)
+# - drop_oldest: выбрасывать самый старый тик из полной очереди
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "8"))
+WS_DROP_POLICY = os.getenv("WS_DROP_POLICY", "latest").lower()
+# Одна отправка дольше этого - клиент отключается
+WS_SEND_TIMEOUT_SECONDS = float(os.getenv("WS_SEND_TIMEOUT_SECONDS", "10"))
+# Клиент, отстающий дольше этого (неотправленные данные), отключается
+WS_EVICT_LAG_SECONDS = float(os.getenv("WS_EVICT_LAG_SECONDS", "30"))
+# Дельта-режим: полный снимок (keyframe) каждые N тиков для ресинхронизации
+WS_DELTA_KEYFRAME_TICKS = int(os.getenv("WS_DELTA_KEYFRAME_TICKS", "12"))
+
+# Источник live-агрегатов у лидера:
+# - memory: StreamAggregator (видит только приём своего процесса - для одного воркера)
+# - db: агрегаты хранилища (все воркеры; запросы делает только лидер)
+LIVE_AGGREGATION_SOURCE = os.getenv(
+    "LIVE_AGGREGATION_SOURCE", "db" if BROADCAST_BACKPLANE == "postgres" else "memory"
+).lower()
+
+# Каналы backplane: анонсы подписок воркеров и готовые агрегаты тика
+SUBSCRIPTIONS_CHANNEL = "metrics_live_subscriptions"
+TICKS_CHANNEL = "metrics_live_ticks"
+# Анонс подписок воркера считается устаревшим через столько тиков
+_ANNOUNCE_TTL_TICKS = 3
+
+# Код закрытия для отключённых медленных клиентов ("Try Again Later")
+_EVICT_CLOSE_CODE = 1013
+
+# --- Внутренние метрики рассылки (видны на /metrics/internal) ---
+WS_CONNECTIONS = Gauge(
+    "ws_connections",
+    "Number of connected live WebSocket clients",
+)
+WS_SUBSCRIPTIONS = Gauge(
+    "ws_distinct_subscriptions",
+    "Number of distinct live subscription signatures",
+)
+WS_SENT_MESSAGES = Counter(
+    "ws_sent_messages_total",
+    "Messages written to live WebSocket clients",
+)
+WS_DROPPED_MESSAGES = Counter(
+    "ws_dropped_messages_total",
+    "Messages dropped for slow live WebSocket clients",
+    ["policy"],
+)
+WS_EVICTED = Counter(
+    "ws_evicted_connections_total",
+    "Live WebSocket clients disconnected for lagging or send timeouts",
+)
+WS_QUEUE_WAIT = Histogram(
+    "ws_queue_wait_seconds",
+    "Time a tick waited in a client's outbound queue before being written",
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30),
+)
+
+# Сигнатура подписки: (отсортированные пары фильтра, отсортированные ключи group_by).
+# Подписчики с одинаковой сигнатурой получают одни и те же сообщения
+Signature = Tuple[Tuple[Tuple[str, str], ...], Tuple[str, ...]]
+# Ключ группы агрегата: (service_name, metric_name, отсортированные пары тегов)
+GroupKey = Tuple[str, str, Tuple[Tuple[str, str], ...]]
+
+_connection_ids = itertools.count(1)
+
+
+def subscription_signature(subscription: Dict) -> Signature:
+    filter_tags = subscription.get("filter") or {}
+    group_by = subscription.get("group_by") or []
+    return tuple(sorted(filter_tags.items())), tuple(sorted(set(group_by)))
+
+
+class ClientConnection:
+    """
+    Клиент live-потока: ограниченная исходящая очередь и собственная задача-писатель.
+
+    Рассылка только кладёт сообщения тика в очередь (без await), поэтому
+    медленный клиент не задерживает остальных и следующий тик.
+    """
+
+    def __init__(
+            self,
+            websocket: WebSocket,
+            subscription: Dict,
+            drop_policy: str = WS_DROP_POLICY,
+            queue_size: int = WS_SEND_QUEUE_SIZE
+    ):
+        self.id = next(_connection_ids)
+        self.websocket = websocket
+        self.subscription = subscription
+        self.signature = subscription_signature(subscription)
+        self.drop_policy = drop_policy
+        self.queue_size = max(queue_size, 1)
+        # Кодировка пакетного режима (один кадр на тик); None - JSON-кадр на каждый агрегат
+        self.encoding: Optional[str] = subscription.get("encoding")
+        # Дельта-режим: клиенту нужен снимок перед первой дельтой и после любого пропуска
+        self.delta = bool(subscription.get("delta"))
+        self.needs_keyframe = self.delta
+        # Элементы очереди: (время постановки, кадры одного тика)
+        self.queue: Deque[Tuple[float, List[Frame]]] = deque()
+        self.connected_at = time.time()
+        self.sent_messages = 0
+        self.dropped_messages = 0
+        self._sending_since: Optional[float] = None
+        self._ready = asyncio.Event()
+        self.writer: Optional[asyncio.Task] = None
+
+    @property
+    def lag_seconds(self) -> float:
+        """Насколько клиент отстаёт: возраст самого старого неотправленного тика или текущей отправки."""
+        now = time.monotonic()
+        lag = now - self.queue[0][0] if self.queue else 0.0
+        if self._sending_since is not None:
+            lag = max(lag, now - self._sending_since)
+        return lag
+
+    def _drop(self, messages: List[Frame]):
+        self.dropped_messages += len(messages)
+        WS_DROPPED_MESSAGES.labels(policy=self.drop_policy).inc(len(messages))
+
+    def enqueue(self, messages: List[Frame]):
+        if self.drop_policy == "latest":
+            while self.queue:
+                self._drop(self.queue.popleft()[1])
+        elif len(self.queue) >= self.queue_size:
+            self._drop(self.queue.popleft()[1])
+
+        self.queue.append((time.monotonic(), messages))
+        self._ready.set()
+
+    def would_drop(self) -> bool:
+        """Выбросит ли следующий enqueue что-то из очереди."""
+        if self.drop_policy == "latest":
+            return bool(self.queue)
+        return len(self.queue) >= self.queue_size
+
+    def resync(self, messages: List[Frame]):
+        """Заменяет всю очередь снимком: после пропуска дельты старые дельты бесполезны."""
+        while self.queue:
+            self._drop(self.queue.popleft()[1])
+        self.enqueue(messages)
+        self.needs_keyframe = False
+
+    async def run_writer(self):
+        """Пишет тики из очереди в сокет по порядку."""
+        while True:
+            if not self.queue:
+                self._ready.clear()
+                await self._ready.wait()
+                continue
+
+            enqueued_at, messages = self.queue.popleft()
+            self._sending_since = enqueued_at
+            WS_QUEUE_WAIT.observe(time.monotonic() - enqueued_at)
+            for message in messages:
+                if isinstance(message, bytes):
+                    send = self.websocket.send_bytes(message)
+                else:
+                    send = self.websocket.send_text(message)
+                await asyncio.wait_for(send, WS_SEND_TIMEOUT_SECONDS)
+            self._sending_since = None
+            self.sent_messages += len(messages)
+            WS_SENT_MESSAGES.inc(len(messages))
+
+    def stats(self) -> Dict:
+        client = self.websocket.client
+        return {
+            "id": self.id,
+            "client": f"{client.host}:{client.port}" if client else None,
+            "subscription": self.subscription,
+            "drop_policy": self.drop_policy,
+            "encoding": self.encoding,
+            "delta": self.delta,
+            "connected_at": self.connected_at,
+            "queued_ticks": len(self.queue),
+            "lag_seconds": round(self.lag_seconds, 3),
+            "sent_messages": self.sent_messages,
+            "dropped_messages": self.dropped_messages,
+        }
+
 
 class ConnectionManager:
     def __init__(self):
         self.active_connections: Set[WebSocket] = set()
         # Подписки: какой клиент какие теги слушает
         self.subscriptions: Dict[WebSocket, Dict] = {}
+        self.clients: Dict[WebSocket, ClientConnection] = {}
+        # Клиенты, сгруппированные по сигнатуре подписки
+        self.groups: Dict[Signature, Set[ClientConnection]] = {}
+        # Задачи закрытия отключённых клиентов (держим ссылки до завершения)
+        self._closing: Set[asyncio.Task] = set()
 
-    async def connect(self, websocket: WebSocket, subscription: Dict = None):
-        await websocket.accept()
+    async def connect(
+            self,
+            websocket: WebSocket,
+            subscription: Dict = None,
+            drop_policy: str = WS_DROP_POLICY,
+            subprotocol: Optional[str] = None
+    ):
+        await websocket.accept(subprotocol=subprotocol)
+        client = ClientConnection(websocket, subscription or {}, drop_policy)
         self.active_connections.add(websocket)
-        self.subscriptions[websocket] = subscription or {}
-        logger.info(f"🔌 WebSocket connected. Total: {len(self.active_connections)}")
+        self.subscriptions[websocket] = client.subscription
+        self.clients[websocket] = client
+        self.groups.setdefault(client.signature, set()).add(client)
+        client.writer = asyncio.create_task(self._writer(client))
+        self._update_gauges()
+        logger.info(
+            f"🔌 WebSocket connected. Total: {len(self.active_connections)}, "
+            f"distinct subscriptions: {len(self.groups)}"
+        )
+
+    async def _writer(self, client: ClientConnection):
+        try:
+            await client.run_writer()
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            logger.warning(f"🐢 WebSocket #{client.id} send timed out, disconnecting")
+            WS_EVICTED.inc()
+            self._close(client, _EVICT_CLOSE_CODE)
+        except Exception:
+            self.disconnect(client.websocket)
 
     def disconnect(self, websocket: WebSocket):
+        client = self.clients.pop(websocket, None)
+        if client is None:
+            return
         self.active_connections.discard(websocket)
         self.subscriptions.pop(websocket, None)
+        group = self.groups.get(client.signature)
+        if group is not None:
+            group.discard(client)
+            if not group:
+                del self.groups[client.signature]
+        if client.writer is not None and client.writer is not asyncio.current_task():
+            client.writer.cancel()
+        self._update_gauges()
         logger.info(f"🔌 WebSocket disconnected. Total: {len(self.active_connections)}")
 
+    def _close(self, client: ClientConnection, code: int):
+        """Отключает клиента и закрывает сокет в фоне (закрытие тоже может зависнуть)."""
+        self.disconnect(client.websocket)
+
+        async def close():
+            try:
+                await asyncio.wait_for(client.websocket.close(code=code), WS_SEND_TIMEOUT_SECONDS)
+            except Exception:
+                pass
+
+        task = asyncio.create_task(close())
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    def publish(
+            self,
+            clients: Iterable[ClientConnection],
+            messages: List[Frame],
+            keyframe: Optional[Callable[[], List[Frame]]] = None
+    ):
+        """
+        Ставит уже сериализованные сообщения в очереди клиентов, не дожидаясь отправки.
+        Клиенты, отстающие дольше WS_EVICT_LAG_SECONDS, отключаются.
+
+        keyframe - снимок для дельта-клиентов: получают его вместо дельты новые
+        клиенты и те, у кого иначе пришлось бы выбросить неотправленную дельту.
+        """
+        for client in list(clients):
+            if client.lag_seconds > WS_EVICT_LAG_SECONDS:
+                logger.warning(f"🐢 WebSocket #{client.id} lagging {client.lag_seconds:.1f}s, disconnecting")
+                WS_EVICTED.inc()
+                self._close(client, _EVICT_CLOSE_CODE)
+                continue
+            if keyframe is not None and (client.needs_keyframe or client.would_drop()):
+                client.resync(keyframe())
+            else:
+                client.enqueue(messages)
+
     async def broadcast(self, message: str):
-        disconnected = set()
-        for connection in self.active_connections:
+        self.publish(set(self.clients.values()), [message])
+
+    def stats(self) -> List[Dict]:
+        return [client.stats() for client in self.clients.values()]
+
+    async def close_all(self):
+        """Остановка: писатели отменяются, сокеты закрываются."""
+        for websocket in list(self.active_connections):
+            self.disconnect(websocket)
             try:
-                await connection.send_text(message)
+                await asyncio.wait_for(websocket.close(), WS_SEND_TIMEOUT_SECONDS)
             except Exception:
-                disconnected.add(connection)
-        for conn in disconnected:
-            self.disconnect(conn)
+                pass
+
+    def _update_gauges(self):
+        WS_CONNECTIONS.set(len(self.active_connections))
+        WS_SUBSCRIPTIONS.set(len(self.groups))
 
 
 manager = ConnectionManager()
 
 
+async def aggregate_subscription(
+        signature: Signature,
+        window_seconds: int = WS_AGGREGATION_WINDOW_SECONDS
+) -> List[AggregatedMetric]:
+    """Агрегаты одной сигнатуры подписки - считаются один раз на всех её клиентов."""
+    filter_items, group_by = signature
+    if LIVE_AGGREGATION_SOURCE == "db":
+        agg_list = await storage.aggregate(
+            window_seconds=window_seconds,
+            group_by_tags=list(group_by) or None,
+            filter_tags=dict(filter_items) or None
+        )
+    else:
+        agg_list = stream_aggregator.aggregate(
+            window_seconds=window_seconds,
+            group_by_tags=list(group_by),
+            filter_tags=dict(filter_items)
+        )
+    return [AggregatedMetric(**agg) for agg in agg_list]
+
+
+def render_frames(
+        aggregates: List[AggregatedMetric],
+        encoding: Optional[str],
+        window_seconds: int = WS_AGGREGATION_WINDOW_SECONDS
+) -> List[Frame]:
+    """
+    Кадры одного тика в кодировке клиента:
+    - None (по умолчанию): по текстовому JSON-кадру на агрегат;
+    - json / msgpack / cbor: один кадр {"type": "tick", ...} со всеми агрегатами.
+    """
+    if encoding is None:
+        return [agg.model_dump_json() for agg in aggregates]
+    return [encode_frame(encoding, {
+        "type": "tick",
+        "timestamp": time.time(),
+        "window_seconds": window_seconds,
+        "aggregates": [agg.model_dump() for agg in aggregates],
+    })]
+
+
+def group_key(aggregate: Dict) -> GroupKey:
+    return aggregate["service_name"], aggregate["metric_name"], tuple(sorted(aggregate["tags"].items()))
+
+
+class DeltaState:
+    """Последнее разосланное состояние сигнатуры подписки для дельта-режима."""
+
+    def __init__(self):
+        self.seq = 0
+        self.last: Dict[GroupKey, Dict] = {}
+
+    def advance(self, aggregates: List[AggregatedMetric]) -> Tuple[List[Dict], List[Dict], List[Dict]]:
+        """Запоминает новое состояние; возвращает (снимок, изменённые/новые группы, удалённые группы)."""
+        current = {}
+        for agg in aggregates:
+            data = agg.model_dump()
+            current[group_key(data)] = data
+
+        upserts = [data for key, data in current.items() if self.last.get(key) != data]
+        removed = [
+            {"service_name": key[0], "metric_name": key[1], "tags": dict(key[2])}
+            for key in self.last.keys() - current.keys()
+        ]
+        self.last = current
+        self.seq += 1
+        return list(current.values()), upserts, removed
+
+    @property
+    def is_keyframe_tick(self) -> bool:
+        return self.seq % max(WS_DELTA_KEYFRAME_TICKS, 1) == 0
+
+
+def render_snapshot(
+        seq: int,
+        snapshot: List[Dict],
+        encoding: str,
+        window_seconds: int = WS_AGGREGATION_WINDOW_SECONDS
+) -> List[Frame]:
+    return [encode_frame(encoding, {
+        "type": "snapshot",
+        "seq": seq,
+        "timestamp": time.time(),
+        "window_seconds": window_seconds,
+        "aggregates": snapshot,
+    })]
+
+
+def render_delta(
+        seq: int,
+        upserts: List[Dict],
+        removed: List[Dict],
+        encoding: str,
+        window_seconds: int = WS_AGGREGATION_WINDOW_SECONDS
+) -> List[Frame]:
+    """Дельта к состоянию seq - 1: изменённые/новые группы и явные удаления."""
+    return [encode_frame(encoding, {
+        "type": "delta",
+        "seq": seq,
+        "timestamp": time.time(),
+        "window_seconds": window_seconds,
+        "upserts": upserts,
+        "removed": removed,
+    })]
+
+
+# Состояние дельта-режима по сигнатурам подписок
+_delta_states: Dict[Signature, DeltaState] = {}
+
+
+def _publish_delta(state: DeltaState, delta: Tuple[List[Dict], List[Dict], List[Dict]],
+                   encoding: str, clients: List[ClientConnection]):
+    snapshot, upserts, removed = delta
+    keyframe_cache: List[List[Frame]] = []
+
+    def keyframe() -> List[Frame]:
+        # Снимок сериализуется только если он кому-то нужен в этом тике
+        if not keyframe_cache:
+            keyframe_cache.append(render_snapshot(state.seq, snapshot, encoding))
+        return keyframe_cache[0]
+
+    if state.is_keyframe_tick:
+        frames = keyframe()
+        for client in clients:
+            client.needs_keyframe = False
+    else:
+        frames = render_delta(state.seq, upserts, removed, encoding)
+    manager.publish(clients, frames, keyframe)
+
+
+def fan_out(signature: Signature, aggregates: List[AggregatedMetric]):
+    """
+    Раздаёт агрегаты тика локальным клиентам сигнатуры: сериализация - один раз
+    на кодировку, дельта-клиенты - изменения к прошлому тику и периодический снимок.
+    """
+    clients = manager.groups.get(signature)
+    if not clients:
+        return
+
+    by_mode: Dict[Tuple[Optional[str], bool], List[ClientConnection]] = {}
+    for client in clients:
+        by_mode.setdefault((client.encoding, client.delta), []).append(client)
+
+    delta = state = None
+    if any(is_delta for _, is_delta in by_mode):
+        state = _delta_states.setdefault(signature, DeltaState())
+        delta = state.advance(aggregates)
+
+    for (encoding, is_delta), members in by_mode.items():
+        if is_delta:
+            _publish_delta(state, delta, encoding, members)
+        # Пакетный режим шлёт и пустой тик - клиент видит, что групп не осталось
+        elif aggregates or encoding is not None:
+            manager.publish(members, render_frames(aggregates, encoding))
+
+
+def _encode_signature(signature: Signature) -> List:
+    filter_items, group_by = signature
+    return [[list(pair) for pair in filter_items], list(group_by)]
+
+
+def _decode_signature(data: List) -> Signature:
+    return tuple(tuple(pair) for pair in data[0]), tuple(data[1])
+
+
+# Подписки других воркеров (для лидера): node_id -> (время анонса, сигнатуры)
+_remote_signatures: Dict[str, Tuple[float, Set[Signature]]] = {}
+
+
+def _on_subscriptions(message: str):
+    data = json.loads(message)
+    _remote_signatures[data["node"]] = (time.monotonic(), {_decode_signature(s) for s in data["signatures"]})
+
+
+def _on_tick(message: str):
+    data = json.loads(message)
+    signature = _decode_signature(data["signature"])
+    if signature in manager.groups:
+        fan_out(signature, [AggregatedMetric(**agg) for agg in data["aggregates"]])
+
+
+def _wanted_signatures() -> Set[Signature]:
+    """Все сигнатуры, у которых есть клиенты хоть на одном воркере."""
+    expire_before = time.monotonic() - _ANNOUNCE_TTL_TICKS * WS_TICK_SECONDS
+    for node in [n for n, (announced, _) in _remote_signatures.items() if announced < expire_before]:
+        del _remote_signatures[node]
+
+    wanted = set(manager.groups)
+    for _, signatures in _remote_signatures.values():
+        wanted |= signatures
+    return wanted
+
+
 async def metrics_aggregator():
-    """Фоновая задача агрегации с группировкой по тегам; с защитой от падений БД"""
-    while True:
-        try:
-            # Агрегируем по регионам и версиям
-            agg_list = await aggregate_last_window(
-                window_seconds=30,
-                group_by_tags=["region", "version"],
-                filter_tags={"env": "production"}
-            )
-
-            if agg_list:
-                # Отправляем каждый агрегат отдельно
-                for agg in agg_list:
-                    payload = AggregatedMetric(**agg).model_dump_json()
-                    await manager.broadcast(payload)
-
-        except Exception as e:
-            # Логируем ошибку, но не останавливаем цикл
-            logger.warning(f"⚠️ Aggregation error (will retry): {e}")
-
-        await asyncio.sleep(5)
+    """
+    Фоновая задача live-рассылки с группировкой по тегам.
+
+    Каждый воркер анонсирует в backplane сигнатуры подписок своих клиентов.
+    Единственный выбранный лидер раз в тик считает агрегаты каждой сигнатуры
+    (один раз на всю систему) и публикует их; каждый воркер раздаёт их своим
+    сокетам через fan_out. Нагрузка агрегации не растёт с числом воркеров.
+    Отправкой занимаются писатели клиентов - тик не ждёт сокеты.
+    """
+    backplane.subscribe(SUBSCRIPTIONS_CHANNEL, _on_subscriptions)
+    backplane.subscribe(TICKS_CHANNEL, _on_tick)
+
+    try:
+        while True:
+            try:
+                if manager.groups:
+                    await backplane.publish(SUBSCRIPTIONS_CHANNEL, json.dumps({
+                        "node": backplane.node_id,
+                        "signatures": [_encode_signature(s) for s in manager.groups],
+                    }))
+
+                if await backplane.is_leader():
+                    for signature in _wanted_signatures():
+                        aggregates = await aggregate_subscription(signature)
+                        await backplane.publish(TICKS_CHANNEL, json.dumps({
+                            "signature": _encode_signature(signature),
+                            "aggregates": [agg.model_dump() for agg in aggregates],
+                        }))
+
+                # Состояние сигнатур, у которых не осталось клиентов, больше не нужно
+                for signature in [s for s in _delta_states if s not in manager.groups]:
+                    del _delta_states[signature]
+
+            except Exception as e:
+                # Логируем ошибку, но не останавливаем цикл
+                logger.warning(f"⚠️ Aggregation error (will retry): {e}")
+
+            await asyncio.sleep(WS_TICK_SECONDS)
+    finally:
+        await backplane.stop()
@@ -0,0 +1,254 @@
+import logging
+import os
+from typing import Dict, List, Optional, Set, Tuple
+
+from prometheus_client import Counter, Gauge
+
+from app.schemas.metric import MetricCreate
+from app.utils.hyperloglog import HyperLogLog
+
+logger = logging.getLogger(__name__)
+
+CARDINALITY_GUARD_ENABLED = os.getenv("CARDINALITY_GUARD_ENABLED", "true").lower() == "true"
+# Сколько различных серий (наборов тегов) допускаем на одну метрику (service, metric)
+CARDINALITY_MAX_SERIES_PER_METRIC = int(os.getenv("CARDINALITY_MAX_SERIES_PER_METRIC", "10000"))
+# Сколько различных ключей тегов допускаем на одну метрику; ключи сверх лимита
+# (и любые новые ключи после исчерпания лимита серий) не получают состояния
+CARDINALITY_MAX_TAG_KEYS = int(os.getenv("CARDINALITY_MAX_TAG_KEYS", "32"))
+# Сколько различных значений допускаем на один ключ тега внутри метрики
+CARDINALITY_MAX_TAG_VALUES = int(os.getenv("CARDINALITY_MAX_TAG_VALUES", "1000"))
+# Лимиты по отдельным ключам: "request_id=0,user_id=100" (0 - ключ не пропускается никогда)
+CARDINALITY_TAG_LIMITS = os.getenv("CARDINALITY_TAG_LIMITS", "")
+# Что делать со значением сверх лимита: other - заменить на __other__, drop - убрать тег
+CARDINALITY_DEFAULT_ACTION = os.getenv("CARDINALITY_DEFAULT_ACTION", "other").lower()
+# Действия по отдельным ключам: "request_id=drop,region=other"
+CARDINALITY_TAG_ACTIONS = os.getenv("CARDINALITY_TAG_ACTIONS", "")
+
+OTHER_VALUE = "__other__"
+# Ключ, в который сливаются ключи сверх лимита (действие other)
+OTHER_KEY = "__other__"
+_ACTIONS = ("other", "drop")
+
+CARDINALITY_LIMITED_TAGS = Counter(
+    "cardinality_limited_tags_total",
+    "Tag values rewritten by the cardinality guard",
+    ["action"],
+)
+CARDINALITY_LIMITED_KEYS = Counter(
+    "cardinality_limited_tag_keys_total",
+    "Tag keys folded into __other__ or dropped because the metric's key or series limit was reached",
+    ["action"],
+)
+CARDINALITY_TRACKED_METRICS = Gauge(
+    "cardinality_tracked_metrics",
+    "Number of (service, metric) pairs tracked by the cardinality guard",
+)
+
+
+def _parse_rules(spec: str) -> Dict[str, str]:
+    """"key=value,key2=value2" -> словарь (пустые и битые элементы пропускаются)."""
+    rules = {}
+    for part in spec.split(","):
+        key, sep, value = part.partition("=")
+        if sep and key.strip():
+            rules[key.strip()] = value.strip()
+    return rules
+
+
+class TagCardinality:
+    """
+    Значения одного ключа тега внутри метрики: HLL-оценка всех встреченных
+    значений и ограниченное лимитом множество пропущенных как есть.
+    """
+
+    __slots__ = ("estimate", "admitted", "limit", "action", "limited")
+
+    def __init__(self, limit: int, action: str):
+        self.estimate = HyperLogLog()
+        self.admitted: Set[str] = set()
+        self.limit = limit
+        self.action = action
+        self.limited = 0
+
+    def admit(self, value: str) -> bool:
+        self.estimate.add(value)
+        if value in self.admitted:
+            return True
+        if len(self.admitted) < self.limit:
+            self.admitted.add(value)
+            return True
+        self.limited += 1
+        return False
+
+
+class MetricCardinality:
+    """Серии одной метрики (service, metric) и её ключи тегов."""
+
+    __slots__ = ("series_estimate", "series", "tags", "limited")
+
+    def __init__(self):
+        self.series_estimate = HyperLogLog()
+        self.series: Set[Tuple[Tuple[str, str], ...]] = set()
+        self.tags: Dict[str, TagCardinality] = {}
+        self.limited = 0
+
+
+class CardinalityGuard:
+    """
+    Ограничитель кардинальности тегов, которые становятся лейблами Prometheus
+    и ключами группировки.
+
+    На горячем пути - проверка значения в множестве уже пропущенных (O(1))
+    и добавление в HyperLogLog. Когда значений ключа больше лимита, новые
+    значения заменяются на __other__ или тег убирается (по правилам ключа).
+    Если лимит серий метрики исчерпан, по тем же правилам схлопываются ключи
+    с наибольшей оценкой кардинальности, пока серия не окажется уже известной,
+    а если не оказалась - вся серия сводится к одной служебной.
+
+    Незнакомый ключ получает состояние (HLL и множество значений), только
+    пока у метрики меньше max_tag_keys ключей и не исчерпан лимит серий;
+    иначе он сливается в единый ключ __other__ или убирается. Поэтому и
+    память, и число серий метрики ограничены лимитами, даже если клиент
+    перебирает ключи (например, id запроса в имени ключа).
+    """
+
+    def __init__(
+            self,
+            max_series_per_metric: int = CARDINALITY_MAX_SERIES_PER_METRIC,
+            max_tag_keys: int = CARDINALITY_MAX_TAG_KEYS,
+            max_tag_values: int = CARDINALITY_MAX_TAG_VALUES,
+            tag_limits: Optional[Dict[str, int]] = None,
+            default_action: str = CARDINALITY_DEFAULT_ACTION,
+            tag_actions: Optional[Dict[str, str]] = None,
+            enabled: bool = CARDINALITY_GUARD_ENABLED,
+    ):
+        if tag_limits is None:
+            tag_limits = {k: int(v) for k, v in _parse_rules(CARDINALITY_TAG_LIMITS).items()}
+        if tag_actions is None:
+            tag_actions = _parse_rules(CARDINALITY_TAG_ACTIONS)
+        for action in [default_action, *tag_actions.values()]:
+            if action not in _ACTIONS:
+                raise ValueError(f"Unknown cardinality action: {action!r} (expected one of {_ACTIONS})")
+
+        self.enabled = enabled
+        self.max_series_per_metric = max_series_per_metric
+        self.max_tag_keys = max_tag_keys
+        self.max_tag_values = max_tag_values
+        self.tag_limits = tag_limits
+        self.default_action = default_action
+        self.tag_actions = tag_actions
+        self.metrics: Dict[Tuple[str, str], MetricCardinality] = {}
+
+    def _tag_state(self, state: MetricCardinality, key: str) -> Optional[TagCardinality]:
+        """Состояние ключа; None - ключ новый, а лимит ключей или серий метрики исчерпан."""
+        tag = state.tags.get(key)
+        if tag is None:
+            if len(state.tags) >= self.max_tag_keys or len(state.series) >= self.max_series_per_metric:
+                return None
+            tag = state.tags[key] = TagCardinality(
+                self.tag_limits.get(key, self.max_tag_values),
+                self.tag_actions.get(key, self.default_action),
+            )
+        return tag
+
+    def _limit_key(self, tags: Dict[str, str], key: str):
+        """Ключ без состояния: сливается в OTHER_KEY или убирается, как значения сверх лимита."""
+        action = self.tag_actions.get(key, self.default_action)
+        del tags[key]
+        if action == "other":
+            tags[OTHER_KEY] = OTHER_VALUE
+        CARDINALITY_LIMITED_KEYS.labels(action=action).inc()
+
+    def _limit(self, tags: Dict[str, str], key: str, action: str):
+        if action == "drop":
+            del tags[key]
+        else:
+            tags[key] = OTHER_VALUE
+        CARDINALITY_LIMITED_TAGS.labels(action=action).inc()
+
+    def apply(self, metric: MetricCreate) -> MetricCreate:
+        """Метрика с тегами в пределах лимитов (исходный объект, если ничего не менялось)."""
+        if not self.enabled or not metric.tags:
+            return metric
+
+        metric_key = (metric.service_name, metric.metric_name)
+        state = self.metrics.get(metric_key)
+        if state is None:
+            state = self.metrics[metric_key] = MetricCardinality()
+            CARDINALITY_TRACKED_METRICS.set(len(self.metrics))
+
+        tags = dict(metric.tags)
+        changed = False
+        for key, value in metric.tags.items():
+            tag = self._tag_state(state, key)
+            if tag is None:
+                self._limit_key(tags, key)
+                changed = True
+            elif not tag.admit(value):
+                self._limit(tags, key, tag.action)
+                changed = True
+
+        series_key = tuple(sorted(tags.items()))
+        state.series_estimate.add(repr(series_key))
+        if series_key not in state.series:
+            if len(state.series) >= self.max_series_per_metric:
+                state.limited += 1
+                # Схлопываем самые «широкие» ключи, пока серия не станет известной
+                by_estimate = sorted(
+                    (k for k, v in tags.items() if v != OTHER_VALUE),
+                    key=lambda k: state.tags[k].estimate.count(),
+                    reverse=True,
+                )
+                for key in by_estimate:
+                    self._limit(tags, key, state.tags[key].action)
+                    changed = True
+                    series_key = tuple(sorted(tags.items()))
+                    if series_key in state.series:
+                        break
+                else:
+                    # Известной серии не нашлось: одна служебная серия на метрику
+                    # (без тегов при действии drop по умолчанию)
+                    tags = {OTHER_KEY: OTHER_VALUE} if self.default_action == "other" else {}
+                    changed = True
+                    series_key = tuple(sorted(tags.items()))
+            # Служебная серия допускается и сверх лимита: лимит + 1 на метрику
+            state.series.add(series_key)
+
+        if not changed:
+            return metric
+        return metric.model_copy(update={"tags": tags})
+
+    def report(self, top: int = 20) -> List[Dict]:
+        """Метрики с наибольшей оценкой числа серий и их самые кардинальные ключи."""
+        rows = []
+        for (service_name, metric_name), state in self.metrics.items():
+            tags = sorted(
+                (
+                    {
+                        "key": key,
+                        "estimated_values": tag.estimate.count(),
+                        "admitted_values": len(tag.admitted),
+                        "limit": tag.limit,
+                        "action": tag.action,
+                        "limited": tag.limited,
+                    }
+                    for key, tag in state.tags.items()
+                ),
+                key=lambda t: t["estimated_values"],
+                reverse=True,
+            )
+            rows.append({
+                "service_name": service_name,
+                "metric_name": metric_name,
+                "estimated_series": state.series_estimate.count(),
+                "admitted_series": len(state.series),
+                "series_limit": self.max_series_per_metric,
+                "limited_series": state.limited,
+                "tags": tags[:top],
+            })
+
+        rows.sort(key=lambda r: r["estimated_series"], reverse=True)
+        return rows[:top]
+
+
+cardinality_guard = CardinalityGuard()
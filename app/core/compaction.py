@@ -0,0 +1,163 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from sqlalchemy import delete, func, select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from app.core.blocks import BLOCK_COMPACT_AFTER_SECONDS, BLOCK_SECONDS, Sample, decode_block, encode_block, to_micros
+from app.core.db import get_engine
+from app.core.partitions import METRICS_RETENTION_DAYS, is_partitioned, list_partitions, parse_partition_bounds
+from app.core.rollups import ROLLUP_LEVELS, ROLLUP_RECOMPUTE_BUCKETS, floor_time, get_watermark, set_watermark
+from app.models.metric import Metric
+from app.models.metric_block import MetricBlock
+
+logger = logging.getLogger(__name__)
+
+METRIC_BLOCKS_ENABLED = os.getenv("METRIC_BLOCKS_ENABLED", "true").lower() == "true"
+# Период запуска фонового задания
+BLOCK_COMPACT_INTERVAL_SECONDS = int(os.getenv("METRIC_BLOCK_COMPACT_INTERVAL_SECONDS", "300"))
+# Сколько диапазонов сжимать за один проход (догоняем порциями)
+BLOCK_MAX_RANGES_PER_RUN = int(os.getenv("METRIC_BLOCK_MAX_RANGES_PER_RUN", "6"))
+
+# Строка таблицы watermark (общая с rollup)
+WATERMARK_NAME = "blocks"
+
+_COMPACT_LOCK_KEY = 0x626C6F6B  # "blok"
+# 7 параметров на строку - укладываемся в лимит параметров Postgres
+_INSERT_CHUNK_SIZE = 2000
+_STREAM_BATCH_SIZE = 10000
+
+
+async def _existing_samples(conn: AsyncConnection, start: datetime, end: datetime) -> Dict[int, List[Sample]]:
+    """Точки блоков, уже записанных в диапазон (повторное сжатие после ручного сброса watermark)."""
+    result = await conn.execute(
+        select(MetricBlock).where(MetricBlock.start_ts >= start, MetricBlock.start_ts < end)
+    )
+    return {block.series_id: decode_block(block) for block in result}
+
+
+async def _compact_range(conn: AsyncConnection, start: datetime, end: datetime) -> int:
+    """
+    Переносит сырые точки [start, end) в блоки (по блоку на серию) и удаляет
+    их из metrics. Транзакцией управляет вызывающий код. Возвращает число блоков.
+    """
+    existing = await _existing_samples(conn, start, end)
+    samples: Dict[int, List[Sample]] = {}
+
+    result = await conn.stream(
+        select(Metric.series_id, Metric.timestamp, Metric.id, Metric.value).where(
+            Metric.timestamp >= start,
+            Metric.timestamp < end
+        ).execution_options(yield_per=_STREAM_BATCH_SIZE)
+    )
+    async for partition in result.partitions():
+        for row in partition:
+            samples.setdefault(row.series_id, []).append((to_micros(row.timestamp), row.id, row.value))
+
+    rows = []
+    for series_id, points in samples.items():
+        points.extend(existing.pop(series_id, ()))
+        points.sort()
+        rows.append({"series_id": series_id, "start_ts": start, **encode_block(points)})
+
+    for chunk_start in range(0, len(rows), _INSERT_CHUNK_SIZE):
+        stmt = pg_insert(MetricBlock).values(rows[chunk_start:chunk_start + _INSERT_CHUNK_SIZE])
+        # Блок пересобран из старого блока и новых точек - заменяется целиком
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[MetricBlock.series_id, MetricBlock.start_ts],
+            set_={col: stmt.excluded[col] for col in ("end_ts", "sample_count", "ts_data", "value_data", "id_data")}
+        )
+        await conn.execute(stmt)
+
+    await conn.execute(delete(Metric).where(Metric.timestamp >= start, Metric.timestamp < end))
+    return len(rows)
+
+
+async def _truncate_compacted_partitions(conn: AsyncConnection, start: datetime, end: datetime) -> List[str]:
+    """
+    Секции, которые закончились в [start, end), уже целиком в блоках: TRUNCATE
+    сразу возвращает место, которое DELETE оставил бы до удаления секции по retention.
+    """
+    truncated = []
+    for name in await list_partitions(conn):
+        bounds = parse_partition_bounds(name)
+        if bounds is not None and start < bounds[1] <= end:
+            await conn.execute(text(f'TRUNCATE TABLE "{name}"'))
+            truncated.append(name)
+    return truncated
+
+
+async def compact_blocks(now: Optional[datetime] = None) -> int:
+    """
+    Один проход сжатия: закрытые диапазоны по BLOCK_SECONDS от watermark вперёд,
+    каждый - отдельной транзакцией. Диапазон закрыт, когда он старше
+    BLOCK_COMPACT_AFTER_SECONDS и уже посчитан в rollup 1m (rollup читает сырые
+    точки). Выполняется под advisory lock. Возвращает число сжатых диапазонов.
+    """
+    now = now or datetime.now(timezone.utc)
+    horizon = floor_time(now - timedelta(seconds=BLOCK_COMPACT_AFTER_SECONDS), BLOCK_SECONDS)
+    compacted = 0
+
+    async with get_engine("background").connect() as conn:
+        locked = (await conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": _COMPACT_LOCK_KEY})).scalar()
+        await conn.commit()
+        if not locked:
+            return compacted
+
+        try:
+            rollup_watermark = await get_watermark(conn, ROLLUP_LEVELS[0].name)
+            if rollup_watermark is None:
+                return compacted
+            # Бакеты, которые rollup ещё пересчитывает, должны остаться в сырых точках
+            rollup_done = rollup_watermark - ROLLUP_LEVELS[0].step * ROLLUP_RECOMPUTE_BUCKETS
+            horizon = min(horizon, floor_time(rollup_done, BLOCK_SECONDS))
+
+            watermark = await get_watermark(conn, WATERMARK_NAME)
+            if watermark is None:
+                oldest = (await conn.execute(select(func.min(Metric.timestamp)))).scalar()
+                if oldest is None:
+                    await conn.commit()
+                    return compacted
+                watermark = floor_time(oldest, BLOCK_SECONDS)
+            partitioned = await is_partitioned(conn)
+
+            while watermark < horizon and compacted < BLOCK_MAX_RANGES_PER_RUN:
+                end = watermark + timedelta(seconds=BLOCK_SECONDS)
+                blocks = await _compact_range(conn, watermark, end)
+                await set_watermark(conn, WATERMARK_NAME, end)
+                truncated = await _truncate_compacted_partitions(conn, watermark, end) if partitioned else []
+                await conn.commit()
+
+                logger.debug(f"🧊 Compacted {watermark.isoformat()} .. {end.isoformat()}: {blocks} blocks")
+                if truncated:
+                    logger.info(f"🧊 Partitions moved to blocks and truncated: {', '.join(truncated)}")
+                watermark = end
+                compacted += 1
+
+            if METRICS_RETENTION_DAYS > 0:
+                cutoff = now - timedelta(days=METRICS_RETENTION_DAYS)
+                await conn.execute(delete(MetricBlock).where(MetricBlock.end_ts < cutoff))
+            await conn.commit()
+        finally:
+            await conn.rollback()
+            await conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": _COMPACT_LOCK_KEY})
+            await conn.commit()
+
+    return compacted
+
+
+async def block_compactor():
+    """Фоновая задача переноса холодных сырых точек в сжатые блоки."""
+    while True:
+        try:
+            compacted = await compact_blocks()
+            if compacted:
+                logger.debug(f"🧊 Compacted {compacted} block ranges")
+        except Exception as e:
+            logger.warning(f"⚠️ Block compaction error (will retry): {e}")
+
+        await asyncio.sleep(BLOCK_COMPACT_INTERVAL_SECONDS)
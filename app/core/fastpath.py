@@ -0,0 +1,164 @@
+import logging
+import os
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Mapping, Optional, Sequence, Tuple
+
+import asyncpg
+from sqlalchemy import BigInteger, bindparam, insert, select, tuple_, any_
+from sqlalchemy.dialects.postgresql import ARRAY
+
+from app.core.blocks import block_history_rows, block_statement, blocks_may_cover, merge_history
+from app.core.db import DEFAULT_POOL, engine, get_engine
+from app.models.metric import Metric
+from app.models.metric_block import MetricBlock
+from app.models.series import Series
+
+logger = logging.getLogger(__name__)
+
+# Горячие запросы - на сыром asyncpg-соединении из пула своей нагрузки, без ORM
+FASTPATH_ENABLED = os.getenv("DB_FASTPATH_ENABLED", "true").lower() == "true"
+
+
+class Record(asyncpg.Record):
+    """Запись asyncpg с доступом к колонкам через атрибуты, как у Row SQLAlchemy."""
+
+    def __getattr__(self, name: str) -> Any:
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+
+@asynccontextmanager
+async def raw_connection(pool: str = DEFAULT_POOL, read_only: bool = False) -> AsyncIterator[asyncpg.Connection]:
+    """
+    Драйверное соединение asyncpg из пула pool (read_only - с реплики, если
+    они настроены). Запросы выполняются вне транзакции (autocommit);
+    соединение возвращается в пул при выходе.
+    """
+    async with get_engine(pool, read_only).connect() as conn:
+        raw = await conn.get_raw_connection()
+        yield raw.driver_connection
+
+
+class PreparedQuery:
+    """
+    Core-выражение, скомпилированное в SQL диалекта asyncpg один раз.
+
+    Параметры - bindparam по имени; литералы выражения (ключи тегов, константы
+    скетча) запоминаются при компиляции. asyncpg готовит (PREPARE) запрос
+    при первом выполнении на соединении и дальше берёт его из кэша соединения,
+    так что повторные вызовы не платят ни за сборку select(), ни за разбор SQL.
+    """
+
+    __slots__ = ("sql", "_names", "_defaults")
+
+    def __init__(self, statement):
+        compiled = statement.compile(dialect=engine.dialect)
+        self.sql = compiled.string
+        self._names = compiled.positiontup or []
+        self._defaults = compiled.params
+
+    def args(self, params: Dict[str, Any]) -> List[Any]:
+        return [params[name] if name in params else self._defaults[name] for name in self._names]
+
+    async def fetch(self, conn: Optional[asyncpg.Connection] = None, **params) -> List[Record]:
+        if conn is None:
+            async with raw_connection() as conn:
+                return await conn.fetch(self.sql, *self.args(params), record_class=Record)
+        return await conn.fetch(self.sql, *self.args(params), record_class=Record)
+
+    async def fetchrow(self, conn: Optional[asyncpg.Connection] = None, **params) -> Optional[Record]:
+        if conn is None:
+            async with raw_connection() as conn:
+                return await conn.fetchrow(self.sql, *self.args(params), record_class=Record)
+        return await conn.fetchrow(self.sql, *self.args(params), record_class=Record)
+
+
+def series_ids_param(name: str = "series_ids"):
+    """Параметр-массив series_id для series_id = ANY($n)."""
+    return any_(bindparam(name, type_=ARRAY(BigInteger)))
+
+
+# --- Приём: одна точка без add / commit / refresh ---
+
+INSERT_METRIC = PreparedQuery(
+    insert(Metric).values(
+        series_id=bindparam("series_id"),
+        value=bindparam("value"),
+    ).returning(Metric.id, Metric.timestamp)
+)
+
+
+async def insert_metric(series_id: int, value: float) -> Tuple[int, datetime]:
+    """Записывает точку и возвращает её (id, timestamp)."""
+    async with raw_connection("ingest") as conn:
+        row = await INSERT_METRIC.fetchrow(conn, series_id=series_id, value=value)
+    return row["id"], row["timestamp"]
+
+
+# --- История: сырые точки набора серий в порядке (timestamp, id) ---
+
+def _history_statement(keyset: str):
+    query = select(
+        Metric.id,
+        Series.service_name,
+        Series.metric_name,
+        Metric.value,
+        Series.tags,
+        Metric.timestamp,
+    ).join(
+        Series, Series.id == Metric.series_id
+    ).where(
+        Metric.series_id == series_ids_param(),
+        Metric.timestamp >= bindparam("since", type_=Metric.timestamp.type),
+    ).order_by(Metric.timestamp, Metric.id).limit(bindparam("limit"))
+
+    after_ts = bindparam("after_ts", type_=Metric.timestamp.type)
+    if keyset == "ts_id":
+        query = query.where(tuple_(Metric.timestamp, Metric.id) > tuple_(after_ts, bindparam("after_id")))
+    elif keyset == "ts":
+        query = query.where(Metric.timestamp > after_ts)
+    return query
+
+
+# Отдельный запрос на каждый вариант keyset: у каждого свой план
+HISTORY_QUERIES = {keyset: PreparedQuery(_history_statement(keyset)) for keyset in ("none", "ts", "ts_id")}
+
+# Сжатые блоки тех же серий (app.core.blocks), пересекающиеся с [since, ...)
+HISTORY_BLOCKS_QUERY = PreparedQuery(
+    block_statement().where(
+        MetricBlock.series_id == series_ids_param(),
+        MetricBlock.end_ts >= bindparam("since", type_=MetricBlock.end_ts.type),
+    )
+)
+
+
+async def fetch_history(
+        series_ids: Sequence[int],
+        since: datetime,
+        after_ts: Optional[datetime] = None,
+        after_id: Optional[int] = None,
+        limit: Optional[int] = None
+) -> List[Mapping[str, Any]]:
+    """
+    Сырые точки серий series_ids (limit=None - без ограничения).
+    Если диапазон задевает холодные данные, к ним добавляются точки из
+    сжатых блоков - в том же порядке (timestamp, id).
+    """
+    if after_ts is None:
+        keyset = "none"
+    elif after_id is None:
+        keyset = "ts"
+    else:
+        keyset = "ts_id"
+    params = dict(series_ids=list(series_ids), since=since, after_ts=after_ts, after_id=after_id, limit=limit)
+    async with raw_connection("interactive", read_only=True) as conn:
+        if not blocks_may_cover(since):
+            return await HISTORY_QUERIES[keyset].fetch(conn, **params)
+        # Один снимок: сжатие, закоммиченное между запросами, не потеряет и не удвоит точки
+        async with conn.transaction(isolation="repeatable_read", readonly=True):
+            blocks = await HISTORY_BLOCKS_QUERY.fetch(conn, series_ids=params["series_ids"], since=since)
+            records = await HISTORY_QUERIES[keyset].fetch(conn, **params)
+    return merge_history(block_history_rows(blocks, since, after_ts, after_id), records, limit)
@@ -0,0 +1,236 @@
+import asyncio
+import logging
+import os
+import time
+from typing import List, Optional
+
+from prometheus_client import Counter, Gauge, Histogram
+
+from app.schemas.metric import MetricCreate
+from app.storage import storage
+
+logger = logging.getLogger(__name__)
+
+# Конфигурация из переменных окружения
+INGEST_BUFFER_ENABLED = os.getenv("INGEST_BUFFER_ENABLED", "true").lower() == "true"
+INGEST_BUFFER_MAX_SIZE = int(os.getenv("INGEST_BUFFER_MAX_SIZE", "100000"))
+INGEST_BUFFER_FLUSH_SIZE = int(os.getenv("INGEST_BUFFER_FLUSH_SIZE", "5000"))
+INGEST_BUFFER_FLUSH_INTERVAL_MS = int(os.getenv("INGEST_BUFFER_FLUSH_INTERVAL_MS", "50"))
+# 0 - сразу отвечать 429 при переполнении, >0 - ждать освобождения места до N мс
+INGEST_BUFFER_BLOCK_TIMEOUT_MS = int(os.getenv("INGEST_BUFFER_BLOCK_TIMEOUT_MS", "0"))
+# Пауза между повторами неудачного group commit: удваивается от начальной до потолка
+INGEST_BUFFER_RETRY_BACKOFF_MS = int(os.getenv("INGEST_BUFFER_RETRY_BACKOFF_MS", "100"))
+INGEST_BUFFER_RETRY_MAX_BACKOFF_MS = int(os.getenv("INGEST_BUFFER_RETRY_MAX_BACKOFF_MS", "5000"))
+# Сколько при остановке ждать, пока хранилище снова примет запись (0 - без ограничения)
+INGEST_BUFFER_DRAIN_TIMEOUT_SECONDS = float(os.getenv("INGEST_BUFFER_DRAIN_TIMEOUT_SECONDS", "30"))
+
+# --- Внутренние метрики буфера (видны на /metrics/internal) ---
+BUFFER_QUEUE_DEPTH = Gauge(
+    "ingest_buffer_queue_depth",
+    "Number of metrics waiting in the write-behind buffer",
+)
+BUFFER_FLUSH_SIZE = Histogram(
+    "ingest_buffer_flush_size",
+    "Number of rows written per group commit",
+    buckets=(1, 10, 50, 100, 500, 1000, 2500, 5000, 10000),
+)
+BUFFER_FLUSH_LATENCY = Histogram(
+    "ingest_buffer_flush_seconds",
+    "Latency of a single group commit",
+)
+BUFFER_FLUSHED_ROWS = Counter(
+    "ingest_buffer_flushed_rows_total",
+    "Rows successfully written by the write-behind buffer",
+)
+BUFFER_REJECTED = Counter(
+    "ingest_buffer_rejected_total",
+    "Metrics rejected because the buffer was full",
+)
+BUFFER_FLUSH_FAILURES = Counter(
+    "ingest_buffer_flush_failures_total",
+    "Failed group commit attempts (the batch is retried)",
+)
+BUFFER_DROPPED_ROWS = Counter(
+    "ingest_buffer_dropped_rows_total",
+    "Rows dropped because storage stayed unavailable past the drain timeout on shutdown",
+)
+
+# Маркер остановки: кладётся в очередь последним, после него флашер завершается
+_STOP = object()
+
+
+class IngestBuffer:
+    """
+    Write-behind буфер приёма метрик.
+
+    Обработчик кладёт валидированную метрику в ограниченную очередь и сразу
+    отвечает 202, а фоновый флашер пишет накопленное одной записью в хранилище
+    (group commit: COPY в Postgres, одна запись журнала во встроенном) по
+    достижении flush_size строк или flush_interval с момента первой строки.
+
+    Принятые (202) строки не теряются при недоступности хранилища: флашер
+    повторяет ту же пачку с растущей паузой, пока запись не пройдёт, а новые
+    строки копятся в очереди за ней. Когда очередь заполнится, put() отказывает
+    и приём отвечает 429 - давление передаётся клиентам.
+    """
+
+    def __init__(
+            self,
+            max_size: int = INGEST_BUFFER_MAX_SIZE,
+            flush_size: int = INGEST_BUFFER_FLUSH_SIZE,
+            flush_interval_ms: int = INGEST_BUFFER_FLUSH_INTERVAL_MS,
+            block_timeout_ms: int = INGEST_BUFFER_BLOCK_TIMEOUT_MS,
+            enabled: bool = INGEST_BUFFER_ENABLED,
+    ):
+        self.enabled = enabled
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.block_timeout = block_timeout_ms / 1000
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_size)
+        self._task: Optional[asyncio.Task] = None
+        self._accepting = False
+        self._drain_deadline: Optional[float] = None
+        BUFFER_QUEUE_DEPTH.set_function(self._queue.qsize)
+
+    @property
+    def accepting(self) -> bool:
+        return self._accepting
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    async def put(self, metric: MetricCreate) -> bool:
+        """
+        Ставит метрику в очередь. Возвращает False, если места нет
+        (сразу или по истечении block_timeout) - вызывающий отвечает 429.
+        """
+        try:
+            self._queue.put_nowait(metric)
+            return True
+        except asyncio.QueueFull:
+            pass
+
+        if self.block_timeout > 0:
+            try:
+                await asyncio.wait_for(self._queue.put(metric), timeout=self.block_timeout)
+                return True
+            except asyncio.TimeoutError:
+                pass
+
+        BUFFER_REJECTED.inc()
+        return False
+
+    def start(self):
+        """Запускает флашер (вызывается из lifespan)."""
+        if self._task is None:
+            self._accepting = True
+            self._task = asyncio.create_task(self._run())
+            logger.info(
+                f"📥 Ingest buffer started (flush_size={self.flush_size}, "
+                f"flush_interval={self.flush_interval * 1000:.0f}ms)"
+            )
+
+    async def stop(self):
+        """Перестаёт принимать метрики и дописывает всё, что осталось в очереди."""
+        if self._task is None:
+            return
+        self._accepting = False
+        if INGEST_BUFFER_DRAIN_TIMEOUT_SECONDS > 0:
+            self._drain_deadline = asyncio.get_running_loop().time() + INGEST_BUFFER_DRAIN_TIMEOUT_SECONDS
+        await self._queue.put(_STOP)
+        await self._task
+        self._task = None
+        self._drain_deadline = None
+        logger.info("📥 Ingest buffer drained")
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+
+        while not stopping:
+            first = await self._queue.get()
+            if first is _STOP:
+                break
+
+            batch: List[MetricCreate] = [first]
+            deadline = loop.time() + self.flush_interval
+
+            while len(batch) < self.flush_size:
+                try:
+                    item = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), timeout=timeout)
+                    except asyncio.TimeoutError:
+                        break
+
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            await self._flush(batch)
+
+    def _drain_expired(self) -> bool:
+        return self._drain_deadline is not None and asyncio.get_running_loop().time() >= self._drain_deadline
+
+    async def _flush(self, batch: List[MetricCreate]):
+        """
+        Group commit, повторяемый до успеха: пачка остаётся первой в очереди
+        на запись, пауза между попытками растёт до INGEST_BUFFER_RETRY_MAX_BACKOFF_MS.
+        Строки отбрасываются только при остановке, если хранилище так и не
+        ответило за INGEST_BUFFER_DRAIN_TIMEOUT_SECONDS.
+        """
+        backoff = INGEST_BUFFER_RETRY_BACKOFF_MS / 1000
+        attempt = 0
+        while True:
+            attempt += 1
+            started = time.perf_counter()
+            try:
+                await storage.write(batch)
+
+                BUFFER_FLUSH_LATENCY.observe(time.perf_counter() - started)
+                BUFFER_FLUSH_SIZE.observe(len(batch))
+                BUFFER_FLUSHED_ROWS.inc(len(batch))
+                if attempt > 1:
+                    logger.info(f"✅ Ingest buffer flush succeeded after {attempt} attempts ({len(batch)} rows)")
+                return
+
+            except Exception as e:
+                BUFFER_FLUSH_FAILURES.inc()
+                logger.warning(
+                    f"⚠️ Ingest buffer flush failed (attempt {attempt}, {len(batch)} rows, "
+                    f"queue depth {self.depth}), retrying in {backoff:.1f}s: {e}"
+                )
+
+            if self._drain_expired():
+                dropped = len(batch) + self._discard_queue()
+                logger.error(
+                    f"❌ Dropping {dropped} buffered metrics: storage unavailable "
+                    f"for {INGEST_BUFFER_DRAIN_TIMEOUT_SECONDS:g}s while shutting down"
+                )
+                BUFFER_DROPPED_ROWS.inc(dropped)
+                return
+
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, INGEST_BUFFER_RETRY_MAX_BACKOFF_MS / 1000)
+
+    def _discard_queue(self) -> int:
+        """Очищает очередь, оставляя маркер остановки, чтобы флашер завершился; возвращает число строк."""
+        discarded = 0
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+            if item is not _STOP:
+                discarded += 1
+        self._queue.put_nowait(_STOP)
+        return discarded
+
+
+ingest_buffer = IngestBuffer()
@@ -0,0 +1,225 @@
+import asyncio
+import logging
+import os
+import re
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from app.core.db import get_engine
+
+logger = logging.getLogger(__name__)
+
+# Конфигурация секционирования таблицы metrics
+# METRICS_PARTITION_INTERVAL: day | hour
+METRICS_PARTITION_INTERVAL = os.getenv("METRICS_PARTITION_INTERVAL", "day").lower()
+# Сколько будущих секций держать созданными заранее
+METRICS_PARTITION_PREMAKE = int(os.getenv("METRICS_PARTITION_PREMAKE", "3"))
+# Срок хранения сырых точек; 0 - хранить бесконечно
+METRICS_RETENTION_DAYS = int(os.getenv("METRICS_RETENTION_DAYS", "30"))
+# Период запуска обслуживания секций
+PARTITION_MAINTENANCE_INTERVAL_SECONDS = int(os.getenv("PARTITION_MAINTENANCE_INTERVAL_SECONDS", "600"))
+
+PARENT_TABLE = "metrics"
+# Секция для точек вне созданных диапазонов: вставка не падает, даже если
+# обслуживание отстало; строки переезжают в свою секцию при её создании
+DEFAULT_PARTITION = f"{PARENT_TABLE}_default"
+
+# Ключ advisory lock: несколько воркеров не должны создавать секции одновременно
+_MAINTENANCE_LOCK_KEY = 0x6D657472  # "metr"
+
+_PARTITION_FORMATS = {
+    "day": ("%Y%m%d", timedelta(days=1)),
+    "hour": ("%Y%m%d%H", timedelta(hours=1)),
+}
+_PARTITION_NAME_RE = re.compile(rf"^{PARENT_TABLE}_p(\d{{8}}|\d{{10}})$")
+
+
+def _interval() -> Tuple[str, timedelta]:
+    try:
+        return _PARTITION_FORMATS[METRICS_PARTITION_INTERVAL]
+    except KeyError:
+        raise ValueError(f"Unsupported METRICS_PARTITION_INTERVAL: {METRICS_PARTITION_INTERVAL}")
+
+
+def partition_start(ts: datetime) -> datetime:
+    """Начало секции, в которую попадает ts (UTC)."""
+    ts = ts.astimezone(timezone.utc)
+    if METRICS_PARTITION_INTERVAL == "hour":
+        return ts.replace(minute=0, second=0, microsecond=0)
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def partition_name(start: datetime) -> str:
+    fmt, _ = _interval()
+    return f"{PARENT_TABLE}_p{start.strftime(fmt)}"
+
+
+def parse_partition_bounds(name: str) -> Optional[Tuple[datetime, datetime]]:
+    """
+    Границы секции по её имени; None для чужих таблиц.
+    Шаг определяется по имени, поэтому смена METRICS_PARTITION_INTERVAL
+    не ломает удаление старых секций.
+    """
+    match = _PARTITION_NAME_RE.match(name)
+    if not match:
+        return None
+    suffix = match.group(1)
+    fmt, step = _PARTITION_FORMATS["hour" if len(suffix) == 10 else "day"]
+    start = datetime.strptime(suffix, fmt).replace(tzinfo=timezone.utc)
+    return start, start + step
+
+
+async def is_partitioned(conn: AsyncConnection) -> bool:
+    result = await conn.execute(
+        text("""
+            SELECT EXISTS (
+                SELECT FROM pg_partitioned_table pt
+                JOIN pg_class c ON c.oid = pt.partrelid
+                WHERE c.relname = :table
+            )
+        """),
+        {"table": PARENT_TABLE}
+    )
+    return bool(result.scalar())
+
+
+async def list_partitions(conn: AsyncConnection) -> List[str]:
+    result = await conn.execute(
+        text("""
+            SELECT c.relname
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            JOIN pg_class p ON p.oid = i.inhparent
+            WHERE p.relname = :table
+            ORDER BY c.relname
+        """),
+        {"table": PARENT_TABLE}
+    )
+    return [row[0] for row in result.fetchall()]
+
+
+async def _create_partition(conn: AsyncConnection, name: str, lower: datetime, upper: datetime):
+    """
+    Создаёт секцию [lower, upper). Если в default-секции уже есть строки
+    этого диапазона, PARTITION OF упадёт на её ограничении - тогда таблица
+    создаётся отдельно, строки переносятся в неё и она присоединяется.
+    """
+    bounds = {"lower": lower, "upper": upper}
+    in_default = await conn.execute(
+        text(
+            f'SELECT EXISTS (SELECT 1 FROM "{DEFAULT_PARTITION}" '
+            f"WHERE timestamp >= :lower AND timestamp < :upper)"
+        ),
+        bounds
+    )
+    for_values = f"FOR VALUES FROM ('{lower.isoformat()}') TO ('{upper.isoformat()}')"
+    if not in_default.scalar():
+        await conn.execute(text(f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF "{PARENT_TABLE}" {for_values}'))
+        return
+
+    await conn.execute(text(
+        f'CREATE TABLE "{name}" (LIKE "{PARENT_TABLE}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'
+    ))
+    moved = await conn.execute(
+        text(f"""
+            WITH moved AS (
+                DELETE FROM "{DEFAULT_PARTITION}"
+                WHERE timestamp >= :lower AND timestamp < :upper
+                RETURNING *
+            )
+            INSERT INTO "{name}" SELECT * FROM moved
+        """),
+        bounds
+    )
+    await conn.execute(text(f'ALTER TABLE "{PARENT_TABLE}" ATTACH PARTITION "{name}" {for_values}'))
+    logger.info(f"🗂️ Moved {moved.rowcount} rows from {DEFAULT_PARTITION} to {name}")
+
+
+async def ensure_partitions(now: Optional[datetime] = None) -> List[str]:
+    """
+    Создаёт default-секцию, текущую и METRICS_PARTITION_PREMAKE будущих секций.
+    Возвращает имена созданных секций.
+    """
+    _, step = _interval()
+    start = partition_start(now or datetime.now(timezone.utc))
+    created = []
+
+    async with get_engine("background").begin() as conn:
+        if not await is_partitioned(conn):
+            logger.warning(
+                f"⚠️ Table '{PARENT_TABLE}' is not partitioned - run 'alembic upgrade head' to enable partitioning"
+            )
+            return created
+
+        await conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": _MAINTENANCE_LOCK_KEY})
+        partitions = await list_partitions(conn)
+        if DEFAULT_PARTITION not in partitions:
+            await conn.execute(text(f'CREATE TABLE IF NOT EXISTS "{DEFAULT_PARTITION}" PARTITION OF "{PARENT_TABLE}" DEFAULT'))
+            created.append(DEFAULT_PARTITION)
+        existing = [b for b in map(parse_partition_bounds, partitions) if b]
+
+        for i in range(METRICS_PARTITION_PREMAKE + 1):
+            lower = start + step * i
+            upper = lower + step
+            # Диапазон уже покрыт (в т.ч. секцией с другим интервалом после его смены)
+            if any(lo < upper and lower < hi for lo, hi in existing):
+                continue
+            name = partition_name(lower)
+            await _create_partition(conn, name, lower, upper)
+            created.append(name)
+
+    if created:
+        logger.info(f"🗂️ Created partitions: {', '.join(created)}")
+    return created
+
+
+async def drop_expired_partitions(now: Optional[datetime] = None) -> List[str]:
+    """
+    Удаляет секции, целиком вышедшие за METRICS_RETENTION_DAYS.
+    DROP секции вместо построчного DELETE: мгновенно и без bloat; в
+    default-секции (обычно пустой) просроченные строки удаляются DELETE.
+    """
+    if METRICS_RETENTION_DAYS <= 0:
+        return []
+
+    cutoff = (now or datetime.now(timezone.utc)) - timedelta(days=METRICS_RETENTION_DAYS)
+    dropped = []
+
+    async with get_engine("background").begin() as conn:
+        if not await is_partitioned(conn):
+            return dropped
+
+        await conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": _MAINTENANCE_LOCK_KEY})
+
+        for name in await list_partitions(conn):
+            bounds = parse_partition_bounds(name)
+            # Секция удаляется, только если её верхняя граница старше cutoff
+            if bounds is None or bounds[1] > cutoff:
+                continue
+            await conn.execute(text(f'DROP TABLE IF EXISTS "{name}"'))
+            dropped.append(name)
+
+        if DEFAULT_PARTITION in await list_partitions(conn):
+            await conn.execute(
+                text(f'DELETE FROM "{DEFAULT_PARTITION}" WHERE timestamp < :cutoff'),
+                {"cutoff": cutoff}
+            )
+
+    if dropped:
+        logger.info(f"🗑️ Dropped expired partitions: {', '.join(dropped)}")
+    return dropped
+
+
+async def partition_maintainer():
+    """Фоновая задача: заранее создаёт секции и удаляет просроченные."""
+    while True:
+        try:
+            await ensure_partitions()
+            await drop_expired_partitions()
+        except Exception as e:
+            logger.warning(f"⚠️ Partition maintenance error (will retry): {e}")
+
+        await asyncio.sleep(PARTITION_MAINTENANCE_INTERVAL_SECONDS)
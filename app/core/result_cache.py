@@ -0,0 +1,277 @@
+import hashlib
+import logging
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Sequence, Set
+
+from prometheus_client import Counter, Gauge
+from pydantic_core import from_json, to_json
+
+from app.core.db import DATABASE_REPLICA_URLS, DB_REPLICA_MAX_LAG_SECONDS
+from app.core.fastpath import fetch_history
+from app.utils.history_formats import RAW_COLUMNS, encode_json
+
+try:
+    from redis import asyncio as redis_asyncio
+except ImportError:  # Redis - опциональная зависимость общего кэша
+    redis_asyncio = None
+
+logger = logging.getLogger(__name__)
+
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "true").lower() == "true"
+# memory - только кэш процесса; redis - поверх него общий кэш воркеров и реплик
+RESULT_CACHE_BACKEND = os.getenv("RESULT_CACHE_BACKEND", "memory").lower()
+RESULT_CACHE_REDIS_URL = os.getenv("RESULT_CACHE_REDIS_URL", "redis://localhost:6379/0")
+# Лимит кэша процесса в байтах; вытесняются давно не читанные записи
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+# Размер чанка истории: диапазон запроса режется по границам, кратным ему
+RESULT_CACHE_CHUNK_SECONDS = int(os.getenv("RESULT_CACHE_CHUNK_SECONDS", "300"))
+# Чанк закрыт (неизменен), когда с его конца прошло столько секунд: запас на сброс
+# буфера приёма и транзакции, начатые до конца чанка
+RESULT_CACHE_SETTLE_SECONDS = float(os.getenv("RESULT_CACHE_SETTLE_SECONDS", "30"))
+# /unique-tags: ключ включает номер интервала такой длины - ответ живёт не дольше него
+RESULT_CACHE_TAGS_BUCKET_SECONDS = int(os.getenv("RESULT_CACHE_TAGS_BUCKET_SECONDS", "30"))
+# TTL записей в общем кэше (история читается не глубже суток)
+RESULT_CACHE_SHARED_TTL_SECONDS = int(os.getenv("RESULT_CACHE_SHARED_TTL_SECONDS", str(2 * 86400)))
+
+# Чтение истории идёт с реплики - чанк закрывается только после того, как она его догонит
+_SETTLE_SECONDS = RESULT_CACHE_SETTLE_SECONDS + (DB_REPLICA_MAX_LAG_SECONDS if DATABASE_REPLICA_URLS else 0)
+
+# Префикс ключей: версия меняется при изменении формата значений
+_KEY_PREFIX = "mksvc:rc:v1:"
+
+# --- Внутренние метрики кэша (видны на /metrics/internal) ---
+RESULT_CACHE_LOOKUPS = Counter(
+    "result_cache_lookups_total",
+    "Result cache lookups (open - chunk still receiving data, always queried)",
+    ["cache", "result"],
+)
+RESULT_CACHE_BYTES = Gauge(
+    "result_cache_bytes",
+    "Bytes held by the in-process result cache",
+)
+RESULT_CACHE_ENTRIES = Gauge(
+    "result_cache_entries",
+    "Entries held by the in-process result cache",
+)
+
+
+class CacheBackend:
+    """
+    Хранилище готовых результатов: строковый ключ -> bytes.
+
+    Значения неизменны - ключ однозначно задаёт содержимое, поэтому
+    инвалидации нет. Ошибка backend для вызывающего кода - просто промах.
+    """
+
+    async def get_many(self, keys: Sequence[str]) -> Dict[str, bytes]:
+        raise NotImplementedError
+
+    async def set_many(self, items: Dict[str, bytes]):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class MemoryCache(CacheBackend):
+    """LRU в процессе, ограниченный суммарным размером значений в байтах."""
+
+    def __init__(self, max_bytes: int = RESULT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[bytes]:
+        value = self._entries.get(key)
+        if value is not None:
+            self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: str, value: bytes):
+        # Значение больше всего кэша вытеснило бы всё остальное
+        if len(value) > self.max_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self.size -= len(previous)
+        self._entries[key] = value
+        self.size += len(value)
+        while self.size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= len(evicted)
+        RESULT_CACHE_BYTES.set(self.size)
+        RESULT_CACHE_ENTRIES.set(len(self._entries))
+
+    async def get_many(self, keys: Sequence[str]) -> Dict[str, bytes]:
+        found = {}
+        for key in keys:
+            value = self.get(key)
+            if value is not None:
+                found[key] = value
+        return found
+
+    async def set_many(self, items: Dict[str, bytes]):
+        for key, value in items.items():
+            self.put(key, value)
+
+
+class RedisCache(CacheBackend):
+    """Общий кэш в Redis: один MGET на чтение, запись пайплайном SET ... EX."""
+
+    def __init__(self, url: str, ttl_seconds: int = RESULT_CACHE_SHARED_TTL_SECONDS):
+        if redis_asyncio is None:
+            raise RuntimeError("RESULT_CACHE_BACKEND=redis requires the redis package")
+        self.ttl_seconds = ttl_seconds
+        self._client = redis_asyncio.from_url(url)
+
+    async def get_many(self, keys: Sequence[str]) -> Dict[str, bytes]:
+        if not keys:
+            return {}
+        try:
+            values = await self._client.mget(keys)
+        except Exception as e:
+            logger.warning(f"⚠️ Shared result cache read failed: {e}")
+            return {}
+        return {key: value for key, value in zip(keys, values) if value is not None}
+
+    async def set_many(self, items: Dict[str, bytes]):
+        if not items:
+            return
+        try:
+            async with self._client.pipeline(transaction=False) as pipe:
+                for key, value in items.items():
+                    pipe.set(key, value, ex=self.ttl_seconds)
+                await pipe.execute()
+        except Exception as e:
+            logger.warning(f"⚠️ Shared result cache write failed: {e}")
+
+    async def close(self):
+        await self._client.aclose()
+
+
+class TieredCache(CacheBackend):
+    """Кэш процесса перед общим: попадания из общего кэша копируются в локальный."""
+
+    def __init__(self, local: MemoryCache, shared: CacheBackend):
+        self.local = local
+        self.shared = shared
+
+    async def get_many(self, keys: Sequence[str]) -> Dict[str, bytes]:
+        found = await self.local.get_many(keys)
+        missing = [key for key in keys if key not in found]
+        if missing:
+            shared = await self.shared.get_many(missing)
+            await self.local.set_many(shared)
+            found.update(shared)
+        return found
+
+    async def set_many(self, items: Dict[str, bytes]):
+        await self.local.set_many(items)
+        await self.shared.set_many(items)
+
+    async def close(self):
+        await self.shared.close()
+
+
+def create_result_cache(kind: str = RESULT_CACHE_BACKEND) -> CacheBackend:
+    local = MemoryCache(RESULT_CACHE_MAX_BYTES)
+    if kind == "redis":
+        return TieredCache(local, RedisCache(RESULT_CACHE_REDIS_URL))
+    if kind == "memory":
+        return local
+    raise ValueError(f"Unknown RESULT_CACHE_BACKEND: {kind}")
+
+
+result_cache = create_result_cache()
+
+
+def _digest(value) -> str:
+    return hashlib.blake2b(to_json(value), digest_size=12).hexdigest()
+
+
+# --- История: неизменные чанки, выровненные по времени ---
+
+def _chunk_start(ts: float, chunk_seconds: int) -> int:
+    return int(ts // chunk_seconds) * chunk_seconds
+
+
+def _concat(bodies: Sequence[bytes]) -> bytes:
+    """Склейка JSON-массивов без повторной сериализации."""
+    return b"[" + b",".join(body[1:-1] for body in bodies if len(body) > 2) + b"]"
+
+
+def _trim(body: bytes, since: datetime) -> bytes:
+    """Строки чанка не раньше since (только первый чанк диапазона, ради границы запроса)."""
+    rows = from_json(body)
+    return to_json([
+        row for row in rows
+        if datetime.fromisoformat(row["timestamp"].replace("Z", "+00:00")) >= since
+    ])
+
+
+async def cached_history(series_ids: Set[int], since: datetime, now: datetime) -> bytes:
+    """
+    Сырые точки серий series_ids с момента since - JSON-массив, как у /history.
+
+    Диапазон режется на чанки по RESULT_CACHE_CHUNK_SECONDS от эпохи. Закрытые
+    чанки (конец старше RESULT_CACHE_SETTLE_SECONDS) неизменны и берутся из
+    кэша; в БД уходит один запрос - с начала первого отсутствующего чанка, то
+    есть при обновлении дашборда только открытый хвост. Ключ чанка - набор серий
+    и начало чанка, а не since: сдвиг окна на каждом обновлении не ломает попадания.
+    """
+    if not series_ids:
+        return b"[]"
+
+    chunk_seconds = RESULT_CACHE_CHUNK_SECONDS
+    series_digest = _digest(sorted(series_ids))
+    starts = list(range(_chunk_start(since.timestamp(), chunk_seconds), int(now.timestamp()) + 1, chunk_seconds))
+    closed_before = now.timestamp() - _SETTLE_SECONDS
+    keys = {
+        start: f"{_KEY_PREFIX}history:{chunk_seconds}:{series_digest}:{start}"
+        for start in starts if start + chunk_seconds <= closed_before
+    }
+
+    cached = await result_cache.get_many(list(keys.values()))
+    bodies: Dict[int, bytes] = {start: cached[key] for start, key in keys.items() if key in cached}
+    RESULT_CACHE_LOOKUPS.labels("history", "hit").inc(len(bodies))
+    RESULT_CACHE_LOOKUPS.labels("history", "miss").inc(len(keys) - len(bodies))
+    RESULT_CACHE_LOOKUPS.labels("history", "open").inc(len(starts) - len(keys))
+
+    missing = [start for start in starts if start not in bodies]
+    if missing:
+        fetch_from = missing[0]
+        # Целый первый чанк, а не с since: иначе его нельзя положить в кэш
+        records = await fetch_history(sorted(series_ids), datetime.fromtimestamp(fetch_from, timezone.utc))
+
+        rows_by_chunk: Dict[int, List] = {start: [] for start in starts if start >= fetch_from}
+        for record in records:
+            rows_by_chunk.setdefault(_chunk_start(record["timestamp"].timestamp(), chunk_seconds), []).append(record)
+        for start, rows in rows_by_chunk.items():
+            bodies[start] = encode_json(rows, RAW_COLUMNS)
+
+        await result_cache.set_many({keys[start]: bodies[start] for start in missing if start in keys})
+
+    if since.timestamp() > starts[0]:
+        bodies[starts[0]] = _trim(bodies[starts[0]], since)
+    return _concat([bodies[start] for start in sorted(bodies)])
+
+
+# --- Ответы без временного диапазона: ключ выровнен по интервалу ---
+
+def bucketed_key(name: str, *params) -> str:
+    """Ключ, действующий до конца текущего интервала RESULT_CACHE_TAGS_BUCKET_SECONDS."""
+    bucket = int(time.time() // RESULT_CACHE_TAGS_BUCKET_SECONDS)
+    return f"{_KEY_PREFIX}{name}:{bucket}:{_digest(params)}"
+
+
+async def cache_get(cache: str, key: str) -> Optional[bytes]:
+    value = (await result_cache.get_many([key])).get(key)
+    RESULT_CACHE_LOOKUPS.labels(cache, "miss" if value is None else "hit").inc()
+    return value
+
+
+async def cache_set(key: str, value: bytes):
+    await result_cache.set_many({key: value})
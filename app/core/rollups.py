@@ -0,0 +1,369 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Hashable, List, Optional, Tuple, Type
+
+from sqlalchemy import select, func, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.blocks import Sample, from_micros, load_block_samples
+from app.core.db import session_maker
+from app.core.series import restrict_to_series
+from app.core.stream_aggregator import WindowStats
+from app.models.metric import Metric
+from app.models.rollup import MetricRollup1m, MetricRollup5m, MetricRollup1h, RollupWatermark
+from app.utils.aggregators import sketch_bucket_columns, sketch_aggregate_columns
+from app.utils.sketches import DDSketch
+
+logger = logging.getLogger(__name__)
+
+# Период запуска фонового задания
+ROLLUP_INTERVAL_SECONDS = int(os.getenv("ROLLUP_INTERVAL_SECONDS", "30"))
+# Бакет считается закрытым через столько секунд после своего конца
+# (запас на write-behind буфер и запаздывающие вставки)
+ROLLUP_LAG_SECONDS = int(os.getenv("ROLLUP_LAG_SECONDS", "15"))
+# Сколько уже посчитанных бакетов пересчитывать на каждом проходе
+ROLLUP_RECOMPUTE_BUCKETS = int(os.getenv("ROLLUP_RECOMPUTE_BUCKETS", "1"))
+# С какой глубины начинать при первом запуске
+ROLLUP_INITIAL_LOOKBACK_HOURS = int(os.getenv("ROLLUP_INITIAL_LOOKBACK_HOURS", "24"))
+# Максимальный диапазон одного прохода на уровень (догоняем порциями)
+ROLLUP_MAX_SPAN_HOURS = int(os.getenv("ROLLUP_MAX_SPAN_HOURS", "6"))
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_UPSERT_CHUNK_SIZE = 2000
+_ROLLUP_LOCK_KEY = 0x726F6C6C  # "roll"
+
+# Ключ бакета: (series_id, bucket)
+BucketKey = Tuple[int, datetime]
+
+
+class RollupLevel:
+    def __init__(self, name: str, step_seconds: int, model: Type, source: Optional[str], retention_days: int):
+        self.name = name
+        self.step_seconds = step_seconds
+        self.step = timedelta(seconds=step_seconds)
+        self.model = model
+        self.source = source
+        self.retention_days = retention_days
+
+
+# Уровни от мелкого к грубому; каждый строится из предыдущего
+ROLLUP_LEVELS: List[RollupLevel] = [
+    RollupLevel("1m", 60, MetricRollup1m, None, int(os.getenv("ROLLUP_1M_RETENTION_DAYS", "7"))),
+    RollupLevel("5m", 300, MetricRollup5m, "1m", int(os.getenv("ROLLUP_5M_RETENTION_DAYS", "90"))),
+    RollupLevel("1h", 3600, MetricRollup1h, "5m", int(os.getenv("ROLLUP_1H_RETENTION_DAYS", "730"))),
+]
+_LEVELS_BY_NAME = {level.name: level for level in ROLLUP_LEVELS}
+
+
+def floor_time(ts: datetime, step_seconds: int) -> datetime:
+    """Выравнивает ts вниз по сетке step_seconds от unix epoch."""
+    offset = int((ts - _EPOCH).total_seconds()) // step_seconds * step_seconds
+    return _EPOCH + timedelta(seconds=offset)
+
+
+def choose_level(step_seconds: int) -> Optional[RollupLevel]:
+    """
+    Самый грубый уровень, чьи бакеты целиком укладываются в бакеты шага:
+    step_seconds кратен шагу уровня. Иначе бакет уровня разрезался бы
+    границей шага (90s поверх 1m) и попадал бы целиком не в тот бакет.
+    """
+    chosen = None
+    for level in ROLLUP_LEVELS:
+        if step_seconds % level.step_seconds == 0:
+            chosen = level
+    return chosen
+
+
+def _add_partial(stats: WindowStats, count: int, total: float, min_value: float, max_value: float):
+    stats.count += count
+    stats.total += total
+    stats.min = min(stats.min, min_value)
+    stats.max = max(stats.max, max_value)
+
+
+async def aggregate_raw_buckets(
+        session: AsyncSession,
+        since: datetime,
+        until: datetime,
+        step_seconds: int,
+        service_name: Optional[str] = None,
+        metric_name: Optional[str] = None,
+        tags_filter: Optional[Dict[str, str]] = None,
+        by_series: bool = True
+) -> Dict[Hashable, WindowStats]:
+    """
+    Агрегирует сырые точки [since, until) в бакеты по step_seconds (date_bin).
+    Перцентили - через корзины DDSketch, посчитанные в SQL. Точки, уже
+    перенесённые в сжатые блоки, докладываются в те же бакеты в Python -
+    вызывающий код читает оба источника из одного снимка (REPEATABLE READ).
+
+    Ключ результата: (series_id, bucket) при by_series, иначе просто bucket.
+    """
+    bucket_expr = func.date_bin(timedelta(seconds=step_seconds), Metric.timestamp, _EPOCH)
+    sign_expr, key_expr = sketch_bucket_columns(Metric.value)
+
+    group_cols = [bucket_expr.label("bucket")]
+    if by_series:
+        group_cols = [Metric.series_id] + group_cols
+
+    query = select(
+        *group_cols,
+        sign_expr.label("sk_sign"),
+        key_expr.label("sk_key"),
+        *sketch_aggregate_columns(Metric.value)
+    ).where(
+        Metric.timestamp >= since,
+        Metric.timestamp < until
+    )
+    query = await restrict_to_series(session, query, Metric.series_id, service_name, metric_name, tags_filter)
+    query = query.group_by(*group_cols[:-1], bucket_expr, sign_expr, key_expr)
+
+    buckets: Dict[Hashable, WindowStats] = {}
+    result = await session.execute(query)
+    for row in result:
+        if by_series:
+            key = (row.series_id, row.bucket)
+        else:
+            key = row.bucket
+        stats = buckets.get(key)
+        if stats is None:
+            stats = buckets[key] = WindowStats()
+        _add_partial(stats, row.count, float(row.total), float(row.min_value), float(row.max_value))
+        stats.sketch.add_bucket(row.sk_sign, row.sk_key, row.count)
+
+    # Холодная часть диапазона лежит в сжатых блоках
+    _add_block_samples(
+        buckets, await load_block_samples(session, since, until, service_name, metric_name, tags_filter),
+        step_seconds, by_series
+    )
+    return buckets
+
+
+def _add_block_samples(buckets: Dict[Hashable, WindowStats], samples: Dict[int, List[Sample]],
+                       step_seconds: int, by_series: bool):
+    """Раскладывает точки блоков по бакетам с теми же границами, что у date_bin от epoch."""
+    step_us = step_seconds * 1_000_000
+    for series_id, points in samples.items():
+        for ts_us, _, value in points:
+            bucket = from_micros(ts_us // step_us * step_us)
+            key = (series_id, bucket) if by_series else bucket
+            stats = buckets.get(key)
+            if stats is None:
+                stats = buckets[key] = WindowStats()
+            stats.add(value)
+
+
+async def load_rollup_buckets(
+        session: AsyncSession,
+        level: RollupLevel,
+        since: datetime,
+        until: datetime,
+        step_seconds: int,
+        service_name: Optional[str] = None,
+        metric_name: Optional[str] = None,
+        tags_filter: Optional[Dict[str, str]] = None,
+        by_series: bool = True
+) -> Dict[Hashable, WindowStats]:
+    """Читает бакеты уровня level из [since, until) и сливает их в бакеты по step_seconds."""
+    model = level.model
+    query = select(model)
+    query = await restrict_to_series(session, query, model.series_id, service_name, metric_name, tags_filter)
+    query = query.where(model.bucket >= since, model.bucket < until)
+
+    buckets: Dict[Hashable, WindowStats] = {}
+    result = await session.execute(query)
+    for row in result.scalars():
+        bucket = floor_time(row.bucket, step_seconds)
+        key = (row.series_id, bucket) if by_series else bucket
+        stats = buckets.get(key)
+        if stats is None:
+            stats = buckets[key] = WindowStats()
+        _add_partial(stats, row.count, row.sum, row.min, row.max)
+        stats.sketch.merge(DDSketch.from_bytes(row.sketch))
+
+    return buckets
+
+
+async def get_watermark(session: AsyncSession, level_name: str) -> Optional[datetime]:
+    result = await session.execute(
+        select(RollupWatermark.watermark).where(RollupWatermark.level == level_name)
+    )
+    return result.scalar()
+
+
+async def set_watermark(session: AsyncSession, level_name: str, watermark: datetime):
+    stmt = pg_insert(RollupWatermark).values(level=level_name, watermark=watermark)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[RollupWatermark.level],
+        set_={"watermark": stmt.excluded.watermark}
+    )
+    await session.execute(stmt)
+
+
+async def _upsert_buckets(session: AsyncSession, level: RollupLevel, buckets: Dict[BucketKey, WindowStats]):
+    model = level.model
+    rows = [
+        {
+            "series_id": series_id,
+            "bucket": bucket,
+            "count": stats.count,
+            "sum": stats.total,
+            "min": stats.min,
+            "max": stats.max,
+            "sketch": stats.sketch.to_bytes(),
+        }
+        for (series_id, bucket), stats in buckets.items()
+    ]
+
+    for start in range(0, len(rows), _UPSERT_CHUNK_SIZE):
+        stmt = pg_insert(model).values(rows[start:start + _UPSERT_CHUNK_SIZE])
+        # Бакет пересчитывается из источника целиком, поэтому значения заменяются
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[model.series_id, model.bucket],
+            set_={col: stmt.excluded[col] for col in ("count", "sum", "min", "max", "sketch")}
+        )
+        await session.execute(stmt)
+
+
+async def _rollup_level(session: AsyncSession, level: RollupLevel, now: datetime) -> int:
+    """Досчитывает закрытые бакеты уровня. Возвращает число записанных бакетов."""
+    end = floor_time(now - timedelta(seconds=ROLLUP_LAG_SECONDS), level.step_seconds)
+
+    if level.source:
+        # Грубый уровень не может обогнать свой источник
+        source_watermark = await get_watermark(session, level.source)
+        if source_watermark is None:
+            return 0
+        end = min(end, floor_time(source_watermark, level.step_seconds))
+
+    watermark = await get_watermark(session, level.name)
+    if watermark is None:
+        watermark = floor_time(now - timedelta(hours=ROLLUP_INITIAL_LOOKBACK_HOURS), level.step_seconds)
+
+    start = floor_time(watermark, level.step_seconds) - level.step * ROLLUP_RECOMPUTE_BUCKETS
+    end = min(end, start + timedelta(hours=ROLLUP_MAX_SPAN_HOURS))
+    if start >= end:
+        return 0
+
+    if level.source:
+        buckets = await load_rollup_buckets(session, _LEVELS_BY_NAME[level.source], start, end, level.step_seconds)
+    else:
+        buckets = await aggregate_raw_buckets(session, start, end, level.step_seconds)
+
+    await _upsert_buckets(session, level, buckets)
+    await set_watermark(session, level.name, max(end, watermark))
+
+    if level.retention_days > 0:
+        cutoff = now - timedelta(days=level.retention_days)
+        await session.execute(level.model.__table__.delete().where(level.model.bucket < cutoff))
+
+    return len(buckets)
+
+
+async def run_rollups(now: Optional[datetime] = None) -> Dict[str, int]:
+    """
+    Один проход по всем уровням. Выполняется под advisory lock,
+    чтобы при нескольких воркерах rollup считал только один.
+    """
+    now = now or datetime.now(timezone.utc)
+    written = {}
+
+    async with session_maker("background")() as session:
+        locked = await session.execute(text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": _ROLLUP_LOCK_KEY})
+        if not locked.scalar():
+            return written
+
+        for level in ROLLUP_LEVELS:
+            written[level.name] = await _rollup_level(session, level, now)
+
+        await session.commit()
+
+    return written
+
+
+async def rollup_maintainer():
+    """Фоновая задача инкрементального обновления rollup-таблиц."""
+    while True:
+        try:
+            written = await run_rollups()
+            if any(written.values()):
+                logger.debug(f"📦 Rollups updated: {written}")
+        except Exception as e:
+            logger.warning(f"⚠️ Rollup error (will retry): {e}")
+
+        await asyncio.sleep(ROLLUP_INTERVAL_SECONDS)
+
+
+def rollup_points(buckets: Dict[datetime, WindowStats]) -> List[Dict]:
+    """Точки истории с шагом (колонки ROLLUP_COLUMNS) из статистик бакетов, по времени."""
+    points = []
+    for bucket in sorted(buckets):
+        stats = buckets[bucket]
+        p50, p95, p99 = stats.sketch.quantiles((0.5, 0.95, 0.99))
+        points.append({
+            "timestamp": bucket,
+            "count": stats.count,
+            "sum": stats.total,
+            "avg_value": stats.total / stats.count if stats.count else 0.0,
+            "min_value": stats.min,
+            "max_value": stats.max,
+            "p50": p50,
+            "p95": p95,
+            "p99": p99,
+        })
+    return points
+
+
+async def query_rollup_history(
+        session: AsyncSession,
+        service_name: str,
+        metric_name: str,
+        tags_filter: Optional[Dict[str, str]],
+        since: datetime,
+        until: datetime,
+        step_seconds: int
+) -> Optional[List[Dict]]:
+    """
+    История с шагом step_seconds из самого грубого подходящего rollup.
+    Закрытые бакеты читаются из rollup-таблицы, хвост после watermark -
+    из сырых точек и сжатых блоков (watermark 5m/1h может отставать от
+    сжатия). Шаг, не кратный ни одному уровню, считается целиком по сырым
+    точкам и блокам. None, если шаг мельче минимального уровня.
+    """
+    if step_seconds < ROLLUP_LEVELS[0].step_seconds:
+        return None
+
+    since = floor_time(since, step_seconds)
+    level = choose_level(step_seconds)
+    if level is None:
+        buckets = await aggregate_raw_buckets(
+            session, since, until, step_seconds,
+            service_name, metric_name, tags_filter, by_series=False
+        )
+        return rollup_points(buckets)
+
+    watermark = await get_watermark(session, level.name) or since
+    rollup_until = min(max(watermark, since), until)
+
+    buckets: Dict[datetime, WindowStats] = {}
+    if rollup_until > since:
+        buckets = await load_rollup_buckets(
+            session, level, since, rollup_until, step_seconds,
+            service_name, metric_name, tags_filter, by_series=False
+        )
+
+    if until > rollup_until:
+        tail = await aggregate_raw_buckets(
+            session, rollup_until, until, step_seconds,
+            service_name, metric_name, tags_filter, by_series=False
+        )
+        for bucket, stats in tail.items():
+            if bucket in buckets:
+                buckets[bucket].merge(stats)
+            else:
+                buckets[bucket] = stats
+
+    return rollup_points(buckets)
@@ -0,0 +1,193 @@
+import hashlib
+import json
+import logging
+import os
+from collections import OrderedDict
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+from sqlalchemy import select, literal, any_, BigInteger
+from sqlalchemy.dialects.postgresql import ARRAY, insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.db import get_engine
+from app.core.tag_index import tag_index, TAG_INDEX_ENABLED, TAG_INDEX_MAX_IN_LIST
+from app.models.series import Series
+from app.schemas.metric import MetricCreate
+
+logger = logging.getLogger(__name__)
+
+# Размер LRU-кэша известных серий в процессе
+SERIES_CACHE_SIZE = int(os.getenv("SERIES_CACHE_SIZE", "100000"))
+
+# 4 параметра на строку - укладываемся в лимит параметров Postgres
+_REGISTER_CHUNK_SIZE = 5000
+
+# Ключ серии в кэше: (service_name, metric_name, отсортированные пары тегов)
+SeriesKey = Tuple[str, str, Tuple[Tuple[str, str], ...]]
+
+
+class SeriesInfo(NamedTuple):
+    id: int
+    service_name: str
+    metric_name: str
+    tags: Dict[str, str]
+
+
+def series_key(service_name: str, metric_name: str, tags: Optional[Dict[str, str]]) -> SeriesKey:
+    return service_name, metric_name, tuple(sorted((tags or {}).items()))
+
+
+def compute_series_id(key: SeriesKey) -> int:
+    """
+    Стабильный id серии: первые 8 байт blake2b от канонического JSON ключа,
+    как знаковое 64-битное число (колонка BIGINT). Одинаков во всех процессах.
+    Формат менять нельзя: id уже записаны в базах (замороженная копия - в миграции 0003).
+    """
+    canonical = json.dumps([key[0], key[1], key[2]], separators=(",", ":"), ensure_ascii=False)
+    digest = hashlib.blake2b(canonical.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+class SeriesRegistry:
+    """
+    In-process LRU: ключ серии -> series_id для серий, уже записанных в таблицу series.
+
+    Горячий путь приёма (попадание в кэш) не обращается к БД вообще.
+    Новые серии вставляются одним INSERT ... ON CONFLICT DO NOTHING в отдельной
+    короткой транзакции и только после её успеха попадают в кэш.
+    """
+
+    def __init__(self, max_size: int = SERIES_CACHE_SIZE):
+        self.max_size = max_size
+        self._by_key: "OrderedDict[SeriesKey, int]" = OrderedDict()
+        self._by_id: "OrderedDict[int, SeriesInfo]" = OrderedDict()
+
+    def _remember(self, key: SeriesKey, series_id: int):
+        self._by_key[key] = series_id
+        self._by_key.move_to_end(key)
+        info = self._by_id[series_id] = SeriesInfo(series_id, key[0], key[1], dict(key[2]))
+        self._by_id.move_to_end(series_id)
+        # Индекс тегов пополняется здесь же: известная серия - уже в индексе
+        tag_index.add(series_id, info.service_name, info.metric_name, info.tags)
+        while len(self._by_key) > self.max_size:
+            _, evicted_id = self._by_key.popitem(last=False)
+            self._by_id.pop(evicted_id, None)
+
+    def get(self, series_id: int) -> Optional[SeriesInfo]:
+        return self._by_id.get(series_id)
+
+    async def resolve_many(self, metrics: Sequence[MetricCreate]) -> List[int]:
+        """series_id для каждой метрики; незнакомые серии регистрируются в БД."""
+        ids: List[int] = []
+        missing: Dict[SeriesKey, int] = {}
+
+        for metric in metrics:
+            key = series_key(metric.service_name, metric.metric_name, metric.tags)
+            series_id = self._by_key.get(key)
+            if series_id is None:
+                series_id = missing.get(key)
+                if series_id is None:
+                    series_id = missing[key] = compute_series_id(key)
+            else:
+                self._by_key.move_to_end(key)
+            ids.append(series_id)
+
+        if missing:
+            await self._register(missing)
+
+        return ids
+
+    async def resolve(self, metric: MetricCreate) -> int:
+        return (await self.resolve_many([metric]))[0]
+
+    async def _register(self, missing: Dict[SeriesKey, int]):
+        rows = [
+            {"id": series_id, "service_name": key[0], "metric_name": key[1], "tags": dict(key[2])}
+            for key, series_id in missing.items()
+        ]
+        async with get_engine("ingest").begin() as conn:
+            for start in range(0, len(rows), _REGISTER_CHUNK_SIZE):
+                stmt = pg_insert(Series).values(rows[start:start + _REGISTER_CHUNK_SIZE])
+                await conn.execute(stmt.on_conflict_do_nothing(index_elements=[Series.id]))
+
+        for key, series_id in missing.items():
+            self._remember(key, series_id)
+
+    async def load(self, session: AsyncSession, series_ids: Iterable[int]) -> Dict[int, SeriesInfo]:
+        """Описания серий по id: из кэша, недостающие - одним запросом к series."""
+        found: Dict[int, SeriesInfo] = {}
+        unknown = []
+        for series_id in set(series_ids):
+            info = self._by_id.get(series_id)
+            if info is None:
+                unknown.append(series_id)
+            else:
+                found[series_id] = info
+
+        if unknown:
+            result = await session.execute(
+                select(Series.id, Series.service_name, Series.metric_name, Series.tags).where(Series.id.in_(unknown))
+            )
+            for row in result:
+                info = SeriesInfo(row.id, row.service_name, row.metric_name, row.tags or {})
+                found[row.id] = info
+                self._remember(series_key(row.service_name, row.metric_name, row.tags), row.id)
+
+        return found
+
+
+def series_filter(query, service_name: Optional[str] = None, metric_name: Optional[str] = None,
+                  tags_filter: Optional[Dict[str, str]] = None):
+    """Добавляет к запросу, уже соединённому с series, фильтры по серии."""
+    if service_name:
+        query = query.where(Series.service_name == service_name)
+    if metric_name:
+        query = query.where(Series.metric_name == metric_name)
+    if tags_filter:
+        # @> использует GIN-индекс ix_series_tags (jsonb_path_ops)
+        query = query.where(Series.tags.contains(tags_filter))
+    return query
+
+
+async def indexed_series_ids(service_name: Optional[str] = None,
+                             metric_name: Optional[str] = None,
+                             tags_filter: Optional[Dict[str, str]] = None) -> Optional[Set[int]]:
+    """
+    series_id серий, подходящих под фильтры, по индексу тегов. Серии других
+    воркеров догружаются не чаще TAG_INDEX_REQUEST_REFRESH_MS, а не на каждый
+    запрос. None - индекс не загружен или серий больше TAG_INDEX_MAX_IN_LIST:
+    фильтровать выгоднее соединением с series.
+    """
+    if not (TAG_INDEX_ENABLED and tag_index.ready):
+        return None
+    await tag_index.refresh_if_stale()
+    series_ids = tag_index.resolve(service_name, metric_name, tags_filter)
+    if len(series_ids) > TAG_INDEX_MAX_IN_LIST:
+        return None
+    return series_ids
+
+
+async def restrict_to_series(session: AsyncSession, query, series_id_column,
+                             service_name: Optional[str] = None, metric_name: Optional[str] = None,
+                             tags_filter: Optional[Dict[str, str]] = None, joined: bool = False):
+    """
+    Ограничивает запрос по series_id_column сериями, подходящими под фильтры.
+
+    Если индекс тегов загружен и серий немного - фильтр резолвится в памяти
+    в series_id = ANY(массив) (индекс ix_metrics_series_ts); серии других
+    воркеров индекс догружает с ограниченной частотой (indexed_series_ids).
+    Иначе - соединение с series (joined=True: запрос уже соединён) и фильтр там.
+    """
+    if not (service_name or metric_name or tags_filter):
+        return query
+
+    series_ids = await indexed_series_ids(service_name, metric_name, tags_filter)
+    if series_ids is not None:
+        return query.where(series_id_column == any_(literal(sorted(series_ids), ARRAY(BigInteger))))
+
+    if not joined:
+        query = query.join(Series, Series.id == series_id_column)
+    return series_filter(query, service_name, metric_name, tags_filter)
+
+
+series_registry = SeriesRegistry()
@@ -0,0 +1,251 @@
+import logging
+import math
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from app.schemas.metric import MetricCreate
+from app.utils.sketches import DDSketch, DEFAULT_RELATIVE_ACCURACY
+
+logger = logging.getLogger(__name__)
+
+# Сколько секунд истории держим в памяти и с каким шагом под-окон
+STREAM_AGG_RETENTION_SECONDS = int(os.getenv("STREAM_AGG_RETENTION_SECONDS", "60"))
+STREAM_AGG_BUCKET_SECONDS = int(os.getenv("STREAM_AGG_BUCKET_SECONDS", "1"))
+
+# Ключ серии: (service_name, metric_name, отсортированные пары тегов)
+SeriesKey = Tuple[str, str, Tuple[Tuple[str, str], ...]]
+
+
+class WindowStats:
+    """Счётчики одного под-окна (или результата слияния под-окон)."""
+
+    __slots__ = ("count", "total", "min", "max", "sketch")
+
+    def __init__(self, relative_accuracy: float = DEFAULT_RELATIVE_ACCURACY):
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.sketch = DDSketch(relative_accuracy)
+
+    def add(self, value: float):
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        self.sketch.add(value)
+
+    def merge(self, other: "WindowStats"):
+        self.count += other.count
+        self.total += other.total
+        if other.min < self.min:
+            self.min = other.min
+        if other.max > self.max:
+            self.max = other.max
+        self.sketch.merge(other.sketch)
+
+
+class SeriesWindow:
+    """Кольцевой буфер под-окон одной серии."""
+
+    __slots__ = ("tags", "slots", "epochs", "last_epoch")
+
+    def __init__(self, tags: Dict[str, str], size: int):
+        self.tags = tags
+        self.slots: List[Optional[WindowStats]] = [None] * size
+        self.epochs: List[int] = [-1] * size
+        self.last_epoch = -1
+
+
+class StreamAggregator:
+    """
+    Инкрементальный агрегатор метрик в памяти.
+
+    Каждая принятая точка раскладывается в под-окно своей серии
+    (service, metric, теги). Агрегат за окно считается слиянием под-окон,
+    поэтому тик стоит O(серий x под-окон) и не зависит от числа точек.
+    Из хранилища читаем только при холодном старте (backfill).
+
+    Видит только метрики, принятые текущим процессом.
+    """
+
+    def __init__(
+            self,
+            retention_seconds: int = STREAM_AGG_RETENTION_SECONDS,
+            bucket_seconds: int = STREAM_AGG_BUCKET_SECONDS,
+            relative_accuracy: float = DEFAULT_RELATIVE_ACCURACY,
+    ):
+        self.retention_seconds = retention_seconds
+        self.bucket_seconds = bucket_seconds
+        self.relative_accuracy = relative_accuracy
+        self.size = math.ceil(retention_seconds / bucket_seconds)
+        self.series: Dict[SeriesKey, SeriesWindow] = {}
+
+    def observe(
+            self,
+            service_name: str,
+            metric_name: str,
+            tags: Optional[Dict[str, str]],
+            value: float,
+            ts: Optional[float] = None
+    ):
+        """Учитывает одну точку; ts - unix time (по умолчанию сейчас)."""
+        tags = tags or {}
+        epoch = int((time.time() if ts is None else ts) // self.bucket_seconds)
+        key = (service_name, metric_name, tuple(sorted(tags.items())))
+
+        window = self.series.get(key)
+        if window is None:
+            window = self.series[key] = SeriesWindow(dict(tags), self.size)
+
+        idx = epoch % self.size
+        slot_epoch = window.epochs[idx]
+        if slot_epoch != epoch:
+            if slot_epoch > epoch:
+                # Точка старше, чем хранит кольцо
+                return
+            window.slots[idx] = WindowStats(self.relative_accuracy)
+            window.epochs[idx] = epoch
+
+        window.slots[idx].add(value)
+        if epoch > window.last_epoch:
+            window.last_epoch = epoch
+
+    def observe_metric(self, metric: MetricCreate, ts: Optional[float] = None):
+        self.observe(metric.service_name, metric.metric_name, metric.tags, metric.value, ts)
+
+    def observe_many(self, metrics: Iterable[MetricCreate], ts: Optional[float] = None):
+        ts = time.time() if ts is None else ts
+        for metric in metrics:
+            self.observe(metric.service_name, metric.metric_name, metric.tags, metric.value, ts)
+
+    def aggregate(
+            self,
+            window_seconds: int = 30,
+            group_by_tags: Optional[List[str]] = None,
+            filter_tags: Optional[Dict[str, str]] = None,
+            now: Optional[float] = None
+    ) -> List[Dict]:
+        """
+        Агрегирует последние window_seconds секунд.
+        Формат результата совпадает с aggregate_last_window.
+        """
+        now_epoch = int((time.time() if now is None else now) // self.bucket_seconds)
+        first_epoch = now_epoch - math.ceil(window_seconds / self.bucket_seconds) + 1
+        expire_before = now_epoch - self.size + 1
+        group_by_tags = group_by_tags or []
+        filter_items = list(filter_tags.items()) if filter_tags else []
+
+        groups: Dict[Tuple, WindowStats] = {}
+        expired = []
+
+        for key, window in self.series.items():
+            if window.last_epoch < expire_before:
+                expired.append(key)
+                continue
+            if window.last_epoch < first_epoch:
+                continue
+
+            tags = window.tags
+            if any(tags.get(k) != v for k, v in filter_items):
+                continue
+
+            group_key = (key[0], key[1], tuple(tags.get(k) for k in group_by_tags))
+            stats = groups.get(group_key)
+
+            for slot, epoch in zip(window.slots, window.epochs):
+                if slot is None or epoch < first_epoch or epoch > now_epoch:
+                    continue
+                if stats is None:
+                    stats = groups[group_key] = WindowStats(self.relative_accuracy)
+                stats.merge(slot)
+
+        for key in expired:
+            del self.series[key]
+
+        aggregates = []
+        for (service_name, metric_name, tag_values), stats in sorted(groups.items(), key=lambda g: g[0][:2]):
+            aggregates.append({
+                "service_name": service_name,
+                "metric_name": metric_name,
+                "avg_value": stats.total / stats.count,
+                "min_value": stats.min,
+                "max_value": stats.max,
+                "p50": stats.sketch.quantile(0.5),
+                "p95": stats.sketch.quantile(0.95),
+                "p99": stats.sketch.quantile(0.99),
+                "count": stats.count,
+                "window_seconds": window_seconds,
+                "tags": {k: v for k, v in zip(group_by_tags, tag_values) if v is not None},
+            })
+
+        return aggregates
+
+    def aggregate_series(self, window_seconds: Optional[int] = None, now: Optional[float] = None) -> List[Dict]:
+        """
+        Агрегаты за последние window_seconds (по умолчанию - весь retention)
+        по каждой серии отдельно, со всеми её тегами. Стоит O(серий x под-окон).
+        """
+        window_seconds = min(window_seconds or self.retention_seconds, self.retention_seconds)
+        now_epoch = int((time.time() if now is None else now) // self.bucket_seconds)
+        first_epoch = now_epoch - math.ceil(window_seconds / self.bucket_seconds) + 1
+        expire_before = now_epoch - self.size + 1
+
+        rows = []
+        expired = []
+        for key, window in self.series.items():
+            if window.last_epoch < expire_before:
+                expired.append(key)
+                continue
+            if window.last_epoch < first_epoch:
+                continue
+
+            stats = WindowStats(self.relative_accuracy)
+            for slot, epoch in zip(window.slots, window.epochs):
+                if slot is not None and first_epoch <= epoch <= now_epoch:
+                    stats.merge(slot)
+            if not stats.count:
+                continue
+
+            p50, p95, p99 = stats.sketch.quantiles((0.5, 0.95, 0.99))
+            rows.append({
+                "service_name": key[0],
+                "metric_name": key[1],
+                "tags": window.tags,
+                "avg_value": stats.total / stats.count,
+                "max_value": stats.max,
+                "min_value": stats.min,
+                "count": stats.count,
+                "p50": p50,
+                "p95": p95,
+                "p99": p99,
+            })
+
+        for key in expired:
+            del self.series[key]
+
+        return rows
+
+    async def backfill(self, source, window_seconds: Optional[int] = None) -> int:
+        """
+        Холодный старт: загружает точки за последние window_seconds
+        (по умолчанию - весь retention) из хранилища source (MetricStorage).
+        Возвращает число точек.
+        """
+        window_seconds = window_seconds or self.retention_seconds
+        since = datetime.now(timezone.utc) - timedelta(seconds=window_seconds)
+
+        loaded = 0
+        async for service_name, metric_name, tags, value, ts in source.scan(since):
+            self.observe(service_name, metric_name, tags, value, ts)
+            loaded += 1
+
+        logger.info(f"📊 Stream aggregator backfilled {loaded} samples from the last {window_seconds}s")
+        return loaded
+
+
+stream_aggregator = StreamAggregator()
@@ -0,0 +1,245 @@
+import asyncio
+import logging
+import os
+import time
+from bisect import bisect_left, insort
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterator, List, Optional, Set
+
+from prometheus_client import Gauge
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.db import session_maker
+from app.models.series import Series
+
+logger = logging.getLogger(__name__)
+
+TAG_INDEX_ENABLED = os.getenv("TAG_INDEX_ENABLED", "true").lower() == "true"
+# Как часто подтягивать серии, зарегистрированные другими воркерами
+TAG_INDEX_REFRESH_SECONDS = int(os.getenv("TAG_INDEX_REFRESH_SECONDS", "30"))
+# Если фильтр даёт больше серий, дешевле соединиться с series, чем передавать массив id
+TAG_INDEX_MAX_IN_LIST = int(os.getenv("TAG_INDEX_MAX_IN_LIST", "5000"))
+# Запрос с фильтром догружает новые серии не чаще раза в N мс на процесс
+# (0 - только фоновая догрузка раз в TAG_INDEX_REFRESH_SECONDS)
+TAG_INDEX_REQUEST_REFRESH_MS = int(os.getenv("TAG_INDEX_REQUEST_REFRESH_MS", "1000"))
+
+# Запас на транзакции регистрации, закоммиченные позже своего created_at
+_REFRESH_OVERLAP = timedelta(seconds=60)
+
+_EMPTY: Set[int] = frozenset()
+
+TAG_INDEX_SERIES = Gauge(
+    "tag_index_series",
+    "Number of series in the in-memory tag index",
+)
+TAG_INDEX_POSTINGS = Gauge(
+    "tag_index_tag_values",
+    "Number of distinct tag key/value pairs in the in-memory tag index",
+)
+
+
+def _prefixed(sorted_items: List[str], prefix: str) -> Iterator[str]:
+    """Элементы отсортированного списка, начинающиеся с prefix (бинарный поиск)."""
+    for i in range(bisect_left(sorted_items, prefix), len(sorted_items)):
+        item = sorted_items[i]
+        if not item.startswith(prefix):
+            break
+        yield item
+
+
+def _intersect(sets: List[Set[int]]) -> Set[int]:
+    """Пересечение постинг-листов, начиная с самого короткого."""
+    sets = sorted(sets, key=len)
+    result = set(sets[0])
+    for other in sets[1:]:
+        if not result:
+            break
+        result &= other
+    return result
+
+
+class TagIndex:
+    """
+    Инвертированный индекс тегов в памяти: ключ -> значение -> множество series_id.
+
+    Плюс постинги по service_name и metric_name, чтобы /unique-tags с фильтрами
+    и резолв tags_filter в набор серий не трогали БД. Ключи и значения
+    хранятся ещё и в отсортированных списках - для поиска по префиксу.
+
+    Пополняется при регистрации серий (SeriesRegistry) и периодически
+    догружает из таблицы series серии, созданные другими процессами.
+    Серии не удаляются: индекс описывает все когда-либо виденные серии.
+    """
+
+    def __init__(self):
+        self._postings: Dict[str, Dict[str, Set[int]]] = {}
+        self._sorted_keys: List[str] = []
+        self._sorted_values: Dict[str, List[str]] = {}
+        self._by_service: Dict[str, Set[int]] = {}
+        self._by_metric: Dict[str, Set[int]] = {}
+        self._known: Set[int] = set()
+        self._value_count = 0
+        # created_at последней загруженной серии; None - полная загрузка ещё не делалась
+        self._loaded_until: Optional[datetime] = None
+        # Монотонное время последней догрузки и блокировка, склеивающая одновременные
+        self._refreshed_at = float("-inf")
+        self._refresh_lock = asyncio.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self._loaded_until is not None
+
+    @property
+    def fresh_since(self) -> Optional[datetime]:
+        """Серии, созданные не раньше этого момента, могут ещё отсутствовать в индексе."""
+        if self._loaded_until is None:
+            return None
+        return self._loaded_until - _REFRESH_OVERLAP
+
+    def __len__(self) -> int:
+        return len(self._known)
+
+    def mark_ready(self):
+        """Индекс полон без загрузки из series: все серии регистрирует владелец (встроенное хранилище)."""
+        if self._loaded_until is None:
+            self._loaded_until = datetime.now(timezone.utc)
+
+    def add(self, series_id: int, service_name: str, metric_name: str, tags: Optional[Dict[str, str]]):
+        if series_id in self._known:
+            return
+        self._known.add(series_id)
+        self._by_service.setdefault(service_name, set()).add(series_id)
+        self._by_metric.setdefault(metric_name, set()).add(series_id)
+
+        for key, value in (tags or {}).items():
+            values = self._postings.get(key)
+            if values is None:
+                values = self._postings[key] = {}
+                self._sorted_values[key] = []
+                insort(self._sorted_keys, key)
+            postings = values.get(value)
+            if postings is None:
+                postings = values[value] = set()
+                insort(self._sorted_values[key], value)
+                self._value_count += 1
+            postings.add(series_id)
+
+        TAG_INDEX_SERIES.set(len(self._known))
+        TAG_INDEX_POSTINGS.set(self._value_count)
+
+    def _candidates(self, service_name: Optional[str], metric_name: Optional[str]) -> List[Set[int]]:
+        sets = []
+        if service_name:
+            sets.append(self._by_service.get(service_name, _EMPTY))
+        if metric_name:
+            sets.append(self._by_metric.get(metric_name, _EMPTY))
+        return sets
+
+    def resolve(
+            self,
+            service_name: Optional[str] = None,
+            metric_name: Optional[str] = None,
+            tags_filter: Optional[Dict[str, str]] = None
+    ) -> Set[int]:
+        """series_id всех серий, подходящих под фильтры (теги - точное совпадение)."""
+        sets = self._candidates(service_name, metric_name)
+        for key, value in (tags_filter or {}).items():
+            sets.append(self._postings.get(key, {}).get(value, _EMPTY))
+        if not sets:
+            return set(self._known)
+        return _intersect(sets)
+
+    def unique_tags(
+            self,
+            service_name: Optional[str] = None,
+            metric_name: Optional[str] = None,
+            key_prefix: str = "",
+            value_prefix: str = "",
+            limit: Optional[int] = None
+    ) -> Dict[str, List[str]]:
+        """
+        Ключи тегов и их значения (отсортированные) для автокомплита.
+        limit ограничивает число значений на ключ.
+        """
+        sets = self._candidates(service_name, metric_name)
+        candidates = _intersect(sets) if sets else None
+        if candidates is not None and not candidates:
+            return {}
+
+        unique = {}
+        for key in _prefixed(self._sorted_keys, key_prefix):
+            values = self._postings[key]
+            matched = []
+            for value in _prefixed(self._sorted_values[key], value_prefix):
+                if candidates is None or not candidates.isdisjoint(values[value]):
+                    matched.append(value)
+                    if limit and len(matched) >= limit:
+                        break
+            if matched:
+                unique[key] = matched
+        return unique
+
+    async def refresh(self, session: Optional[AsyncSession] = None) -> int:
+        """
+        Догружает серии из таблицы series: при первом вызове - все,
+        дальше - созданные после прошлой загрузки (выборка по ix_series_created_at).
+        Возвращает число прочитанных строк.
+        """
+        if session is None:
+            async with session_maker("background", read_only=True)() as session:
+                return await self.refresh(session)
+
+        query = select(Series.id, Series.service_name, Series.metric_name, Series.tags, Series.created_at)
+        if self._loaded_until is not None:
+            query = query.where(Series.created_at >= self.fresh_since)
+
+        loaded = 0
+        loaded_until = self._loaded_until
+        result = await session.stream(query)
+        async for row in result:
+            self.add(row.id, row.service_name, row.metric_name, row.tags)
+            if row.created_at is not None and (loaded_until is None or row.created_at > loaded_until):
+                loaded_until = row.created_at
+            loaded += 1
+
+        if loaded_until is None:
+            # Пустая таблица: считаем индекс загруженным с этого момента
+            loaded_until = datetime.now(timezone.utc)
+        # Параллельные догрузки не должны откатывать отметку назад
+        if self._loaded_until is None or loaded_until > self._loaded_until:
+            self._loaded_until = loaded_until
+        self._refreshed_at = time.monotonic()
+        return loaded
+
+    async def refresh_if_stale(self, max_age_ms: int = TAG_INDEX_REQUEST_REFRESH_MS):
+        """
+        Догрузка на пути запроса: не чаще раза в max_age_ms, одновременные
+        запросы ждут одну догрузку. Ошибка не валит запрос - индекс остаётся
+        как есть до следующей попытки.
+        """
+        if max_age_ms <= 0 or time.monotonic() - self._refreshed_at < max_age_ms / 1000:
+            return
+        async with self._refresh_lock:
+            if time.monotonic() - self._refreshed_at < max_age_ms / 1000:
+                return
+            try:
+                await self.refresh()
+            except Exception as e:
+                self._refreshed_at = time.monotonic()
+                logger.warning(f"⚠️ Tag index refresh on request failed, using loaded series: {e}")
+
+
+async def tag_index_maintainer():
+    """Фоновая задача: подтягивает в индекс серии, созданные другими воркерами."""
+    while True:
+        await asyncio.sleep(TAG_INDEX_REFRESH_SECONDS)
+        try:
+            loaded = await tag_index.refresh()
+            if loaded:
+                logger.debug(f"🏷️ Tag index refreshed: {loaded} series")
+        except Exception as e:
+            logger.warning(f"⚠️ Tag index refresh error (will retry): {e}")
+
+
+tag_index = TagIndex()
@@ -0,0 +1,173 @@
+import math
+import os
+import time
+from bisect import bisect_left
+from typing import Dict, List, Optional, Tuple
+
+
+def _exponential_bounds(start: float, factor: float, count: int) -> List[float]:
+    return [start * factor ** i for i in range(count)]
+
+
+def _classic_bounds() -> List[float]:
+    """
+    Границы классических бакетов: явный список EXPORTER_HISTOGRAM_BUCKETS
+    (фиксированная раскладка) или экспоненциальная start * factor^i.
+    """
+    explicit = os.getenv("EXPORTER_HISTOGRAM_BUCKETS", "").strip()
+    if explicit:
+        return sorted(float(b) for b in explicit.split(","))
+    return _exponential_bounds(
+        float(os.getenv("EXPORTER_HISTOGRAM_START", "1")),
+        float(os.getenv("EXPORTER_HISTOGRAM_FACTOR", "2")),
+        int(os.getenv("EXPORTER_HISTOGRAM_COUNT", "20")),
+    )
+
+
+# Границы le классических бакетов - одни и те же для всех серий и скрейпов
+HISTOGRAM_BOUNDS = _classic_bounds()
+# Начальная схема нативной гистограммы: основание 2^(2^-schema), 3 -> ~9% на бакет
+NATIVE_HISTOGRAM_SCHEMA = int(os.getenv("EXPORTER_NATIVE_HISTOGRAM_SCHEMA", "3"))
+# Больше бакетов - схема понижается (соседние бакеты сливаются попарно)
+NATIVE_HISTOGRAM_MAX_BUCKETS = int(os.getenv("EXPORTER_NATIVE_HISTOGRAM_MAX_BUCKETS", "160"))
+# Значения по модулю не больше порога попадают в нулевой бакет (как в client_golang)
+NATIVE_ZERO_THRESHOLD = 2.0 ** -128
+_MIN_SCHEMA = -4
+
+
+def native_index(value: float, schema: int) -> int:
+    """Индекс бакета (base^(i-1), base^i] для |value| > 0 при base = 2^(2^-schema)."""
+    return math.ceil(math.ldexp(math.log2(value), schema))
+
+
+class CumulativeHistogram:
+    """
+    Гистограмма одной серии с момента старта процесса: счётчики только
+    растут, границы бакетов не меняются - Prometheus хранит стабильный
+    набор рядов и считает rate / histogram_quantile сам.
+
+    Ведёт одновременно классические бакеты (HISTOGRAM_BOUNDS) и разреженные
+    экспоненциальные бакеты нативной гистограммы.
+    """
+
+    __slots__ = (
+        "tags", "bounds", "bucket_counts", "count", "sum", "schema",
+        "zero_count", "positive", "negative", "created", "updated",
+    )
+
+    def __init__(self, tags: Dict[str, str], bounds: List[float] = HISTOGRAM_BOUNDS,
+                 schema: int = NATIVE_HISTOGRAM_SCHEMA):
+        self.tags = tags
+        self.bounds = bounds
+        # Последний элемент - бакет +Inf
+        self.bucket_counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.schema = schema
+        self.zero_count = 0
+        self.positive: Dict[int, int] = {}
+        self.negative: Dict[int, int] = {}
+        self.created = time.time()
+        self.updated = self.created
+
+    def observe(self, value: float):
+        self.updated = time.time()
+        self.count += 1
+        self.sum += value
+        self.bucket_counts[bisect_left(self.bounds, value)] += 1
+
+        magnitude = abs(value)
+        if magnitude <= NATIVE_ZERO_THRESHOLD:
+            self.zero_count += 1
+        else:
+            buckets = self.positive if value > 0 else self.negative
+            index = native_index(magnitude, self.schema)
+            buckets[index] = buckets.get(index, 0) + 1
+            if len(self.positive) + len(self.negative) > NATIVE_HISTOGRAM_MAX_BUCKETS and self.schema > _MIN_SCHEMA:
+                self._downscale()
+
+    def _downscale(self):
+        """Схема - 1: бакеты 2j-1 и 2j схлопываются в j."""
+        self.schema -= 1
+        for name in ("positive", "negative"):
+            merged: Dict[int, int] = {}
+            for index, count in getattr(self, name).items():
+                new_index = (index + 1) >> 1
+                merged[new_index] = merged.get(new_index, 0) + count
+            setattr(self, name, merged)
+
+    def cumulative_buckets(self) -> List[Tuple[float, int]]:
+        """(le, накопленный счётчик) для классических бакетов, последний - +Inf."""
+        buckets = []
+        running = 0
+        for bound, count in zip(self.bounds + [math.inf], self.bucket_counts):
+            running += count
+            buckets.append((bound, running))
+        return buckets
+
+
+def native_spans(buckets: Dict[int, int]) -> Tuple[List[Tuple[int, int]], List[int]]:
+    """
+    Разреженные бакеты в виде protobuf-модели Prometheus: спаны
+    (offset, length) и дельты счётчиков (первая - абсолютное значение).
+    offset первого спана - индекс первого бакета, следующих - пропуск от конца предыдущего.
+    """
+    spans: List[Tuple[int, int]] = []
+    deltas: List[int] = []
+    previous_index = None
+    previous_count = 0
+    for index in sorted(buckets):
+        count = buckets[index]
+        if previous_index is not None and index == previous_index + 1:
+            offset, length = spans[-1]
+            spans[-1] = (offset, length + 1)
+        else:
+            spans.append((index if previous_index is None else index - previous_index - 1, 1))
+        deltas.append(count - previous_count)
+        previous_index = index
+        previous_count = count
+    return spans, deltas
+
+
+# Гистограмма серии без новых точек дольше этого срока перестаёт экспортироваться
+HISTOGRAM_TTL_SECONDS = float(os.getenv("EXPORTER_HISTOGRAM_TTL_SECONDS", "3600"))
+
+# Ключ серии: (service_name, metric_name, отсортированные пары тегов)
+HistogramKey = Tuple[str, str, Tuple[Tuple[str, str], ...]]
+
+
+class HistogramRegistry:
+    """
+    Накопительные гистограммы по сериям, наполняемые при приёме метрик.
+    Как и StreamAggregator, видит только метрики своего процесса, поэтому
+    используется только с EXPORTER_SOURCE=memory и одним воркером.
+    """
+
+    def __init__(self, ttl_seconds: float = HISTOGRAM_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self.series: Dict[HistogramKey, CumulativeHistogram] = {}
+
+    def observe(self, service_name: str, metric_name: str, tags: Optional[Dict[str, str]], value: float):
+        tags = tags or {}
+        key = (service_name, metric_name, tuple(sorted(tags.items())))
+        histogram = self.series.get(key)
+        if histogram is None:
+            histogram = self.series[key] = CumulativeHistogram(dict(tags))
+        histogram.observe(value)
+
+    def families(self, now: Optional[float] = None) -> Dict[str, List[Tuple[str, CumulativeHistogram]]]:
+        """
+        Живые гистограммы, сгруппированные по имени метрики:
+        {metric_name: [(service_name, histogram), ...]}. Заброшенные серии удаляются.
+        """
+        expire_before = (time.time() if now is None else now) - self.ttl_seconds
+        families: Dict[str, List[Tuple[str, CumulativeHistogram]]] = {}
+        expired = []
+        for key, histogram in self.series.items():
+            if histogram.updated < expire_before:
+                expired.append(key)
+                continue
+            families.setdefault(key[1], []).append((key[0], histogram))
+        for key in expired:
+            del self.series[key]
+        return families
@@ -7,25 +7,75 @@ from prometheus_client import (
     REGISTRY
 )
 from fastapi import Response
-from typing import Dict, List, Optional
-from datetime import datetime, timedelta
-from sqlalchemy.ext.asyncio import AsyncSession
-from app.models.metric import Metric
-from sqlalchemy import select, func
+from typing import Dict, Iterable, List, Optional, Tuple
+from datetime import datetime, timedelta, timezone
+from app.core.stream_aggregator import StreamAggregator
+from app.exporters.histograms import HistogramRegistry
+from app.exporters import protobuf
+from app.schemas.metric import MetricCreate
+from app.storage import storage
+from app.utils.aggregators import PERCENTILE_MODE
+import asyncio
+import gzip
+import itertools
+import logging
+import math
+import os
 import re
-
-# Кэш метрик для производительности
-_metrics_cache = {}
-_cache_timestamp = None
-_cache_ttl = 10  # секунд
-
-
+import time
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+# Источник данных скрейпа: memory - состояние серий, обновляемое при приёме метрик
+# (видит только свой процесс: для одного воркера); db - пересчёт GROUP BY по сырым
+# точкам, общий вид для любого числа воркеров (нужен для percentile_mode="exact").
+# Накопительные гистограммы есть только в memory, в db метрики типа histogram
+# отдаются оконными gauge, как остальные.
+EXPORTER_SOURCE = os.getenv("EXPORTER_SOURCE", "memory").lower()
+# Окно экспортируемых агрегатов и шаг под-окон состояния в памяти
+EXPORTER_WINDOW_SECONDS = int(os.getenv("EXPORTER_WINDOW_SECONDS", "300"))
+EXPORTER_BUCKET_SECONDS = int(os.getenv("EXPORTER_BUCKET_SECONDS", "10"))
+
+# Кэш снимков режима db: свежий снимок отдаётся как есть, устаревший - пока идёт
+# фоновое обновление, но не дольше MAX_STALE
+EXPORTER_CACHE_TTL_SECONDS = float(os.getenv("EXPORTER_CACHE_TTL_SECONDS", "10"))
+EXPORTER_CACHE_MAX_STALE_SECONDS = float(os.getenv("EXPORTER_CACHE_MAX_STALE_SECONDS", "300"))
+
+# Снимок состояния в памяти (и его отрисовка) переиспользуется столько секунд
+EXPORTER_SNAPSHOT_SECONDS = float(os.getenv("EXPORTER_SNAPSHOT_SECONDS", "5"))
+# Уровень сжатия gzip-варианта тела экспозиции
+EXPORTER_GZIP_LEVEL = int(os.getenv("EXPORTER_GZIP_LEVEL", "6"))
+# Сколько имён метрик и лейблов держим в кэше санитизации
+SANITIZE_CACHE_SIZE = int(os.getenv("EXPORTER_SANITIZE_CACHE_SIZE", "65536"))
+# Классические бакеты в protobuf-выдаче рядом с нативными (для Prometheus без native histograms)
+EXPORTER_PROTOBUF_CLASSIC_BUCKETS = os.getenv("EXPORTER_PROTOBUF_CLASSIC_BUCKETS", "false").lower() == "true"
+
+CONTENT_TYPE_OPENMETRICS = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+# Формат экспозиции -> Content-Type ответа
+EXPOSITION_CONTENT_TYPES = {
+    "text": CONTENT_TYPE_LATEST,
+    "openmetrics": CONTENT_TYPE_OPENMETRICS,
+    "protobuf": protobuf.CONTENT_TYPE_PROTOBUF,
+}
+
+# Ключ кэша: (window_minutes, percentile_mode)
+CacheKey = Tuple[int, str]
+
+_snapshot_versions = itertools.count(1)
+
+_INVALID_NAME_CHARS = re.compile(r'[^a-zA-Z0-9_]')
+_REPEATED_UNDERSCORES = re.compile(r'__+')
+
+
+@lru_cache(maxsize=SANITIZE_CACHE_SIZE)
 def sanitize_metric_name(name: str) -> str:
-    """Приводит имя метрики к формату Prometheus"""
+    """Приводит имя метрики к формату Prometheus (результат кэшируется)"""
     # Заменяем недопустимые символы на подчёркивания
-    name = re.sub(r'[^a-zA-Z0-9_]', '_', name)
+    name = _INVALID_NAME_CHARS.sub('_', name)
     # Убираем двойные подчёркивания
-    name = re.sub(r'__+', '_', name)
+    name = _REPEATED_UNDERSCORES.sub('_', name)
     # Убираем подчёркивания в начале и конце
     name = name.strip('_')
     # Если начинается с цифры - добавляем префикс
@@ -34,6 +84,24 @@ def sanitize_metric_name(name: str) -> str:
     return name.lower()
 
 
+@lru_cache(maxsize=SANITIZE_CACHE_SIZE)
+def determine_metric_type(metric_name: str) -> str:
+    """Определяет тип метрики по её имени (результат кэшируется)"""
+    metric_name_lower = metric_name.lower()
+
+    # Counter - для счётчиков
+    if any(keyword in metric_name_lower for keyword in ['count', 'total', 'requests', 'errors']):
+        return 'counter'
+
+    # Histogram - для латентностей и времён
+    if any(keyword in metric_name_lower for keyword in ['latency', 'duration', 'time', 'response']):
+        return 'histogram'
+
+    # По умолчанию - gauge
+    return 'gauge'
+
+
+@lru_cache(maxsize=SANITIZE_CACHE_SIZE)
 def sanitize_label_name(name: str) -> str:
     """Приводит имя лейбла к формату Prometheus"""
     return sanitize_metric_name(name)
@@ -44,86 +112,294 @@ def sanitize_label_value(value: str) -> str:
     return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
 
 
-class PrometheusExporter:
-    """Экспортер метрик в формате Prometheus"""
+def accepts_gzip(accept_encoding: Optional[str]) -> bool:
+    """Клиент принимает gzip (и не запретил его через q=0)"""
+    for part in (accept_encoding or "").split(","):
+        coding, *params = [p.strip() for p in part.split(";")]
+        if coding.lower() not in ("gzip", "*"):
+            continue
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    return float(param[2:]) > 0
+                except ValueError:
+                    return False
+        return True
+    return False
+
+
+def negotiate_exposition(accept: Optional[str]) -> str:
+    """
+    Формат экспозиции по заголовку Accept скрейпера: protobuf (только
+    io.prometheus.client.MetricFamily в delimited-кодировке), openmetrics
+    или text. Выбирается известный тип с наибольшим q; по умолчанию - text.
+    """
+    candidates = []
+    for position, part in enumerate((accept or "").split(",")):
+        media_type, *params = [p.strip() for p in part.split(";")]
+        media_type = media_type.lower()
+        options = dict(p.split("=", 1) for p in params if "=" in p)
+        if media_type == "application/vnd.google.protobuf":
+            if options.get("proto") != "io.prometheus.client.MetricFamily":
+                continue
+            if options.get("encoding", "delimited") != "delimited":
+                continue
+            fmt = "protobuf"
+        elif media_type == "application/openmetrics-text":
+            fmt = "openmetrics"
+        elif media_type == "text/plain":
+            fmt = "text"
+        else:
+            continue
+        try:
+            q = float(options.get("q", "1"))
+        except ValueError:
+            q = 1.0
+        if q > 0:
+            candidates.append((-q, position, fmt))
+
+    return min(candidates)[2] if candidates else "text"
+
+
+def _format_float(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    return repr(float(value))
+
+
+def _group_by_name(rows: Iterable[Dict]) -> Dict[str, List[Dict]]:
+    """Группирует агрегаты серий по имени метрики"""
+    metrics_by_name = {}
+    for row in rows:
+        metric_key = f"{row['service_name']}_{row['metric_name']}"
+        metrics_by_name.setdefault(metric_key, []).append(row)
+    return metrics_by_name
+
+
+class Snapshot:
+    """
+    Неизменяемый снимок агрегатов с номером версии. Тело экспозиции каждого
+    формата и его gzip-вариант считаются один раз на версию.
+    """
+
+    __slots__ = ("version", "data", "collected_at", "updated_at", "rendered")
+
+    def __init__(self, data: Dict[str, List[Dict]]):
+        self.version = next(_snapshot_versions)
+        self.data = data
+        self.collected_at = datetime.now(timezone.utc)
+        self.updated_at = time.monotonic()
+        # (формат, gzip) -> готовые байты
+        self.rendered: Dict[Tuple[str, bool], bytes] = {}
+
+
+class _CacheEntry:
+    """Последний удачный снимок одного ключа и его обновление в полёте."""
+
+    __slots__ = ("snapshot", "refresh")
 
     def __init__(self):
-        self.metric_families = {}
+        self.snapshot: Optional[Snapshot] = None
+        self.refresh: Optional[asyncio.Task] = None
+
 
-    async def collect_metrics(self, session: AsyncSession, window_minutes: int = 5):
+class PrometheusExporter:
+    """
+    Экспортер метрик в формате Prometheus.
+
+    По умолчанию агрегаты берутся из состояния серий в памяти: каждая
+    принятая точка попадает в скользящее окно своей серии (под-окна со
+    счётчиками и DDSketch), а скрейп только сливает под-окна и сериализует
+    результат - его стоимость O(серий), а не O(точек за окно).
+    Состояние видит только метрики, принятые этим процессом; при нескольких
+    воркерах каждый отдаёт свою часть, общий вид даёт EXPORTER_SOURCE=db.
+
+    Метрики типа histogram в режиме memory копятся в накопительных
+    гистограммах с неизменными границами бакетов и отдаются как классические
+    бакеты в text / OpenMetrics и как нативные в protobuf. Это счётчики
+    процесса с момента его старта (window_minutes на них не влияет, рестарт -
+    сброс, как у любого клиента Prometheus), поэтому они верны только при
+    одном воркере: несколько воркеров отдавали бы под одними лейблами разные
+    счётчики. В режиме db гистограмм нет - такие метрики отдаются оконными
+    gauge из общего снимка.
+    """
+
+    def __init__(self, source: str = EXPORTER_SOURCE):
+        self.metric_families = {}
+        self.source = source
+        self.state = StreamAggregator(
+            retention_seconds=EXPORTER_WINDOW_SECONDS,
+            bucket_seconds=EXPORTER_BUCKET_SECONDS,
+        )
+        self.histograms: Optional[HistogramRegistry] = HistogramRegistry() if source == "memory" else None
+        self._cache: Dict[CacheKey, _CacheEntry] = {}
+
+    def observe_metric(self, metric: MetricCreate):
+        if self.source != "memory":
+            return
+        self.state.observe_metric(metric)
+        if determine_metric_type(metric.metric_name) == 'histogram':
+            self.histograms.observe(metric.service_name, metric.metric_name, metric.tags, metric.value)
+
+    def observe_many(self, metrics: Iterable[MetricCreate]):
+        if self.source != "memory":
+            return
+        metrics = list(metrics)
+        self.state.observe_many(metrics)
+        for metric in metrics:
+            if determine_metric_type(metric.metric_name) == 'histogram':
+                self.histograms.observe(metric.service_name, metric.metric_name, metric.tags, metric.value)
+
+    def _export_type(self, metric_name: str) -> str:
+        """Тип в экспозиции: без накопительных гистограмм (режим db) histogram отдаётся как gauge."""
+        metric_type = self._determine_metric_type(metric_name)
+        if metric_type == 'histogram' and self.histograms is None:
+            return 'gauge'
+        return metric_type
+
+    def _histogram_families(self) -> Dict[str, List]:
+        return self.histograms.families() if self.histograms is not None else {}
+
+    async def backfill(self) -> int:
+        """Холодный старт состояния из хранилища за окно экспорта."""
+        if self.source != "memory":
+            return 0
+        return await self.state.backfill(storage)
+
+    def _from_memory(self, percentile_mode: str) -> bool:
+        return self.source == "memory" and percentile_mode == "sketch"
+
+    async def collect_metrics(
+            self,
+            window_minutes: int = 5,
+            percentile_mode: str = PERCENTILE_MODE
+    ) -> Dict[str, List[Dict]]:
         """
-        Собирает метрики из БД и конвертирует в формат Prometheus
+        Собирает агрегаты серий, сгруппированные по имени метрики
 
         Args:
-            session: AsyncSession SQLAlchemy
-            window_minutes: окно для сбора метрик (последние N минут)
+            window_minutes: окно для сбора метрик (последние N минут);
+                в режиме memory не больше EXPORTER_WINDOW_SECONDS
+            percentile_mode: "sketch" (DDSketch по корзинам в SQL) или "exact" (percentile_cont);
+                точные перцентили есть только в режиме db
         """
-        global _metrics_cache, _cache_timestamp
-
-        # Проверяем кэш
-        now = datetime.utcnow()
-        if _cache_timestamp and (now - _cache_timestamp).total_seconds() < _cache_ttl:
-            return _metrics_cache
-
-        since = now - timedelta(minutes=window_minutes)
-
-        # Запрос агрегированных метрик
-        query = select(
-            Metric.service_name,
-            Metric.metric_name,
-            Metric.tags,
-            func.avg(Metric.value).label('avg_value'),
-            func.max(Metric.value).label('max_value'),
-            func.min(Metric.value).label('min_value'),
-            func.count(Metric.value).label('count'),
-            func.percentile_cont(0.5).within_group(Metric.value).label('p50'),
-            func.percentile_cont(0.95).within_group(Metric.value).label('p95'),
-            func.percentile_cont(0.99).within_group(Metric.value).label('p99')
-        ).where(
-            Metric.timestamp >= since
-        ).group_by(
-            Metric.service_name,
-            Metric.metric_name,
-            Metric.tags
-        )
-
-        result = await session.execute(query)
-        rows = result.fetchall()
-
-        # Группируем по имени метрики
-        metrics_by_name = {}
-        for row in rows:
-            metric_key = f"{row.service_name}_{row.metric_name}"
-
-            if metric_key not in metrics_by_name:
-                metrics_by_name[metric_key] = []
-
-            metrics_by_name[metric_key].append({
-                'service_name': row.service_name,
-                'metric_name': row.metric_name,
-                'tags': row.tags or {},
-                'avg_value': float(row.avg_value) if row.avg_value else 0,
-                'max_value': float(row.max_value) if row.max_value else 0,
-                'min_value': float(row.min_value) if row.min_value else 0,
-                'count': row.count,
-                'p50': float(row.p50) if row.p50 else None,
-                'p95': float(row.p95) if row.p95 else None,
-                'p99': float(row.p99) if row.p99 else None,
-            })
-
-        _metrics_cache = metrics_by_name
-        _cache_timestamp = now
-
-        return metrics_by_name
-
-    def generate_prometheus_metrics(self, metrics_data: Dict) -> str:
+        return (await self.snapshot(window_minutes, percentile_mode)).data
+
+    async def snapshot(self, window_minutes: int = 5, percentile_mode: str = PERCENTILE_MODE) -> Snapshot:
+        key = (window_minutes, percentile_mode)
+        entry = self._cache.get(key)
+        if entry is None:
+            entry = self._cache[key] = _CacheEntry()
+
+        if self._from_memory(percentile_mode):
+            # Состояние в памяти меняется с каждой точкой: снимок (и его
+            # отрисовка) переиспользуется EXPORTER_SNAPSHOT_SECONDS
+            snapshot = entry.snapshot
+            if snapshot is None or time.monotonic() - snapshot.updated_at >= EXPORTER_SNAPSHOT_SECONDS:
+                snapshot = entry.snapshot = Snapshot(
+                    _group_by_name(self.state.aggregate_series(window_minutes * 60))
+                )
+            return snapshot
+
+        return await self._cached_snapshot(key, entry)
+
+    async def _cached_snapshot(self, key: CacheKey, entry: _CacheEntry) -> Snapshot:
+        """
+        Снимок из БД с single-flight и stale-while-revalidate:
+        - свежий снимок (моложе EXPORTER_CACHE_TTL_SECONDS) отдаётся сразу;
+        - устаревший тоже отдаётся сразу, а обновление запускается в фоне -
+          одно на ключ, сколько бы запросов ни пришло;
+        - без снимка (или старше EXPORTER_CACHE_MAX_STALE_SECONDS) запросы
+          ждут то же самое единственное обновление.
+        """
+        snapshot = entry.snapshot
+        if snapshot is not None:
+            age = time.monotonic() - snapshot.updated_at
+            if age < EXPORTER_CACHE_TTL_SECONDS:
+                return snapshot
+            if age < EXPORTER_CACHE_MAX_STALE_SECONDS:
+                self._start_refresh(key, entry)
+                return snapshot
+
+        # shield: отключившийся клиент не отменяет общее обновление
+        return await asyncio.shield(self._start_refresh(key, entry))
+
+    def _start_refresh(self, key: CacheKey, entry: _CacheEntry) -> asyncio.Task:
+        if entry.refresh is None:
+            entry.refresh = asyncio.create_task(self._refresh(key, entry))
+            entry.refresh.add_done_callback(lambda task: self._on_refresh_done(key, entry, task))
+        return entry.refresh
+
+    def _on_refresh_done(self, key: CacheKey, entry: _CacheEntry, task: asyncio.Task):
+        entry.refresh = None
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"⚠️ Exporter snapshot refresh failed for {key}: {task.exception()}")
+
+    async def _refresh(self, key: CacheKey, entry: _CacheEntry) -> Snapshot:
+        """Пересчёт снимка из хранилища (в Postgres - на собственной сессии пула exporter)."""
+        window_minutes, percentile_mode = key
+        since = datetime.now(timezone.utc) - timedelta(minutes=window_minutes)
+        entry.snapshot = Snapshot(_group_by_name(await storage.aggregate_series(since, percentile_mode)))
+        return entry.snapshot
+
+    async def render(
+            self,
+            window_minutes: int = 5,
+            percentile_mode: str = PERCENTILE_MODE,
+            gzip_encoding: bool = False,
+            fmt: str = "text"
+    ) -> Tuple[bytes, Snapshot]:
+        """
+        Тело экспозиции формата fmt (text / openmetrics / protobuf) для
+        текущего снимка. Каждый формат и его gzip отрисовываются один раз
+        на версию снимка; следующие скрейпы получают готовые байты.
+        """
+        snapshot = await self.snapshot(window_minutes, percentile_mode)
+        body = snapshot.rendered.get((fmt, False))
+        if body is None:
+            if fmt == "protobuf":
+                body = self.generate_protobuf_metrics(snapshot.data, snapshot.collected_at)
+            else:
+                body = self.generate_prometheus_metrics(
+                    snapshot.data, snapshot.collected_at, openmetrics=fmt == "openmetrics"
+                ).encode()
+            snapshot.rendered[(fmt, False)] = body
+        if not gzip_encoding:
+            return body, snapshot
+        gzip_body = snapshot.rendered.get((fmt, True))
+        if gzip_body is None:
+            gzip_body = snapshot.rendered[(fmt, True)] = gzip.compress(body, compresslevel=EXPORTER_GZIP_LEVEL)
+        return gzip_body, snapshot
+
+    def cache_info(self, window_minutes: int = 5, percentile_mode: str = PERCENTILE_MODE) -> Dict:
+        """Состояние снимка для /metrics/debug."""
+        entry = self._cache.get((window_minutes, percentile_mode))
+        snapshot = entry.snapshot if entry else None
+        return {
+            "source": "memory" if self._from_memory(percentile_mode) else "db",
+            "snapshot_version": snapshot.version if snapshot else None,
+            "cache_timestamp": snapshot.collected_at.isoformat() if snapshot else None,
+            "refreshing": bool(entry and entry.refresh is not None),
+        }
+
+    def generate_prometheus_metrics(
+            self,
+            metrics_data: Dict,
+            collected_at: Optional[datetime] = None,
+            openmetrics: bool = False
+    ) -> str:
         """
         Генерирует строку в формате Prometheus из данных
 
         Формат:
         # HELP metric_name Описание метрики
         # TYPE metric_name gauge
-        metric_name{label1="value1", label2="value2"} value
+        metric_name{label1="value1",label2="value2"} value
+
+        openmetrics=True - формат OpenMetrics: оконные агрегаты объявлены
+        gauge (они не монотонны), без пустых строк, в конце "# EOF".
         """
         lines = []
 
@@ -136,15 +412,17 @@ class PrometheusExporter:
             base_name = sanitize_metric_name(f"{sample['metric_name']}") # {sample['service_name']}_
 
             # Определяем тип метрики по имени
-            metric_type = self._determine_metric_type(sample['metric_name'])
+            metric_type = self._export_type(sample['metric_name'])
+            # Гистограммы отдаются из накопительного состояния ниже
+            if metric_type == 'histogram':
+                continue
 
             # HELP и TYPE
             lines.append(f'# HELP {base_name} Metric from {sample["service_name"]} service')
-            lines.append(f'# TYPE {base_name} {metric_type}')
+            lines.append(f'# TYPE {base_name} {"gauge" if openmetrics else metric_type}')
 
             # Генерируем метрики для каждого экземпляра
             for instance in metric_instances:
-                # print("instance", instance)
                 # Формируем лейблы из тегов
                 labels = {
                     'service': instance['service_name'],
@@ -156,69 +434,132 @@ class PrometheusExporter:
 
                 # Генерируем разные варианты метрик
                 if metric_type == 'gauge':
-                    lines.append(f'{base_name}{{type="avg", {label_str}}} {instance["avg_value"]}')
-                    lines.append(f'{base_name}{{type="max", {label_str}}} {instance["max_value"]}')
-                    lines.append(f'{base_name}{{type="min", {label_str}}} {instance["min_value"]}')
+                    lines.append(f'{base_name}{{type="avg",{label_str}}} {instance["avg_value"]}')
+                    lines.append(f'{base_name}{{type="max",{label_str}}} {instance["max_value"]}')
+                    lines.append(f'{base_name}{{type="min",{label_str}}} {instance["min_value"]}')
 
                     # Перцентили, если есть
 
                     if instance['p50'] is not None:
-                        lines.append(f'{base_name}{{type="p50", {label_str}}} {instance["p50"]}')
+                        lines.append(f'{base_name}{{type="p50",{label_str}}} {instance["p50"]}')
                     if instance['p95'] is not None:
-                        lines.append(f'{base_name}{{type="p95", {label_str}}} {instance["p95"]}')
+                        lines.append(f'{base_name}{{type="p95",{label_str}}} {instance["p95"]}')
                     if instance['p99'] is not None:
-                        lines.append(f'{base_name}{{type="p99", {label_str}}} {instance["p99"]}')
+                        lines.append(f'{base_name}{{type="p99",{label_str}}} {instance["p99"]}')
 
                 elif metric_type == 'counter':
-                    lines.append(f'{base_name}{{type="total", {label_str}}} {instance["count"]}')
-                    lines.append(f'{base_name}{{type="avg", {label_str}}} {instance["avg_value"]}')
-
-                elif metric_type == 'histogram':
-                    # Базовое значение
-                    lines.append(f'{base_name}_sum{{{label_str}}} {instance["avg_value"] * instance["count"]}')
-                    lines.append(f'{base_name}_count{{{label_str}}} {instance["count"]}')
-
-                    # Bucket'ы для гистограммы
-                    print("ПЕРЦЕНТИЛИ histogram")
-                    if instance['p95'] is not None:
-                        print('p95', instance['p95'])
-                        lines.append(
-                            f'{base_name}_bucket{{le="{instance["p95"]}", {label_str}}} {int(instance["count"] * 0.95)}')
-                    if instance['p99'] is not None:
-                        print('p99', instance['p99'])
-                        lines.append(
-                            f'{base_name}_bucket{{le="{instance["p99"]}", {label_str}}} {int(instance["count"] * 0.99)}')
-                    lines.append(f'{base_name}_bucket{{le="+Inf", {label_str}}} {instance["count"]}')
-
-            lines.append('')  # Пустая строка между метриками
+                    lines.append(f'{base_name}{{type="total",{label_str}}} {instance["count"]}')
+                    lines.append(f'{base_name}{{type="avg",{label_str}}} {instance["avg_value"]}')
+
+            if not openmetrics:
+                lines.append('')  # Пустая строка между метриками
+
+        # Гистограммы: границы le одни и те же на каждом скрейпе, счётчики только растут
+        for metric_name, members in self._histogram_families().items():
+            base_name = sanitize_metric_name(metric_name)
+            lines.append(f'# HELP {base_name} Metric from {members[0][0]} service')
+            lines.append(f'# TYPE {base_name} histogram')
+
+            for service_name, histogram in members:
+                label_str = self._format_labels({'service': service_name, **histogram.tags})
+                for bound, cumulative in histogram.cumulative_buckets():
+                    lines.append(f'{base_name}_bucket{{le="{_format_float(bound)}",{label_str}}} {cumulative}')
+                lines.append(f'{base_name}_sum{{{label_str}}} {histogram.sum}')
+                lines.append(f'{base_name}_count{{{label_str}}} {histogram.count}')
+                if openmetrics:
+                    lines.append(f'{base_name}_created{{{label_str}}} {histogram.created}')
+
+            if not openmetrics:
+                lines.append('')
 
         # Добавляем информацию о здоровье сервиса
         lines.append('# HELP metrics_collector_up Status of the metrics collector')
         lines.append('# TYPE metrics_collector_up gauge')
         lines.append(f'metrics_collector_up 1')
 
-        lines.append('# HELP metrics_collector_last_scrape_timestamp Unix timestamp of the last scrape')
+        lines.append('# HELP metrics_collector_last_scrape_timestamp Unix timestamp of the exported snapshot')
         lines.append('# TYPE metrics_collector_last_scrape_timestamp gauge')
-        lines.append(f'metrics_collector_last_scrape_timestamp {datetime.utcnow().timestamp()}')
+        collected_at = collected_at or datetime.now(timezone.utc)
+        lines.append(f'metrics_collector_last_scrape_timestamp {collected_at.timestamp()}')
+
+        if openmetrics:
+            lines.append('# EOF')
+            lines.append('')
 
         return '\n'.join(lines)
 
+    def generate_protobuf_metrics(self, metrics_data: Dict, collected_at: Optional[datetime] = None) -> bytes:
+        """
+        Экспозиция в protobuf (delimited MetricFamily). Гистограммы -
+        нативные: разреженные экспоненциальные бакеты, число рядов в
+        Prometheus не зависит от числа бакетов.
+        """
+        families = []
+
+        for metric_key, metric_instances in metrics_data.items():
+            if not metric_instances:
+                continue
 
-    def _determine_metric_type(self, metric_name: str) -> str:
-        """Определяет тип метрики по её имени"""
-        metric_name_lower = metric_name.lower()
+            sample = metric_instances[0]
+            metric_type = self._export_type(sample['metric_name'])
+            if metric_type == 'histogram':
+                continue
 
-        # Counter - для счётчиков
-        if any(keyword in metric_name_lower for keyword in ['count', 'total', 'requests', 'errors']):
-            return 'counter'
+            fields = ('avg_value', 'max_value', 'min_value', 'p50', 'p95', 'p99')
+            if metric_type == 'counter':
+                fields = ('count', 'avg_value')
 
-        # Histogram - для латентностей и времён
-        if any(keyword in metric_name_lower for keyword in ['latency', 'duration', 'time', 'response']):
-            return 'histogram'
+            metrics = []
+            for instance in metric_instances:
+                labels = self._sanitize_labels({'service': instance['service_name'], **instance['tags']})
+                for field in fields:
+                    if instance[field] is None:
+                        continue
+                    name = 'total' if field == 'count' else field.replace('_value', '')
+                    metrics.append(protobuf.gauge_metric({'type': name, **labels}, instance[field]))
+
+            families.append(protobuf.metric_family(
+                sanitize_metric_name(sample['metric_name']),
+                f'Metric from {sample["service_name"]} service',
+                protobuf.TYPE_GAUGE,
+                metrics,
+            ))
+
+        for metric_name, members in self._histogram_families().items():
+            metrics = [
+                protobuf.histogram_metric(
+                    self._sanitize_labels({'service': service_name, **histogram.tags}),
+                    histogram,
+                    classic_buckets=EXPORTER_PROTOBUF_CLASSIC_BUCKETS,
+                )
+                for service_name, histogram in members
+            ]
+            families.append(protobuf.metric_family(
+                sanitize_metric_name(metric_name),
+                f'Metric from {members[0][0]} service',
+                protobuf.TYPE_HISTOGRAM,
+                metrics,
+            ))
+
+        collected_at = collected_at or datetime.now(timezone.utc)
+        families.append(protobuf.metric_family(
+            'metrics_collector_up', 'Status of the metrics collector',
+            protobuf.TYPE_GAUGE, [protobuf.gauge_metric({}, 1)],
+        ))
+        families.append(protobuf.metric_family(
+            'metrics_collector_last_scrape_timestamp', 'Unix timestamp of the exported snapshot',
+            protobuf.TYPE_GAUGE, [protobuf.gauge_metric({}, collected_at.timestamp())],
+        ))
+
+        return b''.join(families)
 
-        # По умолчанию - gauge
-        return 'gauge'
+    def _determine_metric_type(self, metric_name: str) -> str:
+        """Определяет тип метрики по её имени"""
+        return determine_metric_type(metric_name)
 
+    def _sanitize_labels(self, labels: Dict[str, str]) -> Dict[str, str]:
+        """Имена лейблов в формате Prometheus; значения в protobuf не экранируются"""
+        return {sanitize_label_name(key): str(value) for key, value in labels.items()}
 
     def _format_labels(self, labels: Dict[str, str]) -> str:
         """Форматирует лейблы в строку для Prometheus"""
@@ -231,7 +572,7 @@ class PrometheusExporter:
             sanitized_value = sanitize_label_value(value)
             label_parts.append(f'{sanitized_key}="{sanitized_value}"')
 
-        return ', '.join(label_parts) if label_parts else ''
+        return ','.join(label_parts) if label_parts else ''
 
 
 # Singleton экземпляр
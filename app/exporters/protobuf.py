@@ -0,0 +1,136 @@
+import math
+import struct
+from typing import Dict, Iterable, List
+
+from app.exporters.histograms import CumulativeHistogram, NATIVE_ZERO_THRESHOLD, native_spans
+
+# Формат экспозиции protobuf (io.prometheus.client.MetricFamily, delimited).
+# Кодировщик написан вручную по metrics.proto: нужны лишь несколько сообщений,
+# и зависимость от protobuf ради них не тянем.
+CONTENT_TYPE_PROTOBUF = (
+    "application/vnd.google.protobuf; proto=io.prometheus.client.MetricFamily; encoding=delimited"
+)
+
+# MetricType
+TYPE_COUNTER = 0
+TYPE_GAUGE = 1
+TYPE_HISTOGRAM = 4
+
+_VARINT = 0
+_FIXED64 = 1
+_LENGTH_DELIMITED = 2
+
+
+def _varint(value: int) -> bytes:
+    if value < 0:
+        # int64 с отрицательным значением кодируется как 10-байтовый varint
+        value += 1 << 64
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _zigzag(value: int) -> int:
+    return (value << 1) ^ (value >> 63)
+
+
+def _key(field: int, wire_type: int) -> bytes:
+    return _varint((field << 3) | wire_type)
+
+
+def _uint(field: int, value: int) -> bytes:
+    return _key(field, _VARINT) + _varint(value)
+
+
+def _sint(field: int, value: int) -> bytes:
+    return _key(field, _VARINT) + _varint(_zigzag(value))
+
+
+def _double(field: int, value: float) -> bytes:
+    return _key(field, _FIXED64) + struct.pack("<d", value)
+
+
+def _bytes(field: int, value: bytes) -> bytes:
+    return _key(field, _LENGTH_DELIMITED) + _varint(len(value)) + value
+
+
+def _string(field: int, value: str) -> bytes:
+    return _bytes(field, value.encode())
+
+
+def _packed_sint(field: int, values: Iterable[int]) -> bytes:
+    payload = b"".join(_varint(_zigzag(v)) for v in values)
+    return _bytes(field, payload) if payload else b""
+
+
+def _label_pairs(labels: Dict[str, str]) -> bytes:
+    # LabelPair: name = 1, value = 2
+    return b"".join(
+        _bytes(1, _string(1, name) + _string(2, str(value)))
+        for name, value in labels.items()
+    )
+
+
+def _timestamp(seconds: float) -> bytes:
+    # google.protobuf.Timestamp: seconds = 1, nanos = 2
+    whole = math.floor(seconds)
+    return _uint(1, whole) + _uint(2, int((seconds - whole) * 1e9))
+
+
+def gauge_metric(labels: Dict[str, str], value: float) -> bytes:
+    # Metric: label = 1, gauge = 2 (Gauge: value = 1)
+    return _label_pairs(labels) + _bytes(2, _double(1, float(value)))
+
+
+def histogram_metric(labels: Dict[str, str], histogram: CumulativeHistogram,
+                     classic_buckets: bool = False) -> bytes:
+    """
+    Metric с нативной (разреженной) гистограммой. classic_buckets=True
+    добавляет и классические бакеты - для Prometheus без native histograms.
+    """
+    # Histogram: sample_count = 1, sample_sum = 2, bucket = 3, schema = 5,
+    # zero_threshold = 6, zero_count = 7, negative_span = 9, negative_delta = 10,
+    # positive_span = 12, positive_delta = 13, created_timestamp = 15
+    body = bytearray()
+    body += _uint(1, histogram.count)
+    body += _double(2, histogram.sum)
+    if classic_buckets:
+        for bound, cumulative in histogram.cumulative_buckets():
+            # Bucket: cumulative_count = 1, upper_bound = 2
+            body += _bytes(3, _uint(1, cumulative) + _double(2, bound))
+    body += _sint(5, histogram.schema)
+    body += _double(6, NATIVE_ZERO_THRESHOLD)
+    body += _uint(7, histogram.zero_count)
+
+    for span_field, delta_field, buckets in (
+            (9, 10, histogram.negative),
+            (12, 13, histogram.positive),
+    ):
+        spans, deltas = native_spans(buckets)
+        for offset, length in spans:
+            # BucketSpan: offset = 1 (sint32), length = 2
+            body += _bytes(span_field, _sint(1, offset) + _uint(2, length))
+        body += _packed_sint(delta_field, deltas)
+
+    if not histogram.count:
+        # Пустая нативная гистограмма отличается от классической пустым спаном
+        body += _bytes(12, _sint(1, 0) + _uint(2, 0))
+    body += _bytes(15, _timestamp(histogram.created))
+
+    return _label_pairs(labels) + _bytes(7, bytes(body))
+
+
+def metric_family(name: str, help_text: str, metric_type: int, metrics: List[bytes]) -> bytes:
+    """
+    MetricFamily (name = 1, help = 2, type = 3, metric = 4) с префиксом
+    длины - формат encoding=delimited.
+    """
+    message = _string(1, name) + _string(2, help_text) + _uint(3, metric_type)
+    message += b"".join(_bytes(4, metric) for metric in metrics)
+    return _varint(len(message)) + message
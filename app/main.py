@@ -2,19 +2,26 @@ import asyncio
 import os
 import logging
 from contextlib import asynccontextmanager
-from typing import AsyncGenerator
+from typing import AsyncGenerator, List
 
 from fastapi import FastAPI, Request, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse, Response
 from fastapi.exceptions import RequestValidationError
 from prometheus_fastapi_instrumentator import Instrumentator
-from prometheus_client import CONTENT_TYPE_LATEST
 
 from app.api.v1.router import api_router
-from app.core.db import init_db, close_db, check_db_connection
 from app.core.broadcaster import metrics_aggregator, manager
-from app.exporters.prometheus_exporter import exporter
+from app.core.ingest_buffer import ingest_buffer
+from app.core.stream_aggregator import stream_aggregator
+from app.core.result_cache import result_cache
+from app.storage import storage
+from app.exporters.prometheus_exporter import (
+    exporter,
+    accepts_gzip,
+    negotiate_exposition,
+    EXPOSITION_CONTENT_TYPES,
+)
 
 # Настройка логирования
 logging.basicConfig(
@@ -34,20 +41,34 @@ async def lifespan(app: FastAPI) -> AsyncGenerator:
     # Startup
     logger.info("🚀 Starting up application...")
 
-    # 1. Проверка подключения к БД
-    db_ok = await check_db_connection()
-    if not db_ok:
-        logger.error("❌ Cannot start without database connection")
-        raise RuntimeError("Database connection failed")
+    # Фоновые задачи, которые отменяются при остановке
+    background_tasks: List[asyncio.Task] = []
 
     try:
-        # Инициализация таблиц БД (в продакшене лучше через Alembic)
-        if os.getenv("AUTO_MIGRATE", "true").lower() == "true":
-            await init_db()
-            logger.info("✅ Database tables initialized")
+        # Открытие хранилища и его обслуживания: Postgres проверяет БД, создаёт
+        # схему и секции и запускает rollup / сжатие / индекс тегов, встроенное
+        # проигрывает журнал и регистрирует серии в индексе тегов
+        await storage.start()
+        logger.info(f"💾 Storage backend: {storage.kind}")
+
+        # Запуск write-behind буфера приёма метрик
+        if ingest_buffer.enabled:
+            ingest_buffer.start()
+
+        # Холодный старт инкрементального агрегатора из хранилища
+        try:
+            await stream_aggregator.backfill(storage)
+        except Exception as e:
+            logger.warning(f"⚠️ Stream aggregator backfill failed, starting empty: {e}")
+
+        # Состояние экспортера за окно скрейпа (EXPORTER_WINDOW_SECONDS)
+        try:
+            await exporter.backfill()
+        except Exception as e:
+            logger.warning(f"⚠️ Exporter state backfill failed, starting empty: {e}")
 
         # Запуск фоновой задачи агрегации метрик
-        aggregator_task = asyncio.create_task(metrics_aggregator())
+        background_tasks.append(asyncio.create_task(metrics_aggregator()))
         logger.info("📊 Metrics aggregator started")
 
         yield
@@ -60,20 +81,22 @@ async def lifespan(app: FastAPI) -> AsyncGenerator:
         # Shutdown
         logger.info("🛑 Shutting down application...")
 
-        # Отмена фоновой задачи
-        if 'aggregator_task' in locals():
-            aggregator_task.cancel()
+        # Отмена фоновых задач
+        for task in background_tasks:
+            task.cancel()
             try:
-                await aggregator_task
+                await task
             except asyncio.CancelledError:
                 pass
 
-        # Закрытие соединений с БД
-        await close_db()
+        # Дописываем в хранилище всё, что осталось в буфере приёма, и закрываем его
+        # (вместе с фоновым обслуживанием и соединениями с БД)
+        await ingest_buffer.stop()
+        await storage.stop()
+        await result_cache.close()
 
         # Отключение всех WebSocket клиентов
-        for connection in list(manager.active_connections):
-            await connection.close()
+        await manager.close_all()
 
         logger.info("✅ Shutdown complete")
 
@@ -160,29 +183,30 @@ def create_app() -> FastAPI:
         Prometheus будет опрашивать этот эндпоинт для сбора метрик.
         Все теги автоматически конвертируются в лейблы.
 
-        Формат ответа: text/plain; version=0.0.4; charset=utf-8
+        Формат ответа: text/plain; version=0.0.4, application/openmetrics-text
+        или protobuf (delimited MetricFamily) - по заголовку Accept
         """
-        from app.core.db import get_session
+        # Тело экспозиции (и gzip-вариант) отрисовывается один раз на версию снимка;
+        # снимок - из состояния в памяти или из кэша экспортера
+        # Формат - по Accept: text 0.0.4, OpenMetrics или protobuf с нативными гистограммами
+        fmt = negotiate_exposition(request.headers.get("accept"))
+        use_gzip = accepts_gzip(request.headers.get("accept-encoding"))
+        body, _ = await exporter.render(window_minutes=5, gzip_encoding=use_gzip, fmt=fmt)
+
+        headers = {
+            "Cache-Control": "no-cache, no-store, must-revalidate",
+            "Pragma": "no-cache",
+            "Expires": "0",
+            "Vary": "Accept, Accept-Encoding",
+        }
+        if use_gzip:
+            headers["Content-Encoding"] = "gzip"
 
-        async for session in get_session():
-            try:
-                # Собираем метрики из БД
-                metrics_data = await exporter.collect_metrics(session, window_minutes=5)
-
-                # Генерируем формат Prometheus
-                prometheus_output = exporter.generate_prometheus_metrics(metrics_data)
-
-                return Response(
-                    content=prometheus_output,
-                    media_type=CONTENT_TYPE_LATEST,
-                    headers={
-                        "Cache-Control": "no-cache, no-store, must-revalidate",
-                        "Pragma": "no-cache",
-                        "Expires": "0"
-                    }
-                )
-            finally:
-                await session.close()
+        return Response(
+            content=body,
+            media_type=EXPOSITION_CONTENT_TYPES[fmt],
+            headers=headers
+        )
 
     @app.get("/metrics/debug", tags=["Prometheus"])
     async def debug_metrics(request: Request):
@@ -190,18 +214,12 @@ def create_app() -> FastAPI:
         Отладочный эндпоинт - возвращает метрики в JSON формате.
         Полезно для отладки перед экспортом в Prometheus.
         """
-        from app.core.db import get_session
-
-        async for session in get_session():
-            try:
-                metrics_data = await exporter.collect_metrics(session, window_minutes=5)
-                return {
-                    "metrics_count": len(metrics_data),
-                    "metrics": metrics_data,
-                    "cache_timestamp": exporter._cache_timestamp.isoformat() if exporter._cache_timestamp else None
-                }
-            finally:
-                await session.close()
+        metrics_data = await exporter.collect_metrics(window_minutes=5)
+        return {
+            "metrics_count": len(metrics_data),
+            "metrics": metrics_data,
+            **exporter.cache_info(window_minutes=5)
+        }
 
     # Health check endpoint (для Kubernetes / Load Balancer)
     @app.get("/health", tags=["Health"])
@@ -215,10 +233,11 @@ def create_app() -> FastAPI:
     # Readiness check (для Kubernetes)
     @app.get("/ready", tags=["Health"])
     async def readiness_check():
-        db_ok = await check_db_connection()
+        storage_ok = await storage.healthy()
         return {
-            "ready": db_ok,
-            "database": "connected" if db_ok else "disconnected",
+            "ready": storage_ok,
+            "database": "connected" if storage_ok else "disconnected",
+            "storage": storage.kind,
             "prometheus": "enabled"
         }
 
@@ -259,4 +278,6 @@ if __name__ == "__main__":
         reload=os.getenv("DEBUG", "false").lower() == "true",
         log_level="info",
         access_log=True,
+        # Сжатие кадров live-потока, если клиент его предлагает
+        ws_per_message_deflate=os.getenv("WS_PER_MESSAGE_DEFLATE", "true").lower() == "true",
     )
@@ -1,6 +1,14 @@
 from app.models.metric import Metric  # noqa: F401
+from app.models.series import Series  # noqa: F401
+from app.models.metric_block import MetricBlock  # noqa: F401
+from app.models.rollup import (  # noqa: F401
+    MetricRollup1m,
+    MetricRollup5m,
+    MetricRollup1h,
+    RollupWatermark,
+)
 
 # Экспортируйте все модели здесь, чтобы Alembic их видел
 # Это важно для авто-генерации миграций
 
-__all__ = ["Metric"]
\ No newline at end of file
+__all__ = ["Metric", "Series", "MetricBlock", "MetricRollup1m", "MetricRollup5m", "MetricRollup1h", "RollupWatermark"]
\ No newline at end of file
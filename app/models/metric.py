@@ -1,5 +1,4 @@
-from sqlalchemy import Column, Integer, Float, String, DateTime, func, Index
-from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy import Column, Integer, BigInteger, Float, DateTime, func, Index
 
 from app.core.db import Base
 
@@ -7,33 +6,28 @@ from app.core.db import Base
 class Metric(Base):
     __tablename__ = "metrics"
 
-    id = Column(Integer, primary_key=True, index=True)
-    service_name = Column(String, index=True)
-    metric_name = Column(String, index=True)
+    # Таблица секционирована по RANGE (timestamp): ключ секционирования
+    # обязан входить в первичный ключ, поэтому PK составной (id, timestamp).
+    # Секции создаёт/удаляет app.core.partitions
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    # service_name / metric_name / tags хранятся один раз в таблице series
+    series_id = Column(BigInteger, nullable=False)
     value = Column(Float, nullable=False)
-    tags = Column(JSONB, nullable=True, default=dict)
-    timestamp = Column(DateTime(timezone=True), server_default=func.now())
+    timestamp = Column(DateTime(timezone=True), primary_key=True, nullable=False, server_default=func.now())
 
-    # ✅ Правильное создание GIN-индекса для JSONB
     __table_args__ = (
-        Index(
-            'ix_metrics_tags',
-            'tags',
-            postgresql_using='gin',
-            postgresql_ops={'tags': 'jsonb_path_ops'}
-        ),
         # Индекс для быстрых выборок по времени (важно для метрик)
         Index(
             'ix_metrics_timestamp',
             'timestamp',
             postgresql_using='btree'
         ),
-        # Композитный индекс для частых запросов
+        # Композитный индекс для выборки истории одной серии
         Index(
-            'ix_metrics_service_metric_ts',
-            'service_name',
-            'metric_name',
+            'ix_metrics_series_ts',
+            'series_id',
             'timestamp',
             postgresql_using='btree'
         ),
+        {'postgresql_partition_by': 'RANGE (timestamp)'},
     )
@@ -0,0 +1,33 @@
+from sqlalchemy import Column, BigInteger, Integer, DateTime, LargeBinary, Index
+
+from app.core.db import Base
+
+
+class MetricBlock(Base):
+    """
+    Сжатый блок сырых точек одной серии за закрытый диапазон времени.
+
+    Точки переносятся сюда из metrics фоновым заданием app.core.blocks;
+    колонки - битовые потоки app.utils.gorilla, по sample_count значений в каждом.
+    """
+    __tablename__ = "metric_blocks"
+
+    series_id = Column(BigInteger, primary_key=True)
+    # Начало диапазона блока (кратно BLOCK_SECONDS)
+    start_ts = Column(DateTime(timezone=True), primary_key=True)
+    # Время последней точки блока
+    end_ts = Column(DateTime(timezone=True), nullable=False)
+    sample_count = Column(Integer, nullable=False)
+    # timestamp в микросекундах от эпохи, delta-of-delta
+    ts_data = Column(LargeBinary, nullable=False)
+    # value, XOR-кодирование float
+    value_data = Column(LargeBinary, nullable=False)
+    # id точек (ключ keyset-пагинации), delta-of-delta
+    id_data = Column(LargeBinary, nullable=False)
+
+    __table_args__ = (
+        # Чтение истории: блоки серий, заканчивающиеся не раньше since
+        Index('ix_metric_blocks_series_end', 'series_id', 'end_ts'),
+        # Удаление блоков старше срока хранения
+        Index('ix_metric_blocks_end', 'end_ts'),
+    )
@@ -0,0 +1,56 @@
+from sqlalchemy import Column, Float, String, DateTime, BigInteger, LargeBinary, Index
+
+from app.core.db import Base
+
+
+class RollupMixin:
+    """
+    Общие колонки rollup-таблиц: агрегаты одной серии за один бакет.
+    Поддерживаются фоновым заданием app.core.rollups.
+    """
+
+    # Ссылка на series.id (описание серии хранится там)
+    series_id = Column(BigInteger, primary_key=True)
+    bucket = Column(DateTime(timezone=True), primary_key=True)
+    count = Column(BigInteger, nullable=False)
+    sum = Column(Float, nullable=False)
+    min = Column(Float, nullable=False)
+    max = Column(Float, nullable=False)
+    # DDSketch.to_bytes() - мёрджится при переходе на более грубый уровень
+    sketch = Column(LargeBinary, nullable=False)
+
+
+class MetricRollup1m(RollupMixin, Base):
+    __tablename__ = "metrics_rollup_1m"
+
+    __table_args__ = (
+        Index('ix_metrics_rollup_1m_bucket', 'bucket'),
+    )
+
+
+class MetricRollup5m(RollupMixin, Base):
+    __tablename__ = "metrics_rollup_5m"
+
+    __table_args__ = (
+        Index('ix_metrics_rollup_5m_bucket', 'bucket'),
+    )
+
+
+class MetricRollup1h(RollupMixin, Base):
+    __tablename__ = "metrics_rollup_1h"
+
+    __table_args__ = (
+        Index('ix_metrics_rollup_1h_bucket', 'bucket'),
+    )
+
+
+class RollupWatermark(Base):
+    """
+    До какого момента (не включительно) уровень rollup полностью посчитан.
+    Строка level='blocks' - до какого момента сырые точки перенесены в metric_blocks.
+    """
+
+    __tablename__ = "metrics_rollup_watermarks"
+
+    level = Column(String, primary_key=True)
+    watermark = Column(DateTime(timezone=True), nullable=False)
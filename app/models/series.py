@@ -0,0 +1,31 @@
+from sqlalchemy import Column, BigInteger, String, DateTime, func, Index
+from sqlalchemy.dialects.postgresql import JSONB
+
+from app.core.db import Base
+
+
+class Series(Base):
+    """
+    Словарь серий: (service_name, metric_name, теги) -> series_id.
+    id - стабильный 64-битный хэш ключа серии (app.core.series.compute_series_id),
+    поэтому его можно вычислить без обращения к БД.
+    """
+    __tablename__ = "series"
+
+    id = Column(BigInteger, primary_key=True, autoincrement=False)
+    service_name = Column(String, nullable=False)
+    metric_name = Column(String, nullable=False)
+    tags = Column(JSONB, nullable=False, default=dict)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        Index('ix_series_service_metric', 'service_name', 'metric_name'),
+        # Инкрементальная догрузка индекса тегов (app.core.tag_index)
+        Index('ix_series_created_at', 'created_at'),
+        Index(
+            'ix_series_tags',
+            'tags',
+            postgresql_using='gin',
+            postgresql_ops={'tags': 'jsonb_path_ops'}
+        ),
+    )
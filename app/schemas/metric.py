@@ -62,6 +62,10 @@ class MetricRead(MetricCreate):
         from_attributes=True  # Аналог orm_mode в Pydantic v2
     )
 
+class IngestAccepted(BaseModel):
+    status: str = "accepted"
+    queue_depth: int
+
 class AggregatedMetric(BaseModel):
     service_name: str
     metric_name: str
@@ -75,8 +79,38 @@ class AggregatedMetric(BaseModel):
     count: int
     window_seconds: int = Field(default=30)
 
+class RollupPoint(BaseModel):
+    """Точка истории, собранная из rollup-таблиц (параметр step в /history)"""
+    timestamp: datetime
+    count: int
+    sum: float
+    avg_value: float
+    min_value: float
+    max_value: float
+    p50: Optional[float] = None
+    p95: Optional[float] = None
+    p99: Optional[float] = None
+
+class DownsampledPoint(BaseModel):
+    """Точка прореженной истории (параметр max_points в /history)"""
+    service_name: str
+    metric_name: str
+    tags: Dict[str, str] = Field(default_factory=dict)
+    timestamp: datetime
+    value: float
+
 class HistoryQuery(BaseModel):
     service_name: str
     metric_name: str
     tags_filter: Optional[Dict[str, str]] = None
     last_minutes: int = Field(default=60, ge=1, le=1440)
+
+class BatchItemError(BaseModel):
+    index: int = Field(..., description="Позиция элемента в батче (с нуля)")
+    errors: List[Dict[str, Any]]
+
+class BatchIngestResult(BaseModel):
+    received: int
+    accepted: int
+    rejected: int
+    errors: List[BatchItemError] = Field(default_factory=list)
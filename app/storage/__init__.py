@@ -0,0 +1,23 @@
+import os
+
+from app.storage.base import MetricStorage, ScanRow
+
+# Где хранятся точки:
+# - postgres: таблица metrics и всё обслуживание вокруг неё (секции, rollup, блоки, реплики)
+# - embedded: локальные файлы (журнал, голова в памяти, сегменты через mmap) без БД
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "postgres").lower()
+
+
+def create_storage(kind: str = STORAGE_BACKEND) -> MetricStorage:
+    if kind == "postgres":
+        from app.storage.postgres import PostgresStorage
+        return PostgresStorage()
+    if kind == "embedded":
+        from app.storage.embedded import EmbeddedStorage
+        return EmbeddedStorage()
+    raise ValueError(f"Unknown STORAGE_BACKEND: {kind}")
+
+
+storage = create_storage()
+
+__all__ = ["MetricStorage", "ScanRow", "STORAGE_BACKEND", "create_storage", "storage"]
@@ -0,0 +1,130 @@
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Mapping, Optional, Sequence, Tuple
+
+from app.schemas.metric import MetricCreate
+
+# Точка для холодного старта агрегаторов: (service_name, metric_name, tags, value, unix time)
+ScanRow = Tuple[str, str, Dict[str, str], float, float]
+
+
+class MetricStorage:
+    """
+    Хранилище точек метрик: запись, чтение истории, backfill и агрегаты.
+
+    Приём, буфер приёма, backfill агрегаторов, live-агрегация, /history и
+    экспортер работают только через этот интерфейс; как бэкенд ускоряет
+    запросы (rollup-таблицы, кэш результатов, сегменты в памяти), - его дело.
+    start() / stop() запускают и останавливают и его фоновое обслуживание.
+    """
+
+    kind = ""
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def healthy(self) -> bool:
+        return True
+
+    async def write(self, metrics: Sequence[MetricCreate]) -> int:
+        """Групповая запись; возвращает число записанных точек."""
+        raise NotImplementedError
+
+    async def write_one(self, metric: MetricCreate) -> Tuple[int, datetime]:
+        """Синхронная запись одной точки; возвращает (id, timestamp)."""
+        raise NotImplementedError
+
+    def scan(self, since: datetime) -> AsyncIterator[ScanRow]:
+        """Все точки не старше since (порядок внутри серии - по времени)."""
+        raise NotImplementedError
+
+    async def aggregate(
+            self,
+            window_seconds: int,
+            group_by_tags: Optional[List[str]] = None,
+            filter_tags: Optional[Dict[str, str]] = None,
+            percentile_mode: Optional[str] = None
+    ) -> List[Dict]:
+        """Агрегаты за последние window_seconds; формат - как у aggregate_last_window."""
+        raise NotImplementedError
+
+    # --- История и снимок экспортера ---
+
+    async def history(
+            self,
+            service_name: Optional[str],
+            metric_name: Optional[str],
+            tags_filter: Optional[Dict[str, str]],
+            since: datetime,
+            after_ts: Optional[datetime] = None,
+            after_id: Optional[int] = None,
+            limit: Optional[int] = None
+    ) -> List[Dict]:
+        """Сырые точки (колонки RAW_COLUMNS) в порядке (timestamp, id), строго после keyset-ключа."""
+        raise NotImplementedError
+
+    async def stream_history(
+            self,
+            service_name: Optional[str],
+            metric_name: Optional[str],
+            tags_filter: Optional[Dict[str, str]],
+            since: datetime,
+            after_ts: Optional[datetime] = None,
+            after_id: Optional[int] = None,
+            limit: Optional[int] = None
+    ) -> AsyncIterator[List[Mapping[str, Any]]]:
+        """То же, что history, пачками для потоковой выдачи; по умолчанию - одной пачкой."""
+        yield await self.history(service_name, metric_name, tags_filter, since, after_ts, after_id, limit)
+
+    async def cached_history_json(
+            self,
+            service_name: Optional[str],
+            metric_name: Optional[str],
+            tags_filter: Optional[Dict[str, str]],
+            since: datetime,
+            until: datetime
+    ) -> Optional[bytes]:
+        """Готовое JSON-тело всей истории [since, until) из кэша результатов; None - кэша нет."""
+        return None
+
+    async def step_history(
+            self,
+            service_name: Optional[str],
+            metric_name: Optional[str],
+            tags_filter: Optional[Dict[str, str]],
+            since: datetime,
+            until: datetime,
+            step_seconds: int
+    ) -> Optional[List[Dict]]:
+        """Точки с шагом step_seconds (колонки ROLLUP_COLUMNS); None - шаг мельче минимального rollup."""
+        raise NotImplementedError
+
+    async def downsample(
+            self,
+            service_name: Optional[str],
+            metric_name: Optional[str],
+            tags_filter: Optional[Dict[str, str]],
+            since: datetime,
+            until: datetime,
+            max_points: int,
+            method: str
+    ) -> List[Dict]:
+        """История, прореженная до max_points точек на серию (колонки DOWNSAMPLED_COLUMNS)."""
+        raise NotImplementedError
+
+    async def aggregate_series(self, since: datetime, percentile_mode: Optional[str] = None) -> List[Dict]:
+        """Агрегаты каждой серии с since - строки снимка экспортера."""
+        raise NotImplementedError
+
+    async def unique_tags(
+            self,
+            service_name: Optional[str],
+            metric_name: Optional[str],
+            key_prefix: str = "",
+            value_prefix: str = "",
+            limit: Optional[int] = None
+    ) -> Dict[str, List[str]]:
+        """Ключи тегов и их значения (отсортированные, не больше limit на ключ) для автокомплита."""
+        raise NotImplementedError
@@ -0,0 +1,665 @@
+import asyncio
+import heapq
+import json
+import logging
+import math
+import os
+import struct
+import time
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+from typing import AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+from prometheus_client import Counter, Gauge, Histogram
+
+from app.core.blocks import Sample, from_micros, to_micros
+from app.core.partitions import METRICS_RETENTION_DAYS
+from app.core.rollups import ROLLUP_LEVELS, floor_time, rollup_points
+from app.core.series import SeriesInfo, SeriesKey, compute_series_id, series_key
+from app.core.stream_aggregator import WindowStats
+from app.core.tag_index import tag_index
+from app.schemas.metric import MetricCreate
+from app.storage.base import MetricStorage, ScanRow
+from app.storage.segments import SEGMENT_SUFFIX, Segment, segment_name, write_segment
+from app.storage.wal import RecordLog, WriteAheadLog, read_records
+from app.utils.downsampling import DOWNSAMPLE_DEFAULT_METHOD, downsample_samples
+
+try:
+    import fcntl
+except ImportError:  # не POSIX - без блокировки каталога
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Каталог данных: series.log, wal/, segments/
+STORAGE_EMBEDDED_PATH = os.getenv("STORAGE_EMBEDDED_PATH", "data/embedded")
+# Диапазон одного сегмента. Голова в памяти держит не больше одного-двух
+# диапазонов: ~24 байта на точку
+STORAGE_EMBEDDED_SEGMENT_SECONDS = int(os.getenv("STORAGE_EMBEDDED_SEGMENT_SECONDS", "600"))
+# fsync журнала:
+# - always: перед ответом на каждую запись (ничего не теряется при падении машины)
+# - interval: раз в STORAGE_EMBEDDED_WAL_SYNC_INTERVAL_MS (теряется не больше интервала)
+# - none: только буфер ОС (переживает падение процесса, но не машины)
+STORAGE_EMBEDDED_WAL_SYNC = os.getenv("STORAGE_EMBEDDED_WAL_SYNC", "interval").lower()
+STORAGE_EMBEDDED_WAL_SYNC_INTERVAL_MS = int(os.getenv("STORAGE_EMBEDDED_WAL_SYNC_INTERVAL_MS", "1000"))
+# Как часто проверять, не закрылся ли диапазон головы
+STORAGE_EMBEDDED_SEAL_CHECK_SECONDS = float(os.getenv("STORAGE_EMBEDDED_SEAL_CHECK_SECONDS", "10"))
+
+# Запись журнала: timestamp (мкс) и id первой точки, число точек; дальше
+# массивы series_id (int64) и value (float64)
+_SAMPLES = struct.Struct("<qqI")
+# Запись series.log: series_id, дальше JSON [service_name, metric_name, tags]
+_SERIES = struct.Struct("<q")
+
+# --- Внутренние метрики (видны на /metrics/internal) ---
+EMBEDDED_APPENDED = Counter(
+    "embedded_storage_appended_samples_total",
+    "Samples appended to the embedded storage",
+)
+EMBEDDED_HEAD_SAMPLES = Gauge(
+    "embedded_storage_head_samples",
+    "Samples held in the in-memory head",
+)
+EMBEDDED_SEGMENTS = Gauge(
+    "embedded_storage_segments",
+    "Number of open segment files",
+)
+EMBEDDED_SEGMENT_BYTES = Gauge(
+    "embedded_storage_segment_bytes",
+    "Total size of open segment files",
+)
+EMBEDDED_WAL_SYNC_SECONDS = Histogram(
+    "embedded_storage_wal_sync_seconds",
+    "Latency of a WAL fsync",
+)
+EMBEDDED_SEAL_SECONDS = Histogram(
+    "embedded_storage_seal_seconds",
+    "Time to encode and write one segment",
+)
+
+
+class _HeadSeries:
+    """Точки серии в голове: колонки в порядке (timestamp, id)."""
+
+    __slots__ = ("ts", "ids", "values")
+
+    def __init__(self):
+        self.ts = array("q")
+        self.ids = array("q")
+        self.values = array("d")
+
+
+def _percentile(ordered: Sequence[float], q: float) -> float:
+    """Линейная интерполяция, как percentile_cont."""
+    position = (len(ordered) - 1) * q
+    lower = math.floor(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def _summary(values: List[float]) -> Dict:
+    values.sort()
+    return {
+        "avg_value": math.fsum(values) / len(values),
+        "min_value": values[0],
+        "max_value": values[-1],
+        "count": len(values),
+        "p50": _percentile(values, 0.5),
+        "p95": _percentile(values, 0.95),
+        "p99": _percentile(values, 0.99),
+    }
+
+
+class EmbeddedStorage(MetricStorage):
+    """
+    Встроенное хранилище без БД - для edge-развёртываний и бенчмарков.
+
+    - Журнал (WAL): каждая запись - одна запись журнала со всеми точками
+      пачки; при старте журнал проигрывается в голову.
+    - Голова: точки последних диапазонов в памяти, колонками по сериям.
+    - Сегменты: когда диапазон STORAGE_EMBEDDED_SEGMENT_SECONDS закрыт, его
+      точки кодируются (Gorilla, как блоки в Postgres) в неизменяемый файл,
+      который читается через mmap; файлы журнала, целиком попавшие в
+      сегменты, удаляются. Старые сегменты удаляются по METRICS_RETENTION_DAYS.
+
+    Время точки назначает хранилище (как now() в Postgres), монотонно; id
+    точек - общая возрастающая последовательность, поэтому keyset-пагинация
+    по (timestamp, id) работает так же. Серии - те же blake2b-id, что в
+    таблице series; они пишутся в series.log и регистрируются в индексе тегов.
+
+    Каталог использует один процесс (блокировка LOCK): запускать с одним воркером.
+    Запросы выполняются в event loop - хранилище рассчитано на небольшие выборки.
+    """
+
+    kind = "embedded"
+
+    def __init__(
+            self,
+            path: str = STORAGE_EMBEDDED_PATH,
+            segment_seconds: int = STORAGE_EMBEDDED_SEGMENT_SECONDS,
+            wal_sync: str = STORAGE_EMBEDDED_WAL_SYNC,
+    ):
+        self.path = path
+        self.segment_us = segment_seconds * 1_000_000
+        self.wal_sync = wal_sync
+        self._segments_dir = os.path.join(path, "segments")
+        self._wal = WriteAheadLog(os.path.join(path, "wal"))
+        self._series_log = RecordLog(os.path.join(path, "series.log"))
+
+        self._series: Dict[int, SeriesInfo] = {}
+        self._ids_by_key: Dict[SeriesKey, int] = {}
+        self._head: Dict[int, _HeadSeries] = {}
+        self._head_samples = 0
+        self._segments: List[Segment] = []
+        # Все точки раньше этого момента (мкс) уже в сегментах
+        self._persisted_until = 0
+        # Максимальный timestamp точек в каждом файле журнала (-1 - пустой)
+        self._wal_max_ts: Dict[int, int] = {}
+        self._next_id = 1
+        self._last_ts = 0
+
+        self._lock_file = None
+        self._seal_lock = asyncio.Lock()
+        self._tasks: List[asyncio.Task] = []
+        self._dirty = False
+        self._started = False
+
+        EMBEDDED_HEAD_SAMPLES.set_function(lambda: self._head_samples)
+        EMBEDDED_SEGMENTS.set_function(lambda: len(self._segments))
+        EMBEDDED_SEGMENT_BYTES.set_function(lambda: sum(s.size for s in self._segments))
+
+    # --- Жизненный цикл ---
+
+    async def start(self):
+        if self._started:
+            return
+        os.makedirs(self._segments_dir, exist_ok=True)
+        os.makedirs(self._wal.directory, exist_ok=True)
+        self._lock_directory()
+
+        self._load_series()
+        self._load_segments()
+        replayed = self._replay_wal()
+        self._wal.open()
+        self._wal_max_ts[self._wal.seq] = -1
+        self._series_log.open()
+        # Все серии уже зарегистрированы - индекс тегов полон без таблицы series
+        tag_index.mark_ready()
+
+        if self.wal_sync != "always":
+            self._tasks.append(asyncio.create_task(self._syncer()))
+        self._tasks.append(asyncio.create_task(self._sealer()))
+        self._started = True
+        logger.info(
+            f"💽 Embedded storage opened at {self.path}: {len(self._series)} series, "
+            f"{len(self._segments)} segments, {replayed} samples replayed from WAL"
+        )
+
+    async def stop(self):
+        if not self._started:
+            return
+        for task in self._tasks:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks.clear()
+
+        # Голова не сбрасывается в сегмент: её восстановит журнал при следующем старте
+        self._series_log.close()
+        self._wal.close()
+        for segment in self._segments:
+            segment.close()
+        self._segments.clear()
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+        self._started = False
+        logger.info("💽 Embedded storage closed")
+
+    async def healthy(self) -> bool:
+        return self._started
+
+    def _lock_directory(self):
+        self._lock_file = open(os.path.join(self.path, "LOCK"), "a")
+        if fcntl is None:
+            return
+        try:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._lock_file.close()
+            self._lock_file = None
+            raise RuntimeError(f"Embedded storage at {self.path} is used by another process")
+
+    def _load_series(self):
+        if not os.path.exists(self._series_log.path):
+            return
+        for payload in read_records(self._series_log.path, repair=True):
+            (series_id,) = _SERIES.unpack_from(payload)
+            service_name, metric_name, tags = json.loads(payload[_SERIES.size:])
+            self._add_series(series_id, series_key(service_name, metric_name, tags))
+
+    def _load_segments(self):
+        for name in sorted(os.listdir(self._segments_dir)):
+            path = os.path.join(self._segments_dir, name)
+            if name.endswith(".tmp"):
+                # Сегмент, не дописанный до падения: его точки ещё в журнале
+                os.remove(path)
+                continue
+            if not name.endswith(SEGMENT_SUFFIX):
+                continue
+            try:
+                segment = Segment(path)
+            except (OSError, ValueError) as e:
+                logger.error(f"❌ Skipping unreadable segment (renamed to .corrupt): {e}")
+                os.replace(path, path + ".corrupt")
+                continue
+            self._segments.append(segment)
+            self._persisted_until = max(self._persisted_until, segment.end_us)
+            self._next_id = max(self._next_id, segment.max_id + 1)
+            self._last_ts = max(self._last_ts, segment.max_ts)
+        self._segments.sort(key=lambda s: s.start_us)
+
+    def _replay_wal(self) -> int:
+        replayed = 0
+        for seq in self._wal.sequences():
+            self._wal_max_ts[seq] = -1
+        for seq, payload in self._wal.replay():
+            ts_us, first_id, count = _SAMPLES.unpack_from(payload)
+            self._wal_max_ts[seq] = max(self._wal_max_ts[seq], ts_us)
+            self._next_id = max(self._next_id, first_id + count)
+            self._last_ts = max(self._last_ts, ts_us)
+            if ts_us < self._persisted_until:
+                continue
+            offset = _SAMPLES.size
+            series_ids = array("q", payload[offset:offset + 8 * count])
+            values = array("d", payload[offset + 8 * count:offset + 16 * count])
+            self._apply(ts_us, first_id, series_ids, values)
+            replayed += count
+        return replayed
+
+    # --- Запись ---
+
+    def _add_series(self, series_id: int, key: SeriesKey):
+        self._ids_by_key[key] = series_id
+        info = self._series[series_id] = SeriesInfo(series_id, key[0], key[1], dict(key[2]))
+        tag_index.add(series_id, info.service_name, info.metric_name, info.tags)
+
+    def series_id(self, service_name: str, metric_name: str, tags: Optional[Dict[str, str]]) -> int:
+        """id серии; новая серия дописывается в series.log до первой своей точки в журнале."""
+        key = series_key(service_name, metric_name, tags)
+        series_id = self._ids_by_key.get(key)
+        if series_id is None:
+            series_id = compute_series_id(key)
+            self._series_log.append(
+                _SERIES.pack(series_id),
+                json.dumps([key[0], key[1], dict(key[2])], separators=(",", ":"), ensure_ascii=False).encode()
+            )
+            self._series_log.flush()
+            self._add_series(series_id, key)
+        return series_id
+
+    def _now_us(self) -> int:
+        # Не назад: перевод часов не ломает порядок (timestamp, id) в голове и журнале
+        now_us = time.time_ns() // 1000
+        if now_us < self._last_ts:
+            now_us = self._last_ts
+        self._last_ts = now_us
+        return now_us
+
+    def _apply(self, ts_us: int, first_id: int, series_ids: Sequence[int], values: Sequence[float]):
+        head = self._head
+        point_id = first_id
+        for series_id, value in zip(series_ids, values):
+            series = head.get(series_id)
+            if series is None:
+                series = head[series_id] = _HeadSeries()
+            series.ts.append(ts_us)
+            series.ids.append(point_id)
+            series.values.append(value)
+            point_id += 1
+        self._head_samples += len(values)
+
+    async def append(self, series_ids: Sequence[int], values: Sequence[float]) -> Tuple[int, int]:
+        """
+        Пачка точек уже известных серий (series_id) с общим временем.
+        Одна запись журнала на пачку. Возвращает (id первой точки, timestamp в мкс).
+        """
+        ts_us = self._now_us()
+        if not values:
+            return self._next_id, ts_us
+        series_ids = series_ids if isinstance(series_ids, array) else array("q", series_ids)
+        values = values if isinstance(values, array) else array("d", values)
+        first_id = self._next_id
+        self._next_id += len(values)
+
+        self._wal.append(_SAMPLES.pack(ts_us, first_id, len(values)), series_ids.tobytes(), values.tobytes())
+        self._wal_max_ts[self._wal.seq] = ts_us
+        self._apply(ts_us, first_id, series_ids, values)
+        EMBEDDED_APPENDED.inc(len(values))
+
+        if self.wal_sync == "always":
+            await asyncio.to_thread(self._sync)
+        else:
+            self._dirty = True
+        return first_id, ts_us
+
+    async def write(self, metrics: Sequence[MetricCreate]) -> int:
+        series_ids = array("q", [self.series_id(m.service_name, m.metric_name, m.tags) for m in metrics])
+        await self.append(series_ids, [m.value for m in metrics])
+        return len(metrics)
+
+    async def write_one(self, metric: MetricCreate) -> Tuple[int, datetime]:
+        series_id = self.series_id(metric.service_name, metric.metric_name, metric.tags)
+        point_id, ts_us = await self.append([series_id], [metric.value])
+        return point_id, from_micros(ts_us)
+
+    def _sync(self):
+        if self.wal_sync == "none":
+            self._series_log.flush()
+            self._wal.flush()
+            return
+        started = time.perf_counter()
+        # Серии - раньше точек: после падения у каждой точки журнала есть описание серии
+        self._series_log.sync()
+        self._wal.sync()
+        EMBEDDED_WAL_SYNC_SECONDS.observe(time.perf_counter() - started)
+
+    async def _syncer(self):
+        """Фоновая задача: fsync журнала раз в интервал, если были записи."""
+        while True:
+            await asyncio.sleep(STORAGE_EMBEDDED_WAL_SYNC_INTERVAL_MS / 1000)
+            if not self._dirty:
+                continue
+            self._dirty = False
+            try:
+                await asyncio.to_thread(self._sync)
+            except Exception as e:
+                logger.warning(f"⚠️ Embedded storage WAL sync error (will retry): {e}")
+                self._dirty = True
+
+    # --- Сегменты ---
+
+    async def seal(self, now_us: Optional[int] = None) -> int:
+        """
+        Переносит закрытые диапазоны головы в сегменты (от старого к новому)
+        и удаляет сегменты старше retention. Возвращает число записанных сегментов.
+        """
+        sealed = 0
+        async with self._seal_lock:
+            while self._head:
+                now = time.time_ns() // 1000 if now_us is None else now_us
+                oldest = min(series.ts[0] for series in self._head.values())
+                start = oldest // self.segment_us * self.segment_us
+                end = start + self.segment_us
+                if end > now:
+                    break
+                await self._seal_range(start, end)
+                sealed += 1
+
+            if METRICS_RETENTION_DAYS > 0:
+                now = time.time_ns() // 1000 if now_us is None else now_us
+                self._drop_segments_before(now - METRICS_RETENTION_DAYS * 86400 * 1_000_000)
+        return sealed
+
+    async def _seal_range(self, start: int, end: int):
+        # Новый файл журнала: старые удаляются, когда все их точки окажутся в сегментах
+        self._wal_max_ts[self._wal.rotate()] = -1
+
+        columns = {}
+        cut: Dict[int, int] = {}
+        for series_id, series in self._head.items():
+            count = bisect_left(series.ts, end)
+            if count:
+                columns[series_id] = (series.ts[:count], series.ids[:count], series.values[:count])
+                cut[series_id] = count
+
+        path = os.path.join(self._segments_dir, segment_name(start, end))
+        started = time.perf_counter()
+        # Кодирование - в потоке; голова тем временем только дописывается после end
+        await asyncio.to_thread(write_segment, path, start, end, columns)
+        segment = Segment(path)
+        EMBEDDED_SEAL_SECONDS.observe(time.perf_counter() - started)
+
+        # Сегмент появляется и голова усекается без await между ними:
+        # запрос видит каждую точку ровно один раз
+        self._segments.append(segment)
+        self._segments.sort(key=lambda s: s.start_us)
+        for series_id, count in cut.items():
+            series = self._head[series_id]
+            if count == len(series.ts):
+                del self._head[series_id]
+                continue
+            del series.ts[:count]
+            del series.ids[:count]
+            del series.values[:count]
+        self._head_samples -= sum(cut.values())
+        self._persisted_until = max(self._persisted_until, end)
+        # Время новых точек - не раньше end, даже если часы отступят: в закрытый диапазон они не попадут
+        self._last_ts = max(self._last_ts, end)
+
+        stale = [seq for seq, max_ts in self._wal_max_ts.items()
+                 if seq != self._wal.seq and max_ts < self._persisted_until]
+        self._wal.remove(stale)
+        for seq in stale:
+            del self._wal_max_ts[seq]
+        logger.debug(f"💽 Sealed segment {os.path.basename(path)}: {sum(cut.values())} samples, {segment.size} bytes")
+
+    def _drop_segments_before(self, cutoff_us: int):
+        expired = [s for s in self._segments if s.end_us <= cutoff_us]
+        for segment in expired:
+            self._segments.remove(segment)
+            segment.close()
+            os.remove(segment.path)
+        if expired:
+            logger.info(f"💽 Dropped {len(expired)} segments past retention")
+
+    async def _sealer(self):
+        """Фоновая задача: закрытые диапазоны головы - в сегменты."""
+        while True:
+            await asyncio.sleep(STORAGE_EMBEDDED_SEAL_CHECK_SECONDS)
+            try:
+                await self.seal()
+            except Exception as e:
+                logger.warning(f"⚠️ Embedded storage seal error (will retry): {e}")
+
+    # --- Чтение ---
+
+    def _resolve(
+            self,
+            service_name: Optional[str] = None,
+            metric_name: Optional[str] = None,
+            tags_filter: Optional[Dict[str, str]] = None
+    ) -> List[int]:
+        return sorted(s for s in tag_index.resolve(service_name, metric_name, tags_filter) if s in self._series)
+
+    def _overlapping(self, since_us: int, until_us: Optional[int]) -> List[Segment]:
+        return [
+            s for s in self._segments
+            if s.end_us > since_us and (until_us is None or s.start_us < until_us)
+        ]
+
+    def _samples(self, series_id: int, since_us: int, until_us: Optional[int],
+                 segments: List[Segment]) -> List[Sample]:
+        """Точки серии в [since_us, until_us) по (timestamp, id): сегменты, затем голова."""
+        points: List[Sample] = []
+        for segment in segments:
+            ts, ids, values = segment.columns(series_id, since_us, until_us)
+            points.extend(zip(ts, ids, values))
+        series = self._head.get(series_id)
+        if series is not None:
+            lo = bisect_left(series.ts, since_us)
+            hi = len(series.ts) if until_us is None else bisect_left(series.ts, until_us)
+            points.extend(zip(series.ts[lo:hi], series.ids[lo:hi], series.values[lo:hi]))
+        return points
+
+    def _values(self, series_id: int, since_us: int, segments: List[Segment]) -> List[float]:
+        """Только значения серии с since_us - без декодирования id."""
+        values: List[float] = []
+        for segment in segments:
+            values.extend(segment.columns(series_id, since_us, with_ids=False)[2])
+        series = self._head.get(series_id)
+        if series is not None:
+            values.extend(series.values[bisect_left(series.ts, since_us):])
+        return values
+
+    async def scan(self, since: datetime) -> AsyncIterator[ScanRow]:
+        since_us = to_micros(since)
+        segments = self._overlapping(since_us, None)
+        for series_id in list(self._series):
+            info = self._series[series_id]
+            for ts_us, _, value in self._samples(series_id, since_us, None, segments):
+                yield info.service_name, info.metric_name, info.tags, value, ts_us / 1_000_000
+
+    async def history(
+            self,
+            service_name: Optional[str],
+            metric_name: Optional[str],
+            tags_filter: Optional[Dict[str, str]],
+            since: datetime,
+            after_ts: Optional[datetime] = None,
+            after_id: Optional[int] = None,
+            limit: Optional[int] = None
+    ) -> List[Dict]:
+        since_us = to_micros(since)
+        # Keyset: первая точка строго после (after_ts, after_id) - бинарным поиском в каждой серии
+        after_key = None
+        if after_ts is not None:
+            after_us = to_micros(after_ts)
+            after_key = (after_us, after_id + 1) if after_id is not None else (after_us + 1,)
+            since_us = max(since_us, after_us)
+        segments = self._overlapping(since_us, None)
+
+        streams = []
+        for series_id in self._resolve(service_name, metric_name, tags_filter):
+            points = self._samples(series_id, since_us, None, segments)
+            if after_key is not None:
+                points = points[bisect_left(points, after_key):]
+            if limit is not None:
+                points = points[:limit]
+            if points:
+                streams.append([(ts_us, point_id, value, series_id) for ts_us, point_id, value in points])
+
+        rows = []
+        for ts_us, point_id, value, series_id in islice(heapq.merge(*streams), limit):
+            info = self._series[series_id]
+            rows.append({
+                "id": point_id,
+                "service_name": info.service_name,
+                "metric_name": info.metric_name,
+                "value": value,
+                "tags": info.tags,
+                "timestamp": from_micros(ts_us),
+            })
+        return rows
+
+    async def step_history(
+            self,
+            service_name: Optional[str],
+            metric_name: Optional[str],
+            tags_filter: Optional[Dict[str, str]],
+            since: datetime,
+            until: datetime,
+            step_seconds: int
+    ) -> Optional[List[Dict]]:
+        # Те же шаги, что у rollup в Postgres: мельче минимального уровня - сырые точки
+        if step_seconds < ROLLUP_LEVELS[0].step_seconds:
+            return None
+        since_us, until_us = to_micros(floor_time(since, step_seconds)), to_micros(until)
+        step_us = step_seconds * 1_000_000
+        segments = self._overlapping(since_us, until_us)
+
+        buckets: Dict[int, WindowStats] = {}
+        for series_id in self._resolve(service_name, metric_name, tags_filter):
+            for ts_us, _, value in self._samples(series_id, since_us, until_us, segments):
+                bucket = ts_us // step_us
+                stats = buckets.get(bucket)
+                if stats is None:
+                    stats = buckets[bucket] = WindowStats()
+                stats.add(value)
+        return rollup_points({from_micros(bucket * step_us): stats for bucket, stats in buckets.items()})
+
+    async def downsample(
+            self,
+            service_name: Optional[str],
+            metric_name: Optional[str],
+            tags_filter: Optional[Dict[str, str]],
+            since: datetime,
+            until: datetime,
+            max_points: int,
+            method: str = DOWNSAMPLE_DEFAULT_METHOD
+    ) -> List[Dict]:
+        since_us, until_us = to_micros(since), to_micros(until)
+        segments = self._overlapping(since_us, until_us)
+        samples = {}
+        for series_id in self._resolve(service_name, metric_name, tags_filter):
+            points = self._samples(series_id, since_us, until_us, segments)
+            if points:
+                samples[series_id] = points
+        return downsample_samples(samples, self._series, since, until, max_points, method)
+
+    async def aggregate(
+            self,
+            window_seconds: int,
+            group_by_tags: Optional[List[str]] = None,
+            filter_tags: Optional[Dict[str, str]] = None,
+            percentile_mode: Optional[str] = None
+    ) -> List[Dict]:
+        """
+        Агрегаты за окно. Перцентили точные в любом режиме: отсортировать
+        значения в Python дешевле, чем наполнить ими скетч.
+        """
+        group_by_tags = group_by_tags or []
+        since_us = to_micros(datetime.now(timezone.utc) - timedelta(seconds=window_seconds))
+        segments = self._overlapping(since_us, None)
+
+        groups: Dict[Tuple, List[float]] = {}
+        for series_id in self._resolve(tags_filter=filter_tags):
+            values = self._values(series_id, since_us, segments)
+            if not values:
+                continue
+            info = self._series[series_id]
+            key = (info.service_name, info.metric_name, tuple(info.tags.get(k) for k in group_by_tags))
+            groups.setdefault(key, []).extend(values)
+
+        aggregates = []
+        for (service_name, metric_name, tag_values), values in sorted(groups.items(), key=lambda g: g[0][:2]):
+            aggregates.append({
+                "service_name": service_name,
+                "metric_name": metric_name,
+                **_summary(values),
+                "window_seconds": window_seconds,
+                "tags": {k: v for k, v in zip(group_by_tags, tag_values) if v is not None},
+            })
+        return aggregates
+
+    async def aggregate_series(self, since: datetime, percentile_mode: Optional[str] = None) -> List[Dict]:
+        since_us = to_micros(since)
+        segments = self._overlapping(since_us, None)
+
+        rows = []
+        for series_id, info in list(self._series.items()):
+            values = self._values(series_id, since_us, segments)
+            if not values:
+                continue
+            rows.append({
+                "service_name": info.service_name,
+                "metric_name": info.metric_name,
+                "tags": info.tags,
+                **_summary(values),
+            })
+        return rows
+
+    async def unique_tags(
+            self,
+            service_name: Optional[str],
+            metric_name: Optional[str],
+            key_prefix: str = "",
+            value_prefix: str = "",
+            limit: Optional[int] = None
+    ) -> Dict[str, List[str]]:
+        # Индекс тегов ведётся при записи - он и есть каталог серий
+        return tag_index.unique_tags(service_name, metric_name, key_prefix, value_prefix, limit)
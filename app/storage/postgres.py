@@ -0,0 +1,502 @@
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Mapping, Optional, Sequence, Tuple
+
+from pydantic_core import to_json
+from sqlalchemy import bindparam, func, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.blocks import blocks_may_cover, load_block_history, merge_history
+from app.core.compaction import METRIC_BLOCKS_ENABLED, block_compactor
+from app.core.db import (
+    DATABASE_REPLICA_URLS,
+    check_db_connection,
+    check_replicas,
+    close_db,
+    init_db,
+    replica_monitor,
+    session_maker,
+)
+from app.core.fastpath import FASTPATH_ENABLED, PreparedQuery, fetch_history, insert_metric, raw_connection
+from app.core.partitions import ensure_partitions, partition_maintainer
+from app.core.result_cache import RESULT_CACHE_ENABLED, bucketed_key, cache_get, cache_set, cached_history
+from app.core.rollups import query_rollup_history, rollup_maintainer
+from app.core.series import indexed_series_ids, restrict_to_series, series_filter, series_registry
+from app.core.tag_index import TAG_INDEX_ENABLED, tag_index, tag_index_maintainer
+from app.models.metric import Metric
+from app.models.series import Series
+from app.schemas.metric import MetricCreate
+from app.storage.base import MetricStorage, ScanRow
+from app.utils.aggregators import (
+    PERCENTILE_MODE,
+    aggregate_last_window,
+    fold_sketch_rows,
+    sketch_aggregate_columns,
+    sketch_bucket_columns,
+)
+from app.utils.bulk_insert import copy_metrics
+from app.utils.downsampling import DOWNSAMPLE_DEFAULT_METHOD, downsample_history
+
+logger = logging.getLogger(__name__)
+
+# Строк в одной пачке потоковой выдачи истории (fetch серверного курсора)
+HISTORY_STREAM_BATCH_SIZE = int(os.getenv("HISTORY_STREAM_BATCH_SIZE", "5000"))
+
+
+def _history_query(
+        service_name: Optional[str],
+        metric_name: Optional[str],
+        since: datetime,
+        after_ts: Optional[datetime],
+        after_id: Optional[int],
+        limit: Optional[int]
+):
+    """Запрос сырых точек истории в порядке (timestamp, id) - ключ keyset-пагинации."""
+    query = select(
+        Metric.id,
+        Series.service_name,
+        Series.metric_name,
+        Metric.value,
+        Series.tags,
+        Metric.timestamp,
+    ).join(
+        Series, Series.id == Metric.series_id
+    ).where(
+        Metric.timestamp >= since
+    ).order_by(Metric.timestamp, Metric.id)
+
+    # Keyset: строго после последней строки предыдущей страницы, без OFFSET
+    if after_ts is not None:
+        if after_id is not None:
+            query = query.where(tuple_(Metric.timestamp, Metric.id) > tuple_(after_ts, after_id))
+        else:
+            query = query.where(Metric.timestamp > after_ts)
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+
+async def _restricted_history_query(session: AsyncSession, query_args: Dict[str, Any]):
+    # Фильтры резолвятся в набор серий до чтения точек
+    query = _history_query(
+        query_args["service_name"],
+        query_args["metric_name"],
+        query_args["since"],
+        query_args["after_ts"],
+        query_args["after_id"],
+        query_args["limit"],
+    )
+    return await restrict_to_series(
+        session, query, Metric.series_id,
+        query_args["service_name"], query_args["metric_name"], query_args["tags_filter"], joined=True
+    )
+
+
+async def _block_history(session: AsyncSession, query_args: Dict[str, Any]) -> List[Dict]:
+    """
+    Точки истории из сжатых блоков (app.core.blocks). Сессия должна быть в
+    REPEATABLE READ: блоки и сырые точки читаются из одного снимка.
+    """
+    return await load_block_history(
+        session,
+        query_args["service_name"],
+        query_args["metric_name"],
+        query_args["tags_filter"],
+        query_args["since"],
+        query_args["after_ts"],
+        query_args["after_id"],
+    )
+
+
+def _sketch_rows_statement(since):
+    """Корзины DDSketch по series_id за окно: GROUP BY вместо сортировки значений."""
+    sign_expr, key_expr = sketch_bucket_columns(Metric.value)
+    return select(
+        Metric.series_id,
+        sign_expr.label('sk_sign'),
+        key_expr.label('sk_key'),
+        *sketch_aggregate_columns(Metric.value)
+    ).where(
+        Metric.timestamp >= since
+    ).group_by(
+        Metric.series_id,
+        sign_expr,
+        key_expr
+    )
+
+
+# Тот же запрос, скомпилированный один раз для сырого asyncpg-соединения
+SKETCH_ROWS_QUERY = PreparedQuery(_sketch_rows_statement(bindparam('since', type_=Metric.timestamp.type)))
+
+
+class PostgresStorage(MetricStorage):
+    """
+    Точки в таблице metrics (секции, сжатые блоки, rollup-таблицы).
+
+    start() проверяет БД, создаёт схему и секции и запускает обслуживание
+    (реплики, секции, индекс тегов, rollup, сжатие блоков); запросы истории
+    идут через rollup-таблицы, подготовленные запросы asyncpg, серверные
+    курсоры и кэш результатов.
+    """
+
+    kind = "postgres"
+
+    def __init__(self):
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self):
+        if not await check_db_connection():
+            logger.error("❌ Cannot start without database connection")
+            raise RuntimeError("Database connection failed")
+
+        # Инициализация таблиц БД (в продакшене лучше через Alembic)
+        if os.getenv("AUTO_MIGRATE", "true").lower() == "true":
+            await init_db()
+            logger.info("✅ Database tables initialized")
+
+        # Реплики для read-only пулов: проверка сразу и затем периодически
+        if DATABASE_REPLICA_URLS:
+            await check_replicas()
+            self._tasks.append(asyncio.create_task(replica_monitor()))
+            logger.info(f"📚 Read replicas enabled: {len(DATABASE_REPLICA_URLS)}")
+
+        # Секции metrics создаются до первой вставки; если не вышло, точки
+        # примет default-секция, а обслуживание повторит попытку
+        try:
+            await ensure_partitions()
+        except Exception as e:
+            logger.warning(f"⚠️ Partition setup failed, maintainer will retry: {e}")
+        self._tasks.append(asyncio.create_task(partition_maintainer()))
+        logger.info("🗂️ Partition maintainer started")
+
+        # Загрузка индекса тегов из таблицы series
+        if TAG_INDEX_ENABLED:
+            try:
+                loaded = await tag_index.refresh()
+                logger.info(f"🏷️ Tag index loaded: {loaded} series")
+            except Exception as e:
+                logger.warning(f"⚠️ Tag index load failed, falling back to SQL: {e}")
+            self._tasks.append(asyncio.create_task(tag_index_maintainer()))
+
+        # Инкрементальное обновление rollup-таблиц (1m / 5m / 1h)
+        self._tasks.append(asyncio.create_task(rollup_maintainer()))
+        logger.info("📦 Rollup maintainer started")
+
+        # Перенос холодных сырых точек в сжатые блоки
+        if METRIC_BLOCKS_ENABLED:
+            self._tasks.append(asyncio.create_task(block_compactor()))
+            logger.info("🧊 Block compactor started")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks.clear()
+        await close_db()
+
+    async def healthy(self) -> bool:
+        return await check_db_connection()
+
+    async def write(self, metrics: Sequence[MetricCreate]) -> int:
+        if not metrics:
+            return 0
+        async with session_maker("ingest")() as session:
+            written = await copy_metrics(session, metrics)
+            await session.commit()
+        return written
+
+    async def write_one(self, metric: MetricCreate) -> Tuple[int, datetime]:
+        series_id = await series_registry.resolve(metric)
+        if FASTPATH_ENABLED:
+            # INSERT ... RETURNING на сыром соединении вместо add / commit / refresh
+            return await insert_metric(series_id, metric.value)
+
+        async with session_maker("ingest")() as session:
+            db_metric = Metric(series_id=series_id, value=metric.value)
+            session.add(db_metric)
+            await session.commit()
+            await session.refresh(db_metric)
+            return db_metric.id, db_metric.timestamp
+
+    async def scan(self, since: datetime) -> AsyncIterator[ScanRow]:
+        query = select(
+            Series.service_name,
+            Series.metric_name,
+            Series.tags,
+            Metric.value,
+            Metric.timestamp,
+        ).join(
+            Series, Series.id == Metric.series_id
+        ).where(
+            Metric.timestamp >= since
+        )
+
+        async with session_maker("background", read_only=True)() as session:
+            result = await session.stream(query)
+            async for row in result:
+                yield row.service_name, row.metric_name, row.tags, row.value, row.timestamp.timestamp()
+
+    async def aggregate(
+            self,
+            window_seconds: int,
+            group_by_tags: Optional[List[str]] = None,
+            filter_tags: Optional[Dict[str, str]] = None,
+            percentile_mode: Optional[str] = None
+    ) -> List[Dict]:
+        return await aggregate_last_window(
+            window_seconds=window_seconds,
+            group_by_tags=group_by_tags,
+            filter_tags=filter_tags,
+            percentile_mode=percentile_mode or PERCENTILE_MODE
+        )
+
+    async def history(
+            self,
+            service_name: Optional[str],
+            metric_name: Optional[str],
+            tags_filter: Optional[Dict[str, str]],
+            since: datetime,
+            after_ts: Optional[datetime] = None,
+            after_id: Optional[int] = None,
+            limit: Optional[int] = None
+    ) -> List[Mapping[str, Any]]:
+        if FASTPATH_ENABLED:
+            # Серии - из индекса тегов, точки - подготовленным запросом asyncpg
+            series_ids = await indexed_series_ids(service_name, metric_name, tags_filter)
+            if series_ids is not None:
+                return await fetch_history(sorted(series_ids), since, after_ts, after_id, limit)
+
+        query_args = dict(
+            service_name=service_name,
+            metric_name=metric_name,
+            tags_filter=tags_filter,
+            since=since,
+            after_ts=after_ts,
+            after_id=after_id,
+            limit=limit,
+        )
+        async with session_maker("interactive", read_only=True)() as session:
+            if not blocks_may_cover(since):
+                result = await session.execute(await _restricted_history_query(session, query_args))
+                return [row._mapping for row in result]
+
+            # Холодный диапазон: блоки и сырые точки из одного снимка
+            await session.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+            cold = await _block_history(session, query_args)
+            result = await session.execute(await _restricted_history_query(session, query_args))
+            return merge_history(cold, [row._mapping for row in result], limit)
+
+    async def stream_history(
+            self,
+            service_name: Optional[str],
+            metric_name: Optional[str],
+            tags_filter: Optional[Dict[str, str]],
+            since: datetime,
+            after_ts: Optional[datetime] = None,
+            after_id: Optional[int] = None,
+            limit: Optional[int] = None
+    ) -> AsyncIterator[List[Mapping[str, Any]]]:
+        """
+        Пачки через серверный курсор (session.stream) на собственной сессии.
+        Точки из сжатых блоков идут первой пачкой: блоки целиком старше сырых
+        точек, поэтому порядок (timestamp, id) сохраняется.
+        """
+        query_args = dict(
+            service_name=service_name,
+            metric_name=metric_name,
+            tags_filter=tags_filter,
+            since=since,
+            after_ts=after_ts,
+            after_id=after_id,
+            limit=limit,
+        )
+        async with session_maker("interactive", read_only=True)() as session:
+            if blocks_may_cover(since):
+                await session.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+                cold = await _block_history(session, query_args)
+                if limit is not None:
+                    cold = cold[:limit]
+                    query_args["limit"] = limit - len(cold)
+                if cold:
+                    yield cold
+                if query_args["limit"] == 0:
+                    return
+
+            query = await _restricted_history_query(session, query_args)
+            result = await session.stream(query.execution_options(yield_per=HISTORY_STREAM_BATCH_SIZE))
+            async for partition in result.mappings().partitions():
+                yield partition
+
+    async def cached_history_json(
+            self,
+            service_name: Optional[str],
+            metric_name: Optional[str],
+            tags_filter: Optional[Dict[str, str]],
+            since: datetime,
+            until: datetime
+    ) -> Optional[bytes]:
+        # Закрытые чанки - из кэша результатов, в БД - только хвост
+        if not (FASTPATH_ENABLED and RESULT_CACHE_ENABLED):
+            return None
+        series_ids = await indexed_series_ids(service_name, metric_name, tags_filter)
+        if series_ids is None:
+            return None
+        return await cached_history(series_ids, since, until)
+
+    async def step_history(
+            self,
+            service_name: Optional[str],
+            metric_name: Optional[str],
+            tags_filter: Optional[Dict[str, str]],
+            since: datetime,
+            until: datetime,
+            step_seconds: int
+    ) -> Optional[List[Dict]]:
+        async with session_maker("interactive", read_only=True)() as session:
+            if blocks_may_cover(since):
+                # Сырой хвост и блоки - из одного снимка, иначе сжатие между запросами
+                # посчитает точки дважды или потеряет их
+                await session.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+            return await query_rollup_history(
+                session, service_name, metric_name, tags_filter, since, until, step_seconds
+            )
+
+    async def downsample(
+            self,
+            service_name: Optional[str],
+            metric_name: Optional[str],
+            tags_filter: Optional[Dict[str, str]],
+            since: datetime,
+            until: datetime,
+            max_points: int,
+            method: str = DOWNSAMPLE_DEFAULT_METHOD
+    ) -> List[Dict]:
+        async with session_maker("interactive", read_only=True)() as session:
+            if blocks_may_cover(since):
+                await session.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+            return await downsample_history(
+                session, service_name, metric_name, tags_filter, since, until, max_points, method
+            )
+
+    async def unique_tags(
+            self,
+            service_name: Optional[str],
+            metric_name: Optional[str],
+            key_prefix: str = "",
+            value_prefix: str = "",
+            limit: Optional[int] = None
+    ) -> Dict[str, List[str]]:
+        # Ответ из инвертированного индекса тегов в памяти, без обращения к БД
+        if tag_index.ready:
+            return tag_index.unique_tags(service_name, metric_name, key_prefix, value_prefix, limit)
+
+        # Без индекса ответ из БД кэшируется до конца интервала RESULT_CACHE_TAGS_BUCKET_SECONDS
+        cache_key = None
+        if RESULT_CACHE_ENABLED:
+            cache_key = bucketed_key("unique-tags", service_name, metric_name, key_prefix, value_prefix, limit)
+            cached = await cache_get("unique_tags", cache_key)
+            if cached is not None:
+                return json.loads(cached)
+
+        # Каждый набор тегов хранится в series ровно один раз
+        async with session_maker("interactive", read_only=True)() as session:
+            result = await session.execute(series_filter(select(Series.tags), service_name, metric_name))
+            all_tags = result.scalars().all()
+
+        unique: Dict[str, set] = {}
+        for tag_dict in all_tags:
+            if not tag_dict:
+                continue
+            for key, value in tag_dict.items():
+                if key.startswith(key_prefix) and value.startswith(value_prefix):
+                    unique.setdefault(key, set()).add(value)
+
+        tags = {k: sorted(v)[:limit] for k, v in sorted(unique.items())}
+        if cache_key is not None:
+            await cache_set(cache_key, to_json(tags))
+        return tags
+
+    async def aggregate_series(self, since: datetime, percentile_mode: Optional[str] = None) -> List[Dict]:
+        # Собственная сессия пула exporter: скрейпы не держат соединения интерактивного пула
+        async with session_maker("exporter", read_only=True)() as session:
+            if (percentile_mode or PERCENTILE_MODE) == "sketch":
+                return await self._sketch_series_rows(session, since)
+            return await self._exact_series_rows(session, since)
+
+    async def _sketch_series_rows(self, session: AsyncSession, since: datetime) -> List[Dict]:
+        """
+        Агрегаты с перцентилями из DDSketch: GROUP BY по series_id и корзинам
+        вместо сортировки значений; описания серий - из series_registry.
+        """
+        if FASTPATH_ENABLED:
+            async with raw_connection("exporter", read_only=True) as conn:
+                rows = await SKETCH_ROWS_QUERY.fetch(conn, since=since)
+        else:
+            rows = (await session.execute(_sketch_rows_statement(since))).fetchall()
+        folded = fold_sketch_rows(rows, lambda r: r.series_id)
+        series = await series_registry.load(session, folded.keys())
+
+        rows = []
+        for series_id, acc in folded.items():
+            info = series.get(series_id)
+            if info is None:
+                continue
+            rows.append({
+                'service_name': info.service_name,
+                'metric_name': info.metric_name,
+                'tags': info.tags or {},
+                'avg_value': acc['avg_value'],
+                'max_value': acc['max_value'],
+                'min_value': acc['min_value'],
+                'count': acc['count'],
+                'p50': acc['p50'],
+                'p95': acc['p95'],
+                'p99': acc['p99'],
+            })
+        return rows
+
+    async def _exact_series_rows(self, session: AsyncSession, since: datetime) -> List[Dict]:
+        """Агрегаты с точными перцентилями percentile_cont (сортировка всех значений группы)."""
+        # GROUP BY по первичному ключу series: остальные колонки series от него зависят
+        query = select(
+            Series.service_name,
+            Series.metric_name,
+            Series.tags,
+            func.avg(Metric.value).label('avg_value'),
+            func.max(Metric.value).label('max_value'),
+            func.min(Metric.value).label('min_value'),
+            func.count(Metric.value).label('count'),
+            func.percentile_cont(0.5).within_group(Metric.value).label('p50'),
+            func.percentile_cont(0.95).within_group(Metric.value).label('p95'),
+            func.percentile_cont(0.99).within_group(Metric.value).label('p99')
+        ).select_from(Metric).join(
+            Series, Series.id == Metric.series_id
+        ).where(
+            Metric.timestamp >= since
+        ).group_by(
+            Series.id
+        )
+
+        result = await session.execute(query)
+
+        return [
+            {
+                'service_name': row.service_name,
+                'metric_name': row.metric_name,
+                'tags': row.tags or {},
+                'avg_value': float(row.avg_value) if row.avg_value else 0,
+                'max_value': float(row.max_value) if row.max_value else 0,
+                'min_value': float(row.min_value) if row.min_value else 0,
+                'count': row.count,
+                'p50': float(row.p50) if row.p50 else None,
+                'p95': float(row.p95) if row.p95 else None,
+                'p99': float(row.p99) if row.p99 else None,
+            }
+            for row in result.fetchall()
+        ]
@@ -0,0 +1,150 @@
+"""
+Неизменяемые файлы сегментов встроенного хранилища: точки всех серий за
+один диапазон времени, сжатые так же, как блоки в Postgres (app.utils.gorilla).
+
+Раскладка файла:
+    заголовок   magic, start_us, end_us, max_id
+    данные      по серии подряд: ts_data, id_data, value_data
+    индекс      запись на серию: series_id, min_ts, max_ts, count, смещение, длины потоков
+    концовка    смещение индекса, число записей, CRC32 индекса, magic
+
+Файл открывается через mmap: индекс читается при открытии, потоки серии -
+срезом отображения только при запросе к ней; страницы держит кэш ОС.
+"""
+import mmap
+import os
+import struct
+import zlib
+from bisect import bisect_left
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from app.utils.gorilla import decode_floats, decode_ints, encode_floats, encode_ints
+
+SEGMENT_MAGIC = b"MKSEG001"
+SEGMENT_SUFFIX = ".seg"
+
+_HEADER = struct.Struct("<8sqqq")
+# series_id, min_ts, max_ts, count, offset, ts_len, id_len, value_len
+_ENTRY = struct.Struct("<qqqIQIII")
+_FOOTER = struct.Struct("<QII8s")
+
+# Колонки серии: timestamp в микросекундах, id точек, значения
+SeriesColumns = Tuple[Sequence[int], Sequence[int], Sequence[float]]
+
+
+def segment_name(start_us: int, end_us: int) -> str:
+    # Имя с ведущими нулями: лексикографический порядок совпадает с порядком по времени
+    return f"seg-{start_us:020d}-{end_us:020d}{SEGMENT_SUFFIX}"
+
+
+def _fsync_directory(directory: str):
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def write_segment(path: str, start_us: int, end_us: int, columns: Dict[int, SeriesColumns]) -> int:
+    """
+    Пишет сегмент атомарно: временный файл, fsync, rename. Колонки каждой
+    серии упорядочены по (timestamp, id). Возвращает размер файла.
+    """
+    tmp_path = path + ".tmp"
+    max_id = max((ids[-1] for _, ids, _ in columns.values()), default=0)
+    index = bytearray()
+
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(SEGMENT_MAGIC, start_us, end_us, max_id))
+        offset = _HEADER.size
+        for series_id in sorted(columns):
+            ts, ids, values = columns[series_id]
+            ts_data = encode_ints(ts)
+            id_data = encode_ints(ids)
+            value_data = encode_floats(values)
+            f.write(ts_data)
+            f.write(id_data)
+            f.write(value_data)
+            index += _ENTRY.pack(
+                series_id, ts[0], ts[-1], len(ts), offset, len(ts_data), len(id_data), len(value_data)
+            )
+            offset += len(ts_data) + len(id_data) + len(value_data)
+
+        f.write(index)
+        f.write(_FOOTER.pack(offset, len(columns), zlib.crc32(index), SEGMENT_MAGIC))
+        f.flush()
+        os.fsync(f.fileno())
+        size = f.tell()
+
+    os.replace(tmp_path, path)
+    _fsync_directory(os.path.dirname(path) or ".")
+    return size
+
+
+class Segment:
+    """Открытый через mmap сегмент; ValueError - файл повреждён или не сегмент."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError(f"{path}: empty segment file")
+
+        try:
+            self._load_index()
+        except (ValueError, struct.error):
+            self.close()
+            raise
+
+    def _load_index(self):
+        buf = self._map
+        if len(buf) < _HEADER.size + _FOOTER.size:
+            raise ValueError(f"{self.path}: truncated segment")
+        magic, self.start_us, self.end_us, self.max_id = _HEADER.unpack_from(buf, 0)
+        index_offset, entries, crc, footer_magic = _FOOTER.unpack_from(buf, len(buf) - _FOOTER.size)
+        index_end = index_offset + entries * _ENTRY.size
+        if magic != SEGMENT_MAGIC or footer_magic != SEGMENT_MAGIC or index_end != len(buf) - _FOOTER.size:
+            raise ValueError(f"{self.path}: bad segment header or footer")
+        index = buf[index_offset:index_end]
+        if zlib.crc32(index) != crc:
+            raise ValueError(f"{self.path}: segment index checksum mismatch")
+
+        self.index: Dict[int, Tuple[int, ...]] = {entry[0]: entry[1:] for entry in _ENTRY.iter_unpack(index)}
+        self.max_ts = max((entry[1] for entry in self.index.values()), default=self.start_us)
+        self.samples = sum(entry[2] for entry in self.index.values())
+        self.size = len(buf)
+
+    def columns(
+            self,
+            series_id: int,
+            since_us: int,
+            until_us: Optional[int] = None,
+            with_ids: bool = True
+    ) -> Tuple[List[int], Optional[List[int]], List[float]]:
+        """Колонки серии в [since_us, until_us); id декодируются только при with_ids."""
+        entry = self.index.get(series_id)
+        if entry is None or entry[1] < since_us or (until_us is not None and entry[0] >= until_us):
+            return [], [] if with_ids else None, []
+
+        min_ts, max_ts, count, offset, ts_len, id_len, value_len = entry
+        buf = self._map
+        ts = decode_ints(buf[offset:offset + ts_len], count)
+        offset += ts_len
+        ids = decode_ints(buf[offset:offset + id_len], count) if with_ids else None
+        offset += id_len
+        values = decode_floats(buf[offset:offset + value_len], count)
+
+        if min_ts < since_us or (until_us is not None and max_ts >= until_us):
+            lo = bisect_left(ts, since_us)
+            hi = bisect_left(ts, until_us) if until_us is not None else count
+            ts, values = ts[lo:hi], values[lo:hi]
+            if ids is not None:
+                ids = ids[lo:hi]
+        return ts, ids, values
+
+    def close(self):
+        self._map.close()
+        self._file.close()
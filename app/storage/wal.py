@@ -0,0 +1,151 @@
+import logging
+import os
+import struct
+import threading
+import zlib
+from typing import Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Заголовок кадра: длина полезной нагрузки и её CRC32
+_FRAME = struct.Struct("<II")
+
+_WAL_PREFIX = "wal-"
+_WAL_SUFFIX = ".log"
+
+
+def read_records(path: str, repair: bool = False) -> Iterator[bytes]:
+    """
+    Записи файла по порядку. Чтение останавливается на первом оборванном или
+    повреждённом кадре (падение посреди записи); repair=True обрезает файл
+    по последней целой записи, чтобы дописывать можно было сразу за ней.
+    """
+    valid_end = 0
+    with open(path, "rb") as f:
+        while True:
+            header = f.read(_FRAME.size)
+            if len(header) < _FRAME.size:
+                break
+            length, crc = _FRAME.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                break
+            valid_end += _FRAME.size + length
+            yield payload
+        size = f.seek(0, os.SEEK_END)
+
+    if valid_end < size:
+        logger.warning(f"⚠️ {path}: dropping {size - valid_end} bytes of a torn record")
+        if repair:
+            os.truncate(path, valid_end)
+
+
+class RecordLog:
+    """
+    Файл записей, который только дописывается: кадр = длина + CRC32 + данные.
+    flush() отдаёт буфер ОС, sync() - ещё и fsync (переживает падение машины).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+        self._lock = threading.Lock()
+
+    def open(self):
+        self._file = open(self.path, "ab")
+
+    def append(self, *parts: bytes):
+        length, crc = 0, 0
+        for part in parts:
+            length += len(part)
+            crc = zlib.crc32(part, crc)
+        self._file.write(_FRAME.pack(length, crc))
+        for part in parts:
+            self._file.write(part)
+
+    def flush(self):
+        self._file.flush()
+
+    def sync(self):
+        # Вызывается и из потока (to_thread): close() в это время ждёт на блокировке
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._file.close()
+                self._file = None
+
+
+class WriteAheadLog:
+    """
+    Журнал из пронумерованных файлов wal-00000001.log в каталоге.
+
+    Пишется всегда последний файл; rotate() начинает следующий. Файлы,
+    все записи которых уже есть в сегментах, удаляет владелец (remove).
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.seq = 0
+        self._current: Optional[RecordLog] = None
+
+    def _path(self, seq: int) -> str:
+        return os.path.join(self.directory, f"{_WAL_PREFIX}{seq:08d}{_WAL_SUFFIX}")
+
+    def sequences(self) -> List[int]:
+        seqs = []
+        for name in os.listdir(self.directory):
+            if name.startswith(_WAL_PREFIX) and name.endswith(_WAL_SUFFIX):
+                seqs.append(int(name[len(_WAL_PREFIX):-len(_WAL_SUFFIX)]))
+        return sorted(seqs)
+
+    def replay(self) -> Iterator[Tuple[int, bytes]]:
+        """(номер файла, запись) всех файлов по порядку; оборванный хвост отбрасывается."""
+        for seq in self.sequences():
+            for payload in read_records(self._path(seq), repair=True):
+                yield seq, payload
+
+    def open(self):
+        """Начинает новый файл после уже существующих (после replay)."""
+        seqs = self.sequences()
+        self.seq = (seqs[-1] if seqs else 0) + 1
+        self._current = RecordLog(self._path(self.seq))
+        self._current.open()
+
+    def append(self, *parts: bytes):
+        self._current.append(*parts)
+
+    def flush(self):
+        self._current.flush()
+
+    def sync(self):
+        self._current.sync()
+
+    def rotate(self) -> int:
+        """Закрывает текущий файл (с fsync) и начинает следующий; возвращает его номер."""
+        previous = self._current
+        self.seq += 1
+        self._current = RecordLog(self._path(self.seq))
+        self._current.open()
+        previous.close()
+        return self.seq
+
+    def remove(self, seqs: List[int]):
+        for seq in seqs:
+            if seq == self.seq:
+                continue
+            try:
+                os.remove(self._path(seq))
+            except FileNotFoundError:
+                pass
+
+    def close(self):
+        if self._current is not None:
+            self._current.close()
+            self._current = None
@@ -1,110 +1,254 @@
-from sqlalchemy import select, func, ColumnElement
+from sqlalchemy import select, func, case, cast, bindparam, Integer, ColumnElement
 from sqlalchemy.exc import ProgrammingError
-from app.core.db import async_session_maker
+from app.core.db import session_maker
+from app.core.fastpath import FASTPATH_ENABLED, PreparedQuery, raw_connection, series_ids_param
+from app.core.series import restrict_to_series, indexed_series_ids
 from app.models.metric import Metric
-from datetime import datetime, timedelta
-from typing import List, Dict, Optional, Any
+from app.models.series import Series
+from app.utils.sketches import DDSketch, DEFAULT_RELATIVE_ACCURACY, MIN_INDEXABLE_VALUE
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Callable, Hashable, Iterable, List, Dict, Optional, Any, Tuple
 import logging
+import math
+import os
 
 logger = logging.getLogger(__name__)
 
 
+class _FoldedRow:
+    """Строка-результат fold_sketch_rows с атрибутным доступом, как у Row."""
+
+    def __init__(self, acc: Dict):
+        self._acc = acc
+
+    def __getattr__(self, name):
+        if name in self._acc:
+            return self._acc[name]
+        return getattr(self._acc["row"], name)
+
+# Способ расчёта перцентилей:
+# - sketch: GROUP BY по корзинам DDSketch в SQL (hash aggregate, без сортировки),
+#   перцентили с относительной ошибкой SKETCH_RELATIVE_ACCURACY
+# - exact: percentile_cont ... WITHIN GROUP (сортирует все значения группы)
+PERCENTILE_MODE = os.getenv("PERCENTILE_MODE", "sketch").lower()
+
+# Сколько форм запроса агрегатов (теги группировки x режим x фильтр) держим скомпилированными
+AGGREGATE_QUERY_CACHE_SIZE = int(os.getenv("AGGREGATE_QUERY_CACHE_SIZE", "256"))
+
+
+def sketch_bucket_columns(
+        value_column,
+        relative_accuracy: float = DEFAULT_RELATIVE_ACCURACY
+) -> Tuple[ColumnElement, ColumnElement]:
+    """
+    SQL-выражения (знак, ключ корзины DDSketch) для колонки значений.
+    Совпадают с DDSketch.key_for, поэтому корзины можно собрать в скетч в Python.
+    """
+    gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+    abs_value = func.abs(value_column)
+    sign_expr = case(
+        (value_column > MIN_INDEXABLE_VALUE, 1),
+        (value_column < -MIN_INDEXABLE_VALUE, -1),
+        else_=0
+    )
+    key_expr = case(
+        (abs_value > MIN_INDEXABLE_VALUE, cast(func.ceil(func.ln(abs_value) / math.log(gamma)), Integer)),
+        else_=0
+    )
+    return sign_expr, key_expr
+
+
+def sketch_aggregate_columns(value_column) -> List[ColumnElement]:
+    """Частичные агрегаты на корзину; сворачиваются fold_sketch_rows."""
+    return [
+        func.count(value_column).label("count"),
+        func.sum(value_column).label("total"),
+        func.min(value_column).label("min_value"),
+        func.max(value_column).label("max_value"),
+    ]
+
+
+def fold_sketch_rows(
+        rows: Iterable[Any],
+        group_key: Callable[[Any], Hashable],
+        relative_accuracy: float = DEFAULT_RELATIVE_ACCURACY
+) -> Dict[Hashable, Dict]:
+    """
+    Сворачивает строки (группа, sk_sign, sk_key, count, total, min, max)
+    в агрегаты по группам с перцентилями из DDSketch.
+    """
+    folded: Dict[Hashable, Dict] = {}
+    for row in rows:
+        key = group_key(row)
+        acc = folded.get(key)
+        if acc is None:
+            acc = folded[key] = {
+                "row": row,
+                "count": 0,
+                "total": 0.0,
+                "min_value": math.inf,
+                "max_value": -math.inf,
+                "sketch": DDSketch(relative_accuracy),
+            }
+        acc["count"] += row.count
+        acc["total"] += float(row.total)
+        acc["min_value"] = min(acc["min_value"], float(row.min_value))
+        acc["max_value"] = max(acc["max_value"], float(row.max_value))
+        acc["sketch"].add_bucket(row.sk_sign, row.sk_key, row.count)
+
+    for acc in folded.values():
+        sketch = acc.pop("sketch")
+        acc["avg_value"] = acc["total"] / acc["count"] if acc["count"] else 0.0
+        acc["p50"], acc["p95"], acc["p99"] = sketch.quantiles((0.5, 0.95, 0.99))
+
+    return folded
+
+
+def _aggregate_statement(group_by_tags: Tuple[str, ...], use_sketch: bool, since):
+    """
+    GROUP BY по (service, metric[, корзина скетча], теги группировки).
+    Корректно обрабатывает GROUP BY для JSONB-тегов.
+    """
+    # Базовые колонки (всегда присутствуют)
+    base_columns = [
+        Series.service_name.label("service_name"),
+        Series.metric_name.label("metric_name"),
+    ]
+
+    # Базовая группировка (по колонкам небольшой таблицы series)
+    group_by_cols = [Series.service_name, Series.metric_name]
+
+    if use_sketch:
+        # Группируем дополнительно по корзине скетча: строк на группу - O(корзин)
+        sign_expr, key_expr = sketch_bucket_columns(Metric.value)
+        base_columns += [sign_expr.label("sk_sign"), key_expr.label("sk_key")]
+        base_columns += sketch_aggregate_columns(Metric.value)
+        group_by_cols += [sign_expr, key_expr]
+    else:
+        base_columns += [
+            func.avg(Metric.value).label("avg_value"),
+            func.min(Metric.value).label("min_value"),
+            func.max(Metric.value).label("max_value"),
+            func.count(Metric.value).label("count"),
+            func.percentile_cont(0.5).within_group(Metric.value.asc()).label("p50"),
+            func.percentile_cont(0.95).within_group(Metric.value.asc()).label("p95"),
+            func.percentile_cont(0.99).within_group(Metric.value.asc()).label("p99")
+        ]
+
+    # Колонки для SELECT и GROUP BY (будут добавлены теги если нужно)
+    select_columns = list(base_columns)
+
+    # Обработка тегов для группировки
+    for tag_key in group_by_tags:
+        # Создаём выражение извлечения тега ОДИН РАЗ
+        tag_expr = Series.tags[tag_key].astext
+
+        # Добавляем в SELECT с лейблом и то же выражение - в GROUP BY
+        select_columns.append(tag_expr.label(f"tag_{tag_key}"))
+        group_by_cols.append(tag_expr)
+
+    return select(*select_columns).select_from(Metric).join(
+        Series, Series.id == Metric.series_id
+    ).where(
+        Metric.timestamp >= since
+    ).group_by(*group_by_cols).order_by(
+        Series.service_name,
+        Series.metric_name
+    )
+
+
+@lru_cache(maxsize=AGGREGATE_QUERY_CACHE_SIZE)
+def _prepared_aggregate(group_by_tags: Tuple[str, ...], use_sketch: bool, restricted: bool) -> PreparedQuery:
+    """Запрос агрегатов одной формы, скомпилированный один раз для asyncpg."""
+    query = _aggregate_statement(group_by_tags, use_sketch, bindparam("since", type_=Metric.timestamp.type))
+    if restricted:
+        query = query.where(Metric.series_id == series_ids_param())
+    return PreparedQuery(query)
+
+
+async def _aggregate_rows(
+        since: datetime,
+        group_by_tags: Tuple[str, ...],
+        filter_tags: Optional[Dict[str, str]],
+        use_sketch: bool
+) -> List[Any]:
+    if FASTPATH_ENABLED:
+        # Фильтр тегов - набором серий из индекса; без индекса - через ORM ниже
+        series_ids = await indexed_series_ids(tags_filter=filter_tags) if filter_tags else None
+        if not filter_tags or series_ids is not None:
+            prepared = _prepared_aggregate(group_by_tags, use_sketch, series_ids is not None)
+            async with raw_connection("background", read_only=True) as conn:
+                return await prepared.fetch(conn, since=since, series_ids=sorted(series_ids or ()))
+
+    async with session_maker("background", read_only=True)() as session:
+        query = _aggregate_statement(group_by_tags, use_sketch, since)
+        # Фильтрация по тегам: набор серий из индекса тегов (или по series)
+        query = await restrict_to_series(
+            session, query, Metric.series_id, tags_filter=filter_tags, joined=True
+        )
+        result = await session.execute(query)
+        return result.fetchall()
+
+
 async def aggregate_last_window(
         window_seconds: int = 30,
         group_by_tags: Optional[List[str]] = None,
-        filter_tags: Optional[Dict[str, str]] = None
+        filter_tags: Optional[Dict[str, str]] = None,
+        percentile_mode: str = PERCENTILE_MODE
 ) -> List[Dict]:
     """
     Агрегирует метрики за последние N секунд.
-    Корректно обрабатывает GROUP BY для JSONB-тегов.
+
+    percentile_mode: "sketch" (по умолчанию) или "exact" - см. PERCENTILE_MODE.
+    С DB_FASTPATH_ENABLED запрос каждой формы компилируется один раз и
+    выполняется на сыром asyncpg-соединении.
     """
-    try:
-        async with async_session_maker() as session:
-            since = datetime.utcnow() - timedelta(seconds=window_seconds)
-
-            # Базовые колонки (всегда присутствуют)
-            base_columns = [
-                Metric.service_name.label("service_name"),
-                Metric.metric_name.label("metric_name"),
-                func.avg(Metric.value).label("avg_value"),
-                func.min(Metric.value).label("min_value"),
-                func.max(Metric.value).label("max_value"),
-                func.count(Metric.value).label("count"),
-                func.percentile_cont(0.5).within_group(Metric.value.asc()).label("p50"),
-                func.percentile_cont(0.95).within_group(Metric.value.asc()).label("p95"),
-                func.percentile_cont(0.99).within_group(Metric.value.asc()).label("p99")
-            ]
+    use_sketch = percentile_mode == "sketch"
 
-            # Базовая группировка
-            group_by_cols = [Metric.service_name, Metric.metric_name]
+    try:
+        since = datetime.now(timezone.utc) - timedelta(seconds=window_seconds)
+        rows = await _aggregate_rows(since, tuple(group_by_tags or ()), filter_tags, use_sketch)
 
-            # Колонки для SELECT и GROUP BY (будут добавлены теги если нужно)
-            select_columns = list(base_columns)
+        if use_sketch:
+            tag_labels = [f"tag_{tag_key}" for tag_key in (group_by_tags or [])]
+            folded = fold_sketch_rows(
+                rows,
+                lambda r: (r.service_name, r.metric_name, *(getattr(r, label) for label in tag_labels))
+            )
+            rows = [
+                _FoldedRow(acc)
+                for acc in folded.values()
+            ]
 
-            # Обработка тегов для группировки
-            tag_expressions: Dict[str, ColumnElement] = {}
+        # Формируем результат
+        aggregates = []
+        for row in rows:
+            agg = {
+                "service_name": row.service_name,
+                "metric_name": row.metric_name,
+                "avg_value": float(row.avg_value) if row.avg_value else 0.0,
+                "min_value": float(row.min_value) if row.min_value else 0.0,
+                "max_value": float(row.max_value) if row.max_value else 0.0,
+                "p50": float(row.p50) if row.p50 is not None else None,
+                "p95": float(row.p95) if row.p95 is not None else None,
+                "p99": float(row.p99) if row.p99 is not None else None,
+                "count": row.count,
+                "window_seconds": window_seconds,
+                "tags": {}
+            }
 
+            # Извлекаем значения тегов из результата
             if group_by_tags:
                 for tag_key in group_by_tags:
-                    # Создаём выражение извлечения тега ОДИН РАЗ
-                    tag_expr = Metric.tags[tag_key].astext
                     tag_label = f"tag_{tag_key}"
+                    tag_value = getattr(row, tag_label, None)
+                    if tag_value is not None:
+                        agg["tags"][tag_key] = tag_value
 
-                    # Добавляем в SELECT с лейблом
-                    select_columns.append(tag_expr.label(tag_label))
-
-                    # Сохраняем выражение для GROUP BY
-                    tag_expressions[tag_key] = tag_expr
-
-                    # Добавляем то же выражение в GROUP BY
-                    group_by_cols.append(tag_expr)
-
-            # Строим базовый запрос
-            query = select(*select_columns).where(Metric.timestamp >= since)
-
-            # Применяем фильтрацию по тегам
-            if filter_tags:
-                for key, value in filter_tags.items():
-                    query = query.where(Metric.tags[key].astext == value)
-
-            # Добавляем GROUP BY
-            query = query.group_by(*group_by_cols).order_by(
-                Metric.service_name,
-                Metric.metric_name
-            )
+            aggregates.append(agg)
 
-            # Выполняем запрос
-            result = await session.execute(query)
-            rows = result.fetchall()
-
-            # Формируем результат
-            aggregates = []
-            for row in rows:
-                agg = {
-                    "service_name": row.service_name,
-                    "metric_name": row.metric_name,
-                    "avg_value": float(row.avg_value) if row.avg_value else 0.0,
-                    "min_value": float(row.min_value) if row.min_value else 0.0,
-                    "max_value": float(row.max_value) if row.max_value else 0.0,
-                    "p50": float(row.p50) if row.p50 else None,
-                    "p95": float(row.p95) if row.p95 else None,
-                    "p99": float(row.p99) if row.p99 else None,
-                    "count": row.count,
-                    "window_seconds": window_seconds,
-                    "tags": {}
-                }
-
-                # Извлекаем значения тегов из результата
-                if group_by_tags:
-                    for tag_key in group_by_tags:
-                        tag_label = f"tag_{tag_key}"
-                        tag_value = getattr(row, tag_label, None)
-                        if tag_value is not None:
-                            agg["tags"][tag_key] = tag_value
-
-                aggregates.append(agg)
-
-            return aggregates
+        return aggregates
 
     except ProgrammingError as e:
         error_str = str(e).lower()
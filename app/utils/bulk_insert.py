@@ -0,0 +1,73 @@
+import logging
+from typing import List, Sequence
+
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.series import series_registry
+from app.models.metric import Metric
+from app.schemas.metric import MetricCreate
+
+logger = logging.getLogger(__name__)
+
+# Колонки, которые пишем через COPY; id и timestamp заполняются дефолтами таблицы
+COPY_COLUMNS = ["series_id", "value"]
+
+# 2 параметра на строку -> 10000 строк укладываются в лимит параметров Postgres
+INSERT_CHUNK_SIZE = 10000
+
+
+async def copy_metrics(session: AsyncSession, metrics: Sequence[MetricCreate]) -> int:
+    """
+    Массовая вставка метрик через COPY (asyncpg copy_records_to_table).
+    Один round trip на весь батч вместо add + commit + refresh на каждую точку.
+
+    Серии резолвятся через in-process кэш series_registry; в таблицу
+    пишутся только (series_id, value).
+
+    Транзакцией управляет вызывающий код (commit делает зависимость сессии).
+    Возвращает количество записанных строк.
+    """
+    if not metrics:
+        return 0
+
+    series_ids = await series_registry.resolve_many(metrics)
+
+    conn = await session.connection()
+    raw_conn = await conn.get_raw_connection()
+    driver_conn = raw_conn.driver_connection
+
+    if hasattr(driver_conn, "copy_records_to_table"):
+        await driver_conn.copy_records_to_table(
+            Metric.__tablename__,
+            records=[(series_id, m.value) for series_id, m in zip(series_ids, metrics)],
+            columns=COPY_COLUMNS,
+        )
+    else:
+        # Не asyncpg (например, в тестах на другом драйвере) - многострочный INSERT ... VALUES
+        logger.debug("COPY is not available for this driver, falling back to INSERT ... VALUES")
+        await insert_metrics(session, metrics, series_ids)
+
+    return len(metrics)
+
+
+async def insert_metrics(
+        session: AsyncSession,
+        metrics: Sequence[MetricCreate],
+        series_ids: Sequence[int] = None
+) -> int:
+    """Многострочный INSERT ... VALUES без чтения вставленных строк обратно."""
+    if not metrics:
+        return 0
+
+    if series_ids is None:
+        series_ids = await series_registry.resolve_many(metrics)
+
+    rows: List[dict] = [
+        {"series_id": series_id, "value": m.value}
+        for series_id, m in zip(series_ids, metrics)
+    ]
+    # Postgres ограничивает число параметров в запросе (32767) - режем на чанки
+    for start in range(0, len(rows), INSERT_CHUNK_SIZE):
+        await session.execute(insert(Metric).values(rows[start:start + INSERT_CHUNK_SIZE]))
+    return len(rows)
@@ -0,0 +1,228 @@
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import select, func, Float
+from sqlalchemy.dialects.postgresql import array
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.blocks import Sample, from_micros, load_block_samples, to_micros
+from app.core.series import SeriesInfo, restrict_to_series, series_registry
+from app.models.metric import Metric
+
+# Метод прореживания по умолчанию для max_points в /history: lttb, minmax или avg
+DOWNSAMPLE_DEFAULT_METHOD = os.getenv("DOWNSAMPLE_DEFAULT_METHOD", "lttb")
+# LTTB выбирает точки из min/max-кандидатов: бакетов = max_points * ratio / 2
+LTTB_CANDIDATE_RATIO = int(os.getenv("LTTB_CANDIDATE_RATIO", "4"))
+
+_MIN_STEP = timedelta(milliseconds=1)
+
+# Частичный агрегат бакета: [сумма, число точек, (min, epoch), (max, epoch)]
+BucketKey = Tuple[int, datetime]
+
+
+def lttb(xs: Sequence[float], ys: Sequence[float], threshold: int) -> List[int]:
+    """
+    Largest-Triangle-Three-Buckets: индексы threshold точек, лучше всего
+    сохраняющих форму ряда. Первая и последняя точки сохраняются всегда.
+    """
+    n = len(xs)
+    if threshold >= n:
+        return list(range(n))
+    if threshold <= 2:
+        return [0, n - 1][:max(threshold, 0)]
+
+    every = (n - 2) / (threshold - 2)
+    selected = [0]
+    a = 0
+    for i in range(threshold - 2):
+        # Среднее следующего бакета - третья вершина треугольника
+        avg_start = int((i + 1) * every) + 1
+        avg_end = min(int((i + 2) * every) + 1, n)
+        avg_len = avg_end - avg_start
+        avg_x = sum(xs[avg_start:avg_end]) / avg_len
+        avg_y = sum(ys[avg_start:avg_end]) / avg_len
+
+        ax, ay = xs[a], ys[a]
+        best_area = -1.0
+        best = range_start = int(i * every) + 1
+        for j in range(range_start, int((i + 1) * every) + 1):
+            area = abs((ax - avg_x) * (ys[j] - ay) - (ax - xs[j]) * (avg_y - ay))
+            if area > best_area:
+                best_area = area
+                best = j
+        selected.append(best)
+        a = best
+
+    selected.append(n - 1)
+    return selected
+
+
+def bucket_step(since: datetime, until: datetime, buckets: int) -> timedelta:
+    return max((until - since) / max(buckets, 1), _MIN_STEP)
+
+
+async def _bucket_rows(session: AsyncSession, since: datetime, until: datetime, step: timedelta,
+                       service_name: str, metric_name: str, tags_filter: Optional[Dict[str, str]], extremes: bool):
+    """
+    Один проход date_bin по сырым точкам: агрегат на (серию, бакет).
+    extremes=True - ещё и точки минимума/максимума вместе со временем:
+    min/max по массиву [value, epoch] - обычный hash aggregate без сортировки.
+    """
+    bucket_expr = func.date_bin(step, Metric.timestamp, since)
+    columns = [
+        Metric.series_id,
+        bucket_expr.label("bucket"),
+        func.avg(Metric.value).label("avg_value"),
+        func.count().label("count"),
+    ]
+    if extremes:
+        pair = array([Metric.value, func.extract("epoch", Metric.timestamp).cast(Float)])
+        columns += [func.min(pair).label("min_pair"), func.max(pair).label("max_pair")]
+
+    query = select(*columns).where(
+        Metric.timestamp >= since,
+        Metric.timestamp < until
+    )
+    query = await restrict_to_series(session, query, Metric.series_id, service_name, metric_name, tags_filter)
+    query = query.group_by(Metric.series_id, bucket_expr).order_by(Metric.series_id, bucket_expr)
+    return await session.execute(query)
+
+
+def _extreme_points(min_pair: Sequence[float], max_pair: Sequence[float]) -> List[tuple]:
+    """(epoch, value) минимума и максимума бакета в порядке времени, без дублей."""
+    points = {(min_pair[1], min_pair[0]), (max_pair[1], max_pair[0])}
+    return sorted(points)
+
+
+def _add_samples(partials: Dict[BucketKey, list], samples: Dict[int, List[Sample]],
+                 since: datetime, step: timedelta):
+    """
+    Досчитывает бакеты по точкам, декодированным в Python (сжатые блоки,
+    встроенное хранилище) - те же границы, что у date_bin(step, timestamp, since);
+    бакет на стыке блоков и сырых точек сливается.
+    """
+    since_us = to_micros(since)
+    step_us = step // timedelta(microseconds=1)
+    for series_id, points in samples.items():
+        for ts_us, _, value in points:
+            key = (series_id, from_micros(since_us + (ts_us - since_us) // step_us * step_us))
+            pair = (value, ts_us / 1_000_000)
+            partial = partials.get(key)
+            if partial is None:
+                partials[key] = [value, 1, pair, pair]
+                continue
+            partial[0] += value
+            partial[1] += 1
+            if partial[2] is not None:
+                partial[2] = min(partial[2], pair)
+                partial[3] = max(partial[3], pair)
+
+
+def _bucket_count(max_points: int, method: str) -> int:
+    if method == "avg":
+        return max_points
+    if method == "minmax":
+        return max(max_points // 2, 1)
+    return max(max_points * LTTB_CANDIDATE_RATIO // 2, 1)
+
+
+def _series_points(partials: Dict[BucketKey, list], max_points: int, method: str) -> Dict[int, List[tuple]]:
+    """Точки (epoch, value) каждой серии из частичных агрегатов бакетов."""
+    per_series: Dict[int, List[tuple]] = {}
+    for (series_id, bucket), (total, count, min_pair, max_pair) in sorted(partials.items()):
+        points = per_series.setdefault(series_id, [])
+        if method == "avg":
+            points.append((bucket.timestamp(), total / count))
+        else:
+            points.extend(_extreme_points(min_pair, max_pair))
+
+    if method == "lttb":
+        for series_id, points in per_series.items():
+            xs = [p[0] for p in points]
+            ys = [p[1] for p in points]
+            per_series[series_id] = [points[i] for i in lttb(xs, ys, max_points)]
+    return per_series
+
+
+def _downsampled_rows(per_series: Dict[int, List[tuple]], infos: Dict[int, SeriesInfo]) -> List[Dict]:
+    downsampled = []
+    for series_id, points in per_series.items():
+        info = infos.get(series_id)
+        if info is None:
+            continue
+        for epoch, value in points:
+            downsampled.append({
+                "service_name": info.service_name,
+                "metric_name": info.metric_name,
+                "tags": info.tags,
+                "timestamp": datetime.fromtimestamp(epoch, timezone.utc),
+                "value": value,
+            })
+
+    downsampled.sort(key=lambda p: p["timestamp"])
+    return downsampled
+
+
+def downsample_samples(
+        samples: Dict[int, List[Sample]],
+        infos: Dict[int, SeriesInfo],
+        since: datetime,
+        until: datetime,
+        max_points: int,
+        method: str = DOWNSAMPLE_DEFAULT_METHOD
+) -> List[Dict]:
+    """То же прореживание, что у downsample_history, целиком в Python - по уже прочитанным точкам."""
+    step = bucket_step(since, until, _bucket_count(max_points, method))
+    partials: Dict[BucketKey, list] = {}
+    _add_samples(partials, samples, since, step)
+    return _downsampled_rows(_series_points(partials, max_points, method), infos)
+
+
+async def downsample_history(
+        session: AsyncSession,
+        service_name: str,
+        metric_name: str,
+        tags_filter: Optional[Dict[str, str]],
+        since: datetime,
+        until: datetime,
+        max_points: int,
+        method: str = DOWNSAMPLE_DEFAULT_METHOD
+) -> List[Dict]:
+    """
+    История, прореженная до max_points точек на серию.
+
+    Тяжёлая часть - в SQL (date_bin + агрегаты), в Python приходит не больше
+    O(max_points) строк на серию, поэтому размер ответа и время отрисовки
+    не зависят от плотности ряда:
+    - avg: среднее на бакет, max_points бакетов;
+    - minmax: точки минимума и максимума на бакет, max_points / 2 бакетов;
+    - lttb: LTTB поверх min/max-кандидатов (MinMaxLTTB).
+
+    Точки, уже перенесённые в сжатые блоки, декодируются и раскладываются
+    по тем же бакетам в Python; чтобы сжатие между двумя запросами не
+    задвоило точки, вызывающий код открывает сессию REPEATABLE READ.
+    """
+    step = bucket_step(since, until, _bucket_count(max_points, method))
+    extremes = method != "avg"
+    result = await _bucket_rows(
+        session, since, until, step, service_name, metric_name, tags_filter, extremes=extremes
+    )
+
+    partials: Dict[BucketKey, list] = {}
+    for row in result:
+        partials[(row.series_id, row.bucket)] = [
+            float(row.avg_value) * row.count,
+            row.count,
+            tuple(row.min_pair) if extremes else None,
+            tuple(row.max_pair) if extremes else None,
+        ]
+    # Холодная часть диапазона лежит в сжатых блоках - бакеты по ней считаются в Python
+    _add_samples(
+        partials, await load_block_samples(session, since, until, service_name, metric_name, tags_filter),
+        since, step
+    )
+
+    per_series = _series_points(partials, max_points, method)
+    infos = await series_registry.load(session, per_series.keys())
+    return _downsampled_rows(per_series, infos)
@@ -0,0 +1,49 @@
+import json
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+try:
+    import msgpack
+except ImportError:  # msgpack - опциональная зависимость
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:  # CBOR - опциональная зависимость
+    cbor2 = None
+
+# Кадр WebSocket: str - текстовый, bytes - бинарный
+Frame = Union[str, bytes]
+
+# Подпротоколы (Sec-WebSocket-Protocol) пакетного режима -> кодировка кадра
+SUBPROTOCOLS = {
+    "metrics.batch.json": "json",
+    "metrics.batch.msgpack": "msgpack",
+    "metrics.batch.cbor": "cbor",
+}
+
+
+def available_encodings() -> List[str]:
+    encodings = ["json"]
+    if msgpack is not None:
+        encodings.append("msgpack")
+    if cbor2 is not None:
+        encodings.append("cbor")
+    return encodings
+
+
+def choose_subprotocol(offered: Sequence[str]) -> Optional[str]:
+    """Первый из предложенных клиентом подпротоколов, который сервер поддерживает."""
+    encodings = available_encodings()
+    for subprotocol in offered:
+        if SUBPROTOCOLS.get(subprotocol) in encodings:
+            return subprotocol
+    return None
+
+
+def encode_frame(encoding: str, payload: Dict[str, Any]) -> Frame:
+    """Один кадр: json - текстовый, msgpack / cbor - бинарный."""
+    if encoding == "msgpack":
+        return msgpack.packb(payload, use_bin_type=True)
+    if encoding == "cbor":
+        return cbor2.dumps(payload)
+    return json.dumps(payload, separators=(",", ":"), ensure_ascii=False)
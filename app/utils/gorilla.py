@@ -0,0 +1,180 @@
+"""
+Сжатие рядов в стиле Gorilla (Pelkonen et al., VLDB 2015).
+
+- Целые (timestamp в микросекундах, id точек) - delta-of-delta: у ряда
+  с постоянным шагом почти каждая точка стоит 1 бит.
+- float - XOR с предыдущим значением: повтор стоит 1 бит, медленно
+  меняющиеся значения - только значащие биты XOR.
+
+Форматы - чистые битовые потоки без заголовка: длину ряда хранит вызывающий
+код (колонка sample_count блока).
+"""
+from array import array
+from typing import List, Sequence
+
+# Префиксы delta-of-delta: (код, длина кода, бит значения). Шаги - в микросекундах,
+# поэтому корзины шире, чем у секундных меток в оригинальной статье
+_DOD_BUCKETS = (
+    (0b10, 2, 7),
+    (0b110, 3, 14),
+    (0b1110, 4, 20),
+    (0b11110, 5, 32),
+)
+# delta-of-delta соседних int64 не шире 66 бит (с учётом zigzag) - без переполнения
+_DOD_ESCAPE = (0b11111, 5, 68)
+
+_U64 = (1 << 64) - 1
+
+# Декодер читает префикс сразу 5 битами: значение -> (длина префикса, бит значения)
+_PREFIX_TABLE = []
+for _prefix in range(32):
+    _ones = 0
+    while _ones < 5 and _prefix & (0b10000 >> _ones):
+        _ones += 1
+    _PREFIX_TABLE.append((min(_ones + 1, 5), ([b[2] for b in _DOD_BUCKETS] + [_DOD_ESCAPE[2]])[_ones - 1] if _ones else 0))
+
+_PAD = bytes(16)
+
+
+class BitWriter:
+    __slots__ = ("_buf", "_acc", "_bits")
+
+    def __init__(self):
+        self._buf = bytearray()
+        self._acc = 0
+        self._bits = 0
+
+    def write(self, value: int, nbits: int):
+        self._acc = (self._acc << nbits) | value
+        self._bits += nbits
+        if self._bits >= 64:
+            whole = self._bits >> 3
+            rest = self._bits - (whole << 3)
+            self._buf += (self._acc >> rest).to_bytes(whole, "big")
+            self._acc &= (1 << rest) - 1
+            self._bits = rest
+
+    def getvalue(self) -> bytes:
+        if self._bits:
+            pad = -self._bits % 8
+            return bytes(self._buf + (self._acc << pad).to_bytes((self._bits + pad) >> 3, "big"))
+        return bytes(self._buf)
+
+
+def _read(buf: bytes, pos: int, nbits: int) -> int:
+    """nbits бит с позиции pos (буфер дополнен нулями - чтение за концом безопасно)."""
+    end = pos + nbits
+    last = (end + 7) >> 3
+    return (int.from_bytes(buf[pos >> 3:last], "big") >> ((last << 3) - end)) & ((1 << nbits) - 1)
+
+
+def _zigzag(value: int) -> int:
+    return value << 1 if value >= 0 else ((-value) << 1) - 1
+
+
+def encode_ints(values: Sequence[int]) -> bytes:
+    """Первое значение - 64 бита, дальше delta-of-delta с префиксными корзинами."""
+    if not values:
+        return b""
+    writer = BitWriter()
+    writer.write(values[0] & _U64, 64)
+    prev, prev_delta = values[0], 0
+    for value in values[1:]:
+        delta = value - prev
+        dod = delta - prev_delta
+        prev, prev_delta = value, delta
+        if dod == 0:
+            writer.write(0, 1)
+            continue
+        encoded = _zigzag(dod)
+        for code, code_bits, value_bits in _DOD_BUCKETS:
+            if encoded < (1 << value_bits):
+                writer.write((code << value_bits) | encoded, code_bits + value_bits)
+                break
+        else:
+            code, code_bits, value_bits = _DOD_ESCAPE
+            writer.write(code, code_bits)
+            writer.write(encoded, value_bits)
+    return writer.getvalue()
+
+
+def decode_ints(data: bytes, count: int) -> List[int]:
+    if count == 0:
+        return []
+    buf = data + _PAD
+    first = int.from_bytes(buf[:8], "big")
+    if first >= 1 << 63:
+        first -= 1 << 64
+    values = [first]
+    prev, prev_delta = first, 0
+    pos = 64
+    for _ in range(count - 1):
+        used, width = _PREFIX_TABLE[_read(buf, pos, 5)]
+        pos += used
+        if width:
+            encoded = _read(buf, pos, width)
+            prev_delta += (encoded >> 1) ^ -(encoded & 1)
+            pos += width
+        prev += prev_delta
+        values.append(prev)
+    return values
+
+
+def encode_floats(values: Sequence[float]) -> bytes:
+    """
+    XOR с предыдущим значением: 0 - повтор; 10 - значащие биты в окне
+    предыдущего XOR; 11 - новое окно (5 бит ведущих нулей, 6 бит длины).
+    """
+    if not values:
+        return b""
+    bits = array("Q", array("d", values).tobytes())
+    writer = BitWriter()
+    writer.write(bits[0], 64)
+    prev = bits[0]
+    prev_lead, prev_trail = -1, 0
+    for current in bits[1:]:
+        xor = current ^ prev
+        prev = current
+        if xor == 0:
+            writer.write(0, 1)
+            continue
+        lead = min(64 - xor.bit_length(), 31)
+        trail = (xor & -xor).bit_length() - 1
+        if prev_lead >= 0 and lead >= prev_lead and trail >= prev_trail:
+            width = 64 - prev_lead - prev_trail
+            writer.write(0b10, 2)
+            writer.write(xor >> prev_trail, width)
+        else:
+            width = 64 - lead - trail
+            # Длина 64 не помещается в 6 бит - пишется как 0
+            writer.write((0b11 << 11) | (lead << 6) | (width & 63), 13)
+            writer.write(xor >> trail, width)
+            prev_lead, prev_trail = lead, trail
+    return writer.getvalue()
+
+
+def decode_floats(data: bytes, count: int) -> List[float]:
+    if count == 0:
+        return []
+    buf = data + _PAD
+    bits = array("Q", [int.from_bytes(buf[:8], "big")])
+    prev = bits[0]
+    lead, trail = 0, 0
+    pos = 64
+    for _ in range(count - 1):
+        # Управляющие биты и заголовок окна - одним чтением
+        head = _read(buf, pos, 13)
+        if head >> 12:
+            if head >> 11 == 0b11:
+                lead = (head >> 6) & 31
+                trail = 64 - lead - ((head & 63) or 64)
+                pos += 13
+            else:
+                pos += 2
+            width = 64 - lead - trail
+            prev ^= _read(buf, pos, width) << trail
+            pos += width
+        else:
+            pos += 1
+        bits.append(prev)
+    return array("d", bits.tobytes()).tolist()
@@ -0,0 +1,189 @@
+import csv
+import io
+import json
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Mapping, Optional, Sequence, Tuple
+
+from pydantic_core import to_json
+
+try:
+    import pyarrow as pa
+except ImportError:  # Arrow - опциональная зависимость
+    pa = None
+
+# Форматы выдачи истории и их Content-Type
+HISTORY_MEDIA_TYPES = {
+    "json": "application/json",
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+_ACCEPT_FORMATS = {
+    "application/json": "json",
+    "application/x-ndjson": "ndjson",
+    "application/ndjson": "ndjson",
+    "application/jsonl": "ndjson",
+    "text/csv": "csv",
+    "application/vnd.apache.arrow.stream": "arrow",
+}
+
+# Описание колонок: (имя, тип) - тип определяет кодирование в CSV и схему Arrow
+Columns = Sequence[Tuple[str, str]]
+
+RAW_COLUMNS: Columns = (
+    ("id", "int"),
+    ("service_name", "str"),
+    ("metric_name", "str"),
+    ("value", "float"),
+    ("tags", "tags"),
+    ("timestamp", "ts"),
+)
+
+ROLLUP_COLUMNS: Columns = (
+    ("timestamp", "ts"),
+    ("count", "int"),
+    ("sum", "float"),
+    ("avg_value", "float"),
+    ("min_value", "float"),
+    ("max_value", "float"),
+    ("p50", "float"),
+    ("p95", "float"),
+    ("p99", "float"),
+)
+
+DOWNSAMPLED_COLUMNS: Columns = (
+    ("service_name", "str"),
+    ("metric_name", "str"),
+    ("tags", "tags"),
+    ("timestamp", "ts"),
+    ("value", "float"),
+)
+
+RowBatches = AsyncIterator[Sequence[Mapping[str, Any]]]
+
+
+def negotiate_format(format_param: Optional[str], accept: Optional[str]) -> str:
+    """
+    Формат ответа: явный ?format= важнее заголовка Accept.
+    Из Accept берётся известный тип с наибольшим q; по умолчанию - json.
+    """
+    if format_param:
+        return format_param
+
+    candidates = []
+    for position, part in enumerate((accept or "").split(",")):
+        media_type, *params = [p.strip() for p in part.split(";")]
+        fmt = _ACCEPT_FORMATS.get(media_type.lower())
+        if fmt is None:
+            continue
+        q = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    pass
+        candidates.append((-q, position, fmt))
+
+    return min(candidates)[2] if candidates else "json"
+
+
+def arrow_available() -> bool:
+    return pa is not None
+
+
+def _json_default(value: Any):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def encode_json(rows: Sequence[Mapping[str, Any]], columns: Columns) -> bytes:
+    """
+    Весь ответ одним JSON-массивом - сериализатором pydantic-core (тот же
+    формат, что у ответов FastAPI), но без моделей Pydantic на каждую строку.
+    """
+    names = [name for name, _ in columns]
+    return to_json([{name: row[name] for name in names} for row in rows])
+
+
+async def encode_ndjson(batches: RowBatches, columns: Columns) -> AsyncIterator[bytes]:
+    names = [name for name, _ in columns]
+    async for batch in batches:
+        yield "".join(
+            json.dumps({name: row[name] for name in names}, default=_json_default, ensure_ascii=False) + "\n"
+            for row in batch
+        ).encode()
+
+
+def _csv_cell(value: Any, kind: str) -> Any:
+    if value is None:
+        return ""
+    if kind == "tags":
+        return json.dumps(value, sort_keys=True, ensure_ascii=False)
+    if kind == "ts":
+        return value.isoformat()
+    return value
+
+
+async def encode_csv(batches: RowBatches, columns: Columns) -> AsyncIterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([name for name, _ in columns])
+    yield buffer.getvalue().encode()
+
+    async for batch in batches:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows([_csv_cell(row[name], kind) for name, kind in columns] for row in batch)
+        yield buffer.getvalue().encode()
+
+
+def _arrow_schema(columns: Columns):
+    types = {
+        "int": pa.int64(),
+        "float": pa.float64(),
+        "str": pa.string(),
+        "tags": pa.map_(pa.string(), pa.string()),
+        "ts": pa.timestamp("us", tz="UTC"),
+    }
+    return pa.schema([(name, types[kind]) for name, kind in columns])
+
+
+async def encode_arrow(batches: RowBatches, columns: Columns) -> AsyncIterator[bytes]:
+    """Arrow IPC stream: схема, затем по record batch на каждую пачку строк."""
+    schema = _arrow_schema(columns)
+    sink = io.BytesIO()
+    writer = pa.ipc.new_stream(sink, schema)
+
+    def flush() -> bytes:
+        chunk = sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+        return chunk
+
+    yield flush()
+    async for batch in batches:
+        arrays: Dict[str, List] = {name: [] for name, _ in columns}
+        for row in batch:
+            for name, kind in columns:
+                value = row[name]
+                arrays[name].append(list(value.items()) if kind == "tags" and value is not None else value)
+        writer.write_batch(pa.record_batch([arrays[name] for name, _ in columns], schema=schema))
+        yield flush()
+
+    writer.close()
+    yield flush()
+
+
+_ENCODERS = {
+    "ndjson": encode_ndjson,
+    "csv": encode_csv,
+    "arrow": encode_arrow,
+}
+
+
+def encode_rows(fmt: str, batches: RowBatches, columns: Columns) -> AsyncIterator[bytes]:
+    """Потоковый кодировщик пачек строк в формат fmt (ndjson / csv / arrow)."""
+    return _ENCODERS[fmt](batches, columns)
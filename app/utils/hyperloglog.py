@@ -0,0 +1,64 @@
+import math
+import os
+
+# Точность по умолчанию: 2^10 регистров, стандартная ошибка ~1.04/sqrt(m) = ~3.3%
+DEFAULT_PRECISION = int(os.getenv("HLL_PRECISION", "10"))
+
+_HASH_BITS = 64
+_HASH_MASK = (1 << _HASH_BITS) - 1
+
+
+def _alpha(m: int) -> float:
+    if m == 16:
+        return 0.673
+    if m == 32:
+        return 0.697
+    if m == 64:
+        return 0.709
+    return 0.7213 / (1 + 1.079 / m)
+
+
+class HyperLogLog:
+    """
+    Оценка числа различных значений в фиксированной памяти (2^precision байт).
+
+    Хеш - встроенный hash() строки: он рандомизирован на процесс, поэтому
+    скетч годится для оценок внутри процесса, но не для слияния между процессами.
+    """
+
+    __slots__ = ("precision", "m", "registers", "_value_bits")
+
+    def __init__(self, precision: int = DEFAULT_PRECISION):
+        if not 4 <= precision <= 16:
+            raise ValueError("precision must be in [4, 16]")
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = bytearray(self.m)
+        self._value_bits = _HASH_BITS - precision
+
+    def add(self, value: str):
+        h = hash(value) & _HASH_MASK
+        index = h >> self._value_bits
+        rest = h & ((1 << self._value_bits) - 1)
+        # Позиция первой единицы в оставшихся битах (1, если старший бит взведён)
+        rank = self._value_bits - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: "HyperLogLog"):
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge HyperLogLog sketches with different precision")
+        registers = self.registers
+        for i, rank in enumerate(other.registers):
+            if rank > registers[i]:
+                registers[i] = rank
+
+    def count(self) -> int:
+        m = self.m
+        estimate = _alpha(m) * m * m / sum(2.0 ** -r for r in self.registers)
+        if estimate <= 2.5 * m:
+            # Малые мощности: linear counting по пустым регистрам
+            zeros = self.registers.count(0)
+            if zeros:
+                estimate = m * math.log(m / zeros)
+        return int(round(estimate))
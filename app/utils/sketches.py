@@ -0,0 +1,196 @@
+import math
+import os
+import struct
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Относительная точность по умолчанию: оценка квантиля отличается
+# от истинного значения не более чем на 1%
+DEFAULT_RELATIVE_ACCURACY = float(os.getenv("SKETCH_RELATIVE_ACCURACY", "0.01"))
+
+# Значения по модулю меньше этого порога считаются нулём
+MIN_INDEXABLE_VALUE = 1e-9
+
+# Версия бинарного формата to_bytes()
+_FORMAT_VERSION = 1
+_HEADER = struct.Struct("<Bd")
+
+
+def _write_varint(out: bytearray, value: int):
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _zigzag(value: int) -> int:
+    return (value << 1) ^ (value >> 63)
+
+
+def _unzigzag(value: int) -> int:
+    return (value >> 1) ^ -(value & 1)
+
+
+def _write_bins(out: bytearray, bins: Dict[int, int]):
+    # Ключи пишем дельтами от предыдущего - соседние корзины дают 1-байтовые varint
+    _write_varint(out, len(bins))
+    prev = 0
+    for key in sorted(bins):
+        _write_varint(out, _zigzag(key - prev))
+        _write_varint(out, bins[key])
+        prev = key
+
+
+def _read_bins(data: bytes, pos: int) -> Tuple[Dict[int, int], int]:
+    n, pos = _read_varint(data, pos)
+    bins = {}
+    key = 0
+    for _ in range(n):
+        delta, pos = _read_varint(data, pos)
+        key += _unzigzag(delta)
+        bins[key], pos = _read_varint(data, pos)
+    return bins, pos
+
+
+class DDSketch:
+    """
+    Мёрджируемый скетч квантилей (DDSketch) с гарантией относительной ошибки.
+
+    Значение v > 0 попадает в корзину ceil(log_gamma(v)), где
+    gamma = (1 + a) / (1 - a). Оценка любого квантиля отличается от
+    истинного не более чем на долю a. Два скетча с одинаковой точностью
+    объединяются простым сложением счётчиков корзин.
+    """
+
+    __slots__ = ("relative_accuracy", "gamma", "_log_gamma", "positive", "negative", "zero_count", "count")
+
+    def __init__(self, relative_accuracy: float = DEFAULT_RELATIVE_ACCURACY):
+        if not 0 < relative_accuracy < 1:
+            raise ValueError("relative_accuracy must be in (0, 1)")
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.positive: Dict[int, int] = {}
+        self.negative: Dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def _key(self, value: float) -> int:
+        return math.ceil(math.log(value) / self._log_gamma)
+
+    def _value(self, key: int) -> float:
+        # Середина корзины (в относительном смысле) - даёт ошибку не больше relative_accuracy
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def add(self, value: float, weight: int = 1):
+        if value > MIN_INDEXABLE_VALUE:
+            key = self._key(value)
+            self.positive[key] = self.positive.get(key, 0) + weight
+        elif value < -MIN_INDEXABLE_VALUE:
+            key = self._key(-value)
+            self.negative[key] = self.negative.get(key, 0) + weight
+        else:
+            self.zero_count += weight
+        self.count += weight
+
+    def key_for(self, value: float) -> Tuple[int, int]:
+        """(знак, ключ корзины) для значения - то же, что считает SQL-пушдаун."""
+        if value > MIN_INDEXABLE_VALUE:
+            return 1, self._key(value)
+        if value < -MIN_INDEXABLE_VALUE:
+            return -1, self._key(-value)
+        return 0, 0
+
+    def add_bucket(self, sign: int, key: int, count: int):
+        """Добавляет готовую корзину (например, посчитанную в SQL через GROUP BY)."""
+        if sign > 0:
+            self.positive[key] = self.positive.get(key, 0) + count
+        elif sign < 0:
+            self.negative[key] = self.negative.get(key, 0) + count
+        else:
+            self.zero_count += count
+        self.count += count
+
+    def merge(self, other: "DDSketch"):
+        if other.gamma != self.gamma:
+            raise ValueError("Cannot merge sketches with different relative accuracy")
+        for key, cnt in other.positive.items():
+            self.positive[key] = self.positive.get(key, 0) + cnt
+        for key, cnt in other.negative.items():
+            self.negative[key] = self.negative.get(key, 0) + cnt
+        self.zero_count += other.zero_count
+        self.count += other.count
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Оценка квантиля q в [0, 1]; None для пустого скетча."""
+        if self.count == 0:
+            return None
+        if not 0 <= q <= 1:
+            raise ValueError("Quantile must be in [0, 1]")
+
+        rank = q * (self.count - 1)
+
+        # Отрицательные значения: от больших по модулю к меньшим
+        seen = 0
+        for key in sorted(self.negative, reverse=True):
+            seen += self.negative[key]
+            if seen > rank:
+                return -self._value(key)
+
+        seen += self.zero_count
+        if seen > rank:
+            return 0.0
+
+        for key in sorted(self.positive):
+            seen += self.positive[key]
+            if seen > rank:
+                return self._value(key)
+
+        return self._value(max(self.positive)) if self.positive else 0.0
+
+    def quantiles(self, qs: Iterable[float]) -> List[Optional[float]]:
+        return [self.quantile(q) for q in qs]
+
+    def to_bytes(self) -> bytes:
+        """
+        Компактная сериализация: заголовок (версия, точность), счётчик нуля
+        и корзины как varint-дельты ключей + varint-счётчики.
+        """
+        out = bytearray(_HEADER.pack(_FORMAT_VERSION, self.relative_accuracy))
+        _write_varint(out, self.zero_count)
+        _write_bins(out, self.positive)
+        _write_bins(out, self.negative)
+        return bytes(out)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "DDSketch":
+        version, relative_accuracy = _HEADER.unpack_from(data, 0)
+        if version != _FORMAT_VERSION:
+            raise ValueError(f"Unsupported sketch format version: {version}")
+
+        sketch = cls(relative_accuracy)
+        pos = _HEADER.size
+        sketch.zero_count, pos = _read_varint(data, pos)
+        sketch.positive, pos = _read_bins(data, pos)
+        sketch.negative, pos = _read_bins(data, pos)
+        sketch.count = sketch.zero_count + sum(sketch.positive.values()) + sum(sketch.negative.values())
+        return sketch
+
+    def copy(self) -> "DDSketch":
+        clone = DDSketch(self.relative_accuracy)
+        clone.merge(self)
+        return clone
+
+    def __len__(self) -> int:
+        return self.count
@@ -0,0 +1,121 @@
+"""
+Бенчмарк сжатых блоков (app.core.blocks): байт на точку и скорость
+кодирования/декодирования против строки в куче metrics.
+
+Запуск:
+    python -m benchmarks.bench_blocks                    # только Python, без БД
+    python -m benchmarks.bench_blocks --db               # + реальные размеры таблиц на DATABASE_URL
+    python -m benchmarks.bench_blocks --points 3600 --interval 10
+
+Без --db ряды синтетические: точка раз в interval секунд с дрожанием
+времени приёма, id - общая последовательность нескольких серий. С --db -
+pg_total_relation_size (куча, TOAST и индексы) metrics и metric_blocks,
+поделённый на число точек в каждой.
+"""
+import argparse
+import asyncio
+import math
+import random
+import time
+from typing import Callable, Dict, List
+
+from app.core.blocks import Sample, decode_block, encode_block
+
+# Оценка строки metrics: заголовок кортежа и указатель (~28 байт), id + series_id +
+# value + timestamp с выравниванием (32), записи трёх индексов (pkey, ix_metrics_timestamp,
+# ix_metrics_series_ts) по ~20-24 байта и заполнение страниц
+HEAP_BYTES_PER_ROW_ESTIMATE = 130
+
+SHAPES: Dict[str, Callable[[int], float]] = {
+    "constant": lambda i: 1.0,
+    "counter": lambda i: float(i * 17),
+    "gauge_2dp": lambda i: round(50 + 20 * math.sin(i / 60) + random.random(), 2),
+    "latency_ms": lambda i: random.lognormvariate(3, 1),
+}
+
+
+class _Block:
+    """Строка блока: атрибуты, как у записи из БД."""
+
+    def __init__(self, columns: Dict):
+        self.__dict__.update(columns)
+
+
+def _series(points: int, interval: float, shape: Callable[[int], float], writers: int) -> List[Sample]:
+    start_us = 1_760_000_000_000_000
+    next_id = 1
+    samples = []
+    for i in range(points):
+        # Время сервера: шаг отправки плюс задержка буфера приёма
+        ts_us = start_us + int(i * interval * 1_000_000) + random.randint(0, 50_000)
+        samples.append((ts_us, next_id, shape(i)))
+        # Между точками серии в общую последовательность пишут другие серии
+        next_id += random.randint(1, writers)
+    samples.sort()
+    return samples
+
+
+def bench_python(points: int, interval: float, writers: int):
+    print(f"== Python: {points} points per block, interval {interval}s, ~{writers} writers")
+    for name, shape in SHAPES.items():
+        samples = _series(points, interval, shape, writers)
+
+        started = time.perf_counter()
+        columns = encode_block(samples)
+        encode_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        decoded = decode_block(_Block(columns))
+        decode_seconds = time.perf_counter() - started
+        assert decoded == samples
+
+        size = len(columns["ts_data"]) + len(columns["value_data"]) + len(columns["id_data"])
+        print(
+            f"{name:<11} {size / points:6.2f} B/point "
+            f"(ts {len(columns['ts_data']) / points:5.2f}, value {len(columns['value_data']) / points:5.2f}, "
+            f"id {len(columns['id_data']) / points:5.2f}) | "
+            f"{HEAP_BYTES_PER_ROW_ESTIMATE / (size / points):5.1f}x vs heap | "
+            f"encode {encode_seconds / points * 1e6:5.2f} us/pt, decode {decode_seconds / points * 1e6:5.2f} us/pt"
+        )
+
+
+async def bench_db():
+    from sqlalchemy import text
+    from app.core.db import get_engine, close_db
+
+    print("\n== Postgres: bytes per point on disk (heap + TOAST + indexes)")
+    async with get_engine("background").connect() as conn:
+        heap_rows = (await conn.execute(text("SELECT count(*) FROM metrics"))).scalar()
+        heap_bytes = (await conn.execute(text(
+            "SELECT COALESCE(sum(pg_total_relation_size(c.oid)), 0) FROM pg_class c "
+            "WHERE c.relname = 'metrics' OR c.oid IN (SELECT inhrelid FROM pg_inherits "
+            "WHERE inhparent = 'metrics'::regclass)"
+        ))).scalar()
+        block_points = (await conn.execute(text("SELECT COALESCE(sum(sample_count), 0) FROM metric_blocks"))).scalar()
+        block_bytes = (await conn.execute(text("SELECT pg_total_relation_size('metric_blocks')"))).scalar()
+
+    heap_per_row = heap_bytes / heap_rows if heap_rows else None
+    block_per_point = block_bytes / block_points if block_points else None
+    print(f"metrics        {heap_rows:>12} rows   " + (f"{heap_per_row:8.1f} B/row" if heap_per_row else "-"))
+    print(f"metric_blocks  {block_points:>12} points " + (f"{block_per_point:8.1f} B/point" if block_per_point else "-"))
+    if heap_per_row and block_per_point:
+        print(f"reduction      {heap_per_row / block_per_point:.1f}x")
+    await close_db()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--points", type=int, default=3600, help="точек в блоке")
+    parser.add_argument("--interval", type=float, default=1.0, help="шаг отправки точек, с")
+    parser.add_argument("--writers", type=int, default=50, help="серий, пишущих в общую последовательность id")
+    parser.add_argument("--db", action="store_true", help="также замерить таблицы на DATABASE_URL")
+    args = parser.parse_args()
+
+    random.seed(42)
+    bench_python(args.points, args.interval, args.writers)
+    if args.db:
+        asyncio.run(bench_db())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+Бенчмарк накладных расходов на запрос: ORM / Core через сессию против
+подготовленных запросов на сыром asyncpg-соединении (app.core.fastpath).
+
+Запуск:
+    python -m benchmarks.bench_fastpath                  # только Python, без БД
+    python -m benchmarks.bench_fastpath --db             # + горячие запросы на DATABASE_URL
+    python -m benchmarks.bench_fastpath --db --repeats 500 --rows 2000
+
+Без --db сравнивается то, что не зависит от Postgres: сборка select() на
+каждый вызов против готового SQL и сериализация ответа /history через
+MetricRead против записей. С --db - время одного запроса целиком
+(checkout соединения, выполнение, разбор результата) для синхронного
+приёма, истории одной серии и агрегатов окна.
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, List
+
+from pydantic import TypeAdapter
+
+from app.schemas.metric import MetricRead
+from app.utils.history_formats import RAW_COLUMNS, encode_json
+
+
+def _report(name: str, timings: List[float]):
+    timings = sorted(timings)
+    p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+    print(f"{name:<34} median {statistics.median(timings) * 1e6:9.1f} us | p99 {p99 * 1e6:9.1f} us")
+
+
+def _time_sync(fn: Callable[[], object], repeats: int) -> List[float]:
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+async def _time_async(fn: Callable[[], Awaitable[object]], repeats: int) -> List[float]:
+    await fn()  # прогрев: соединение, PREPARE, кэш компиляции
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        await fn()
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def bench_python(rows: int, repeats: int):
+    from sqlalchemy.dialects.postgresql import asyncpg as asyncpg_dialect
+    from app.utils.aggregators import _aggregate_statement, _prepared_aggregate
+
+    print(f"== Python: {repeats} repeats, {rows} history rows")
+    dialect = asyncpg_dialect.dialect()
+    since = datetime.now(timezone.utc)
+
+    _report("aggregate select() + compile", _time_sync(
+        lambda: str(_aggregate_statement(("region",), True, since).compile(dialect=dialect)), repeats
+    ))
+    _report("aggregate prepared (cached SQL)", _time_sync(
+        lambda: _prepared_aggregate(("region",), True, False).args({"since": since}), repeats
+    ))
+
+    now = datetime.now(timezone.utc)
+    records = [
+        {
+            "id": i,
+            "service_name": "api-gateway",
+            "metric_name": "latency_ms",
+            "value": random.lognormvariate(3, 1),
+            "tags": {"region": "eu-west", "env": "production"},
+            "timestamp": now - timedelta(milliseconds=i),
+        }
+        for i in range(rows)
+    ]
+    # Так ответ собирает FastAPI: модель на строку, проверка response_model и сериализация
+    adapter = TypeAdapter(List[MetricRead])
+    orm_repeats = max(1, repeats // 10)
+    _report("history: MetricRead per row + dump", _time_sync(
+        lambda: adapter.dump_json(adapter.validate_python([MetricRead.model_validate(r) for r in records])),
+        orm_repeats
+    ))
+    _report("history: records -> encode_json", _time_sync(
+        lambda: encode_json(records, RAW_COLUMNS), orm_repeats
+    ))
+
+
+async def bench_db(rows: int, repeats: int):
+    from sqlalchemy import select
+    from app.core.db import async_session_maker, close_db
+    from app.core.fastpath import fetch_history, insert_metric
+    from app.core.series import series_registry
+    from app.models.metric import Metric
+    from app.models.series import Series
+    from app.schemas.metric import MetricCreate
+    from app.utils.aggregators import aggregate_last_window
+    import app.utils.aggregators as aggregators
+    import app.core.fastpath as fastpath
+
+    print(f"\n== Postgres: {repeats} repeats")
+    adapter = TypeAdapter(List[MetricRead])
+    metric = MetricCreate(service_name="bench", metric_name="fastpath_ms", value=1.0, tags={"bench": "fastpath"})
+    series_id = await series_registry.resolve(metric)
+    since = datetime.now(timezone.utc) - timedelta(hours=1)
+
+    async def orm_insert():
+        async with async_session_maker() as session:
+            db_metric = Metric(series_id=series_id, value=random.random())
+            session.add(db_metric)
+            await session.commit()
+            await session.refresh(db_metric)
+
+    async def raw_insert():
+        await insert_metric(series_id, random.random())
+
+    results: Dict[str, List[float]] = {}
+    results["ingest: add + commit + refresh"] = await _time_async(orm_insert, repeats)
+    results["ingest: INSERT ... RETURNING"] = await _time_async(raw_insert, repeats)
+
+    async def orm_history():
+        async with async_session_maker() as session:
+            query = select(
+                Metric.id, Series.service_name, Series.metric_name, Metric.value, Series.tags, Metric.timestamp
+            ).join(Series, Series.id == Metric.series_id).where(
+                Metric.series_id == series_id, Metric.timestamp >= since
+            ).order_by(Metric.timestamp, Metric.id).limit(rows)
+            result = await session.execute(query)
+            adapter.dump_json(adapter.validate_python([MetricRead.model_validate(row._mapping) for row in result]))
+
+    async def raw_history():
+        encode_json(await fetch_history([series_id], since, limit=rows), RAW_COLUMNS)
+
+    results["history: ORM + MetricRead"] = await _time_async(orm_history, repeats)
+    results["history: prepared + encode_json"] = await _time_async(raw_history, repeats)
+
+    async def aggregate(enabled: bool):
+        aggregators.FASTPATH_ENABLED = enabled
+        await aggregate_last_window(window_seconds=60, group_by_tags=["bench"])
+
+    results["aggregate: session + select()"] = await _time_async(lambda: aggregate(False), repeats)
+    results["aggregate: prepared"] = await _time_async(lambda: aggregate(True), repeats)
+    aggregators.FASTPATH_ENABLED = fastpath.FASTPATH_ENABLED
+
+    for name, timings in results.items():
+        _report(name, timings)
+    await close_db()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000, help="строк в ответе /history")
+    parser.add_argument("--repeats", type=int, default=200)
+    parser.add_argument("--db", action="store_true", help="также замерить запросы на DATABASE_URL")
+    args = parser.parse_args()
+
+    random.seed(42)
+    bench_python(args.rows, args.repeats)
+    if args.db:
+        asyncio.run(bench_db(args.rows, args.repeats))
+
+
+if __name__ == "__main__":
+    main()
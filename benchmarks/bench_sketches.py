@@ -0,0 +1,125 @@
+"""
+Бенчмарк DDSketch против точных перцентилей.
+
+Запуск:
+    python -m benchmarks.bench_sketches                 # только Python, без БД
+    python -m benchmarks.bench_sketches --db            # + сравнение SQL-путей на DATABASE_URL
+    python -m benchmarks.bench_sketches --accuracy 0.005 --samples 1000000
+
+Режим --db сравнивает aggregate_last_window(percentile_mode="exact")
+(percentile_cont ... WITHIN GROUP) и percentile_mode="sketch"
+(GROUP BY по корзинам) на данных, уже лежащих в таблице metrics.
+"""
+import argparse
+import asyncio
+import random
+import time
+from typing import Callable, Dict, List
+
+from app.utils.sketches import DDSketch
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+DISTRIBUTIONS: Dict[str, Callable[[], float]] = {
+    "lognormal": lambda: random.lognormvariate(3, 1),
+    "normal": lambda: random.gauss(100, 15),
+    "uniform": lambda: random.uniform(0, 1000),
+    "bimodal": lambda: random.gauss(20, 2) if random.random() < 0.9 else random.gauss(800, 50),
+}
+
+
+def exact_quantile(sorted_values: List[float], q: float) -> float:
+    """Линейная интерполяция, как percentile_cont в Postgres."""
+    pos = q * (len(sorted_values) - 1)
+    lo = int(pos)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (pos - lo)
+
+
+def bench_python(samples: int, accuracy: float, partitions: int):
+    print(f"== Python: {samples} samples, relative accuracy {accuracy}, merge of {partitions} partial sketches")
+    print(f"{'distribution':<10} {'q':>5} {'exact':>12} {'sketch':>12} {'rel.err':>9}")
+
+    for name, gen in DISTRIBUTIONS.items():
+        values = [gen() for _ in range(samples)]
+
+        started = time.perf_counter()
+        ordered = sorted(values)
+        exact = [exact_quantile(ordered, q) for q in QUANTILES]
+        exact_time = time.perf_counter() - started
+
+        # Скетчи строятся по частям (как под-окна/воркеры) и сливаются
+        started = time.perf_counter()
+        chunk = len(values) // partitions + 1
+        parts = []
+        for i in range(partitions):
+            part = DDSketch(accuracy)
+            for v in values[i * chunk:(i + 1) * chunk]:
+                part.add(v)
+            parts.append(part)
+        build_time = time.perf_counter() - started
+
+        started = time.perf_counter()
+        merged = DDSketch(accuracy)
+        for part in parts:
+            merged.merge(part)
+        estimated = merged.quantiles(QUANTILES)
+        merge_time = time.perf_counter() - started
+
+        for q, e, s in zip(QUANTILES, exact, estimated):
+            print(f"{name:<10} {q:>5} {e:>12.4f} {s:>12.4f} {abs(s - e) / abs(e):>9.4%}")
+
+        blob = merged.to_bytes()
+        assert DDSketch.from_bytes(blob).quantiles(QUANTILES) == estimated
+        print(
+            f"{'':<10} sort+exact {exact_time * 1000:.1f} ms | sketch build {build_time * 1000:.1f} ms, "
+            f"merge+query {merge_time * 1000:.2f} ms | serialized {len(blob)} B vs raw {samples * 8} B"
+        )
+
+
+async def bench_db(repeats: int):
+    from app.utils.aggregators import aggregate_last_window
+
+    print(f"\n== Postgres: aggregate_last_window, best of {repeats}")
+    results = {}
+    for mode in ("exact", "sketch"):
+        timings = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            results[mode] = await aggregate_last_window(
+                window_seconds=3600,
+                group_by_tags=["region"],
+                percentile_mode=mode
+            )
+            timings.append(time.perf_counter() - started)
+        print(f"{mode:<7} {min(timings) * 1000:8.1f} ms, groups: {len(results[mode])}")
+
+    exact_by_key = {(a["service_name"], a["metric_name"], tuple(a["tags"].items())): a for a in results["exact"]}
+    worst = 0.0
+    for agg in results["sketch"]:
+        exact = exact_by_key.get((agg["service_name"], agg["metric_name"], tuple(agg["tags"].items())))
+        if not exact:
+            continue
+        for q in ("p50", "p95", "p99"):
+            if exact[q] and agg[q] is not None:
+                worst = max(worst, abs(agg[q] - exact[q]) / abs(exact[q]))
+    print(f"max relative error vs percentile_cont: {worst:.4%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--samples", type=int, default=200_000)
+    parser.add_argument("--accuracy", type=float, default=0.01)
+    parser.add_argument("--partitions", type=int, default=30)
+    parser.add_argument("--db", action="store_true", help="также сравнить SQL-пути на DATABASE_URL")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    random.seed(42)
+    bench_python(args.samples, args.accuracy, args.partitions)
+    if args.db:
+        asyncio.run(bench_db(args.repeats))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Бенчмарк хранилищ (app.storage): точек в секунду на приёме и стоимость
+чтения у встроенного хранилища; с --db - та же запись в Postgres.
+
+Запуск:
+    python -m benchmarks.bench_storage                        # встроенное, во временном каталоге
+    python -m benchmarks.bench_storage --series 1000 --batch 10000 --samples 5000000
+    python -m benchmarks.bench_storage --wal-sync always      # fsync на каждую пачку
+    python -m benchmarks.bench_storage --db                   # + PostgresStorage на DATABASE_URL
+
+append - пачки уже известных серий (series_id), как у встроенного приёмника
+или генератора нагрузки; write - пачки MetricCreate с резолвом серий, как
+у /batch и буфера приёма. Сегменты пишутся принудительным seal().
+"""
+import argparse
+import asyncio
+import random
+import shutil
+import tempfile
+import time
+from array import array
+from datetime import datetime, timedelta, timezone
+
+from app.schemas.metric import MetricCreate
+from app.storage.embedded import EmbeddedStorage
+
+
+def _metrics(series: int, count: int):
+    return [
+        MetricCreate(
+            service_name="bench",
+            metric_name=f"metric_{i % 10}",
+            value=round(random.random() * 100, 2),
+            tags={"host": f"host-{i % series}"},
+        )
+        for i in range(count)
+    ]
+
+
+async def bench_embedded(series: int, batch: int, samples: int, wal_sync: str):
+    path = tempfile.mkdtemp(prefix="bench_storage_")
+    print(f"== Embedded ({path}, WAL sync: {wal_sync}): {series} series, batches of {batch}")
+    storage = EmbeddedStorage(path=path, wal_sync=wal_sync)
+    try:
+        await storage.start()
+        metrics = _metrics(series, batch)
+        series_ids = array("q", [storage.series_id(m.service_name, m.metric_name, m.tags) for m in metrics])
+        values = array("d", [m.value for m in metrics])
+
+        started = time.perf_counter()
+        for _ in range(samples // batch):
+            await storage.append(series_ids, values)
+        append_seconds = time.perf_counter() - started
+        appended = samples // batch * batch
+        print(f"append      {appended / append_seconds:>12,.0f} samples/s")
+
+        rounds = max(samples // batch // 10, 1)
+        started = time.perf_counter()
+        for _ in range(rounds):
+            await storage.write(metrics)
+        write_seconds = time.perf_counter() - started
+        print(f"write       {rounds * batch / write_seconds:>12,.0f} samples/s (MetricCreate, series lookup)")
+
+        since = datetime.now(timezone.utc) - timedelta(minutes=5)
+        started = time.perf_counter()
+        rows = await storage.history("bench", "metric_0", {"host": "host-0"}, since)
+        print(f"history     {(time.perf_counter() - started) * 1000:>12.1f} ms for {len(rows)} points (head)")
+
+        # Всё, что в голове, - в сегмент
+        started = time.perf_counter()
+        await storage.seal(now_us=time.time_ns() // 1000 + storage.segment_us)
+        seal_seconds = time.perf_counter() - started
+        total = sum(s.samples for s in storage._segments)
+        size = sum(s.size for s in storage._segments)
+        print(f"seal        {total / seal_seconds:>12,.0f} samples/s, {size / total:.2f} B/point on disk")
+
+        started = time.perf_counter()
+        rows = await storage.history("bench", "metric_0", {"host": "host-0"}, since)
+        print(f"history     {(time.perf_counter() - started) * 1000:>12.1f} ms for {len(rows)} points (segment)")
+
+        started = time.perf_counter()
+        aggregates = await storage.aggregate(300, ["host"])
+        print(f"aggregate   {(time.perf_counter() - started) * 1000:>12.1f} ms for {len(aggregates)} groups")
+    finally:
+        await storage.stop()
+        shutil.rmtree(path, ignore_errors=True)
+
+
+async def bench_db(series: int, batch: int, samples: int):
+    from app.core.db import close_db
+    from app.storage.postgres import PostgresStorage
+
+    print(f"\n== Postgres: {series} series, batches of {batch}")
+    storage = PostgresStorage()
+    metrics = _metrics(series, batch)
+    await storage.write(metrics)  # регистрация серий
+
+    rounds = max(samples // batch // 10, 1)
+    started = time.perf_counter()
+    for _ in range(rounds):
+        await storage.write(metrics)
+    print(f"write       {rounds * batch / (time.perf_counter() - started):>12,.0f} samples/s (COPY)")
+    await close_db()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--series", type=int, default=1000, help="число серий")
+    parser.add_argument("--batch", type=int, default=10000, help="точек в пачке")
+    parser.add_argument("--samples", type=int, default=2_000_000, help="точек в замере append")
+    parser.add_argument("--wal-sync", default="interval", choices=("always", "interval", "none"))
+    parser.add_argument("--db", action="store_true", help="также замерить запись в Postgres на DATABASE_URL")
+    args = parser.parse_args()
+
+    random.seed(42)
+    asyncio.run(bench_embedded(args.series, args.batch, args.samples, args.wal_sync))
+    if args.db:
+        asyncio.run(bench_db(args.series, args.batch, args.samples))
+
+
+if __name__ == "__main__":
+    main()
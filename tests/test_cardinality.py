@@ -0,0 +1,64 @@
+from app.core.cardinality import OTHER_KEY, OTHER_VALUE, CardinalityGuard
+from app.schemas.metric import MetricCreate
+
+
+def _metric(tags):
+    return MetricCreate(service_name="api", metric_name="requests", value=1.0, tags=tags)
+
+
+def _guard(**kwargs):
+    options = dict(
+        max_series_per_metric=50,
+        max_tag_keys=4,
+        max_tag_values=100,
+        tag_limits={},
+        tag_actions={},
+        default_action="other",
+        enabled=True,
+    )
+    options.update(kwargs)
+    return CardinalityGuard(**options)
+
+
+def test_rotating_keys_keep_state_and_series_bounded():
+    guard = _guard()
+    label_sets = set()
+    for i in range(5000):
+        # Ключ на каждый запрос - классическая ошибка клиента
+        metric = guard.apply(_metric({"region": "eu", f"req_{i}": "1"}))
+        label_sets.add(tuple(sorted(metric.tags.items())))
+
+    state = guard.metrics[("api", "requests")]
+    assert len(state.tags) <= guard.max_tag_keys
+    assert len(state.series) <= guard.max_series_per_metric + 1
+    assert len(label_sets) <= guard.max_series_per_metric + 1
+    # Ключи сверх лимита слиты в один служебный
+    assert metric.tags == {"region": "eu", OTHER_KEY: OTHER_VALUE}
+
+
+def test_rotating_keys_and_values_after_series_limit():
+    guard = _guard(max_series_per_metric=10, max_tag_keys=100)
+    label_sets = set()
+    for i in range(2000):
+        metric = guard.apply(_metric({f"k{i % 7}": str(i), f"req_{i}": str(i)}))
+        label_sets.add(tuple(sorted(metric.tags.items())))
+
+    state = guard.metrics[("api", "requests")]
+    assert len(state.series) <= 11
+    assert len(label_sets) <= 11
+    # После исчерпания лимита серий новые ключи состояния не получают
+    assert len(state.tags) < 100
+
+
+def test_drop_action_removes_keys_over_limit():
+    guard = _guard(default_action="drop", max_tag_keys=2)
+    guard.apply(_metric({"a": "1", "b": "1"}))
+    metric = guard.apply(_metric({"a": "1", "c": "1"}))
+    assert metric.tags == {"a": "1"}
+    assert set(guard.metrics[("api", "requests")].tags) == {"a", "b"}
+
+
+def test_known_keys_pass_unchanged():
+    guard = _guard()
+    metric = _metric({"region": "eu", "host": "a"})
+    assert guard.apply(metric) is metric
@@ -0,0 +1,115 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from app.core import rollups
+from app.core.blocks import to_micros
+from app.core.rollups import choose_level, query_rollup_history
+from app.core.stream_aggregator import WindowStats
+from app.utils.sketches import DDSketch
+
+
+def _stats(*values):
+    stats = WindowStats()
+    for value in values:
+        stats.add(value)
+    return stats
+
+
+def test_choose_level_requires_step_multiple():
+    assert choose_level(30) is None
+    assert choose_level(60).name == "1m"
+    # 90s поверх 1m: бакет 1m разрезался бы границей шага
+    assert choose_level(90) is None
+    assert choose_level(120).name == "1m"
+    assert choose_level(300).name == "5m"
+    assert choose_level(5400).name == "5m"
+    assert choose_level(7200).name == "1h"
+
+
+def test_step_not_multiple_of_level_uses_raw_buckets(monkeypatch):
+    since = datetime(2026, 10, 16, 12, 0, 30, tzinfo=timezone.utc)
+    until = since + timedelta(minutes=9)
+    calls = []
+
+    async def fail_rollup(*args, **kwargs):
+        raise AssertionError("rollup level must not be used for a 90s step")
+
+    async def raw_buckets(session, start, end, step_seconds, *args, by_series=True):
+        calls.append((start, end, step_seconds, by_series))
+        return {start: _stats(1.0, 3.0), start + timedelta(seconds=step_seconds): _stats(5.0)}
+
+    monkeypatch.setattr(rollups, "get_watermark", fail_rollup)
+    monkeypatch.setattr(rollups, "load_rollup_buckets", fail_rollup)
+    monkeypatch.setattr(rollups, "aggregate_raw_buckets", raw_buckets)
+
+    points = asyncio.run(query_rollup_history(None, "api", "latency", None, since, until, 90))
+
+    aligned = datetime(2026, 10, 16, 12, 0, 0, tzinfo=timezone.utc)
+    assert calls == [(aligned, until, 90, False)]
+    assert [p["timestamp"] for p in points] == [aligned, aligned + timedelta(seconds=90)]
+    assert [p["count"] for p in points] == [2, 1]
+    assert points[0]["avg_value"] == 2.0
+
+
+def test_step_multiple_of_level_reads_rollup(monkeypatch):
+    since = datetime(2026, 10, 16, 12, 0, tzinfo=timezone.utc)
+    until = since + timedelta(minutes=10)
+    levels = []
+
+    async def watermark(session, level_name):
+        return until
+
+    async def rollup_buckets(session, level, start, end, step_seconds, *args, by_series=True):
+        levels.append(level.name)
+        return {start: _stats(2.0)}
+
+    async def fail_raw(*args, **kwargs):
+        raise AssertionError("closed range must be served from the rollup")
+
+    monkeypatch.setattr(rollups, "get_watermark", watermark)
+    monkeypatch.setattr(rollups, "load_rollup_buckets", rollup_buckets)
+    monkeypatch.setattr(rollups, "aggregate_raw_buckets", fail_raw)
+
+    points = asyncio.run(query_rollup_history(None, "api", "latency", None, since, until, 120))
+
+    assert levels == ["1m"]
+    assert [p["count"] for p in points] == [1]
+
+
+def test_step_below_minimum_level_returns_none():
+    assert asyncio.run(query_rollup_history(None, "api", "latency", None, None, None, 30)) is None
+
+
+def test_raw_buckets_include_block_samples(monkeypatch):
+    since = datetime(2026, 10, 15, 12, 0, tzinfo=timezone.utc)
+    until = since + timedelta(seconds=270)
+    heap_bucket = since + timedelta(seconds=180)
+
+    class HeapRow:
+        bucket = heap_bucket
+        sk_sign, sk_key = DDSketch().key_for(7.0)
+        count, total, min_value, max_value = 1, 7.0, 7.0, 7.0
+
+    class Session:
+        async def execute(self, query):
+            return [HeapRow()]
+
+    async def restrict(session, query, *args, **kwargs):
+        return query
+
+    async def block_samples(session, start, end, *args):
+        assert (start, end) == (since, until)
+        # Начало диапазона уже сжато в блоки и удалено из metrics
+        return {1: [(to_micros(since + timedelta(seconds=10)), 1, 1.0),
+                    (to_micros(since + timedelta(seconds=100)), 2, 3.0),
+                    (to_micros(since + timedelta(seconds=170)), 3, 5.0)]}
+
+    monkeypatch.setattr(rollups, "restrict_to_series", restrict)
+    monkeypatch.setattr(rollups, "load_block_samples", block_samples)
+
+    points = asyncio.run(query_rollup_history(Session(), "api", "latency", None, since, until, 90))
+
+    assert [p["timestamp"] for p in points] == [since, since + timedelta(seconds=90), heap_bucket]
+    assert [p["count"] for p in points] == [1, 2, 1]
+    assert points[1]["avg_value"] == 4.0
+    assert points[2]["max_value"] == 7.0